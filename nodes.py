@@ -3,8 +3,6 @@ import comfy
 import json
 import os
 import numpy as np
-from PIL import Image
-import torchvision.transforms as transforms
 from typing import Dict, List, Tuple, Any, Optional
 import folder_paths
 
@@ -14,7 +12,25 @@ os.makedirs(CONFIG_DIR, exist_ok=True)
 
 # 工具导入
 from .utils.variable_processor import variable_processor
+from .utils.clip_analyzer import clip_analyzer
+from .utils.template_registry import template_registry
+from .utils.text_embeddings import text_embedding_bank
+from .utils.embedding_store import get_embedding_store, hash_images
+from .utils.inference_runtime import RUNTIME_BACKENDS, PRECISION_MODES, export_vision_encoder, checkpoint_hash
 from .utils.label_generator import LabelGenerator
+from .utils.analysis_result import AnalysisResult
+from .utils.image_preprocess import image_preprocessor, CLIP_MEAN, CLIP_STD
+from .utils.sequence_labeler import sequence_labeler, SIGNATURE_METHODS
+from .utils.multi_crop import multi_crop_analyzer
+from .utils.combination_enumerator import CombinationEnumerator, shard_range
+from .utils.weighted_sampler import weighted_sampler
+from .utils.caption_writer import get_caption_writer, MERGE_MODES
+from .utils.prompt_extractor import prompt_extractor, MERGE_POLICIES
+from .utils.tag_statistics import get_tag_statistics
+from .utils.results_store import get_results_store, records_from_batch
+
+# 选择器中表示"不指定该变量"的选项（默认值）：不写入选择器输出，提示词解析的补充模式会填写这些变量
+UNSET_OPTION = "未指定"
 
 
 class CLIPVisionLoaderWrapper:
@@ -25,6 +41,19 @@ class CLIPVisionLoaderWrapper:
         return {
             "required": {
                 "clip_name": (folder_paths.get_filename_list("clip_vision"),),
+            },
+            "optional": {
+                # CPU推理运行时：eager 为原生PyTorch；torchscript/onnx 会导出一次并缓存到磁盘
+                "cpu_runtime": (list(RUNTIME_BACKENDS), {"default": "eager"}),
+                # 推理精度：float32、bf16 autocast、int8 动态量化（Linear层，CPU）
+                "precision": (list(PRECISION_MODES), {"default": "float32"}),
+                "intra_op_threads": ("INT", {"default": 0, "min": 0, "max": 256, "step": 1}),
+                "inter_op_threads": ("INT", {"default": 0, "min": 0, "max": 256, "step": 1}),
+                # 同时进行的模型推理数，0 表示按设备自动选择
+                "max_concurrent_inference": ("INT", {"default": 0, "min": 0, "max": 64, "step": 1}),
+                # 配套的CLIP文本塔（transformers 模型名或本地目录），用于计算真实的CLIP分数
+                # 例如 openai/clip-vit-large-patch14；留空时CLIP分数为随机模拟数据
+                "text_encoder": ("STRING", {"default": "", "multiline": False}),
             }
         }
     
@@ -33,10 +62,33 @@ class CLIPVisionLoaderWrapper:
     FUNCTION = "load_clip"
     CATEGORY = "character_labeler/clip"
     
-    def load_clip(self, clip_name):
+    def load_clip(self, clip_name, cpu_runtime="eager", precision="float32", intra_op_threads=0, inter_op_threads=0,
+                  max_concurrent_inference=0, text_encoder=""):
         from comfy.clip_vision import load_clipvision
         clip_path = folder_paths.get_full_path("clip_vision", clip_name)
         clip_vision = load_clipvision(clip_path)
+        clip_vision.precision = precision
+
+        # int8 量化模型只在CPU上运行
+        device = "cpu" if precision == "int8" else getattr(clip_vision, "load_device", None)
+        clip_analyzer.configure_concurrency(max_concurrent_inference, intra_op_threads, inter_op_threads, device)
+
+        if text_encoder and text_encoder.strip():
+            clip_analyzer.use_transformers_text_encoder(text_encoder.strip())
+        elif clip_analyzer.text_encoder_key is None:
+            # 代码中通过 set_text_encoder 设置的编码器同样有效，只在完全没有编码器时提示
+            print("⚠️ 未设置CLIP文本编码器，CLIP分析将输出随机模拟分数")
+        # 提示词模板文件在加载模型时检查一次，打分时不再读取
+        text_embedding_bank.refresh()
+        
+        # 检查点指纹：嵌入存储按它区分模型，量化模型也按它缓存
+        clip_vision.checkpoint_key = checkpoint_hash(clip_path)
+        
+        if cpu_runtime != "eager" and precision == "float32":
+            # 导出失败时返回 None，编码器继续使用 eager 模式
+            clip_vision.exported_encoder = export_vision_encoder(
+                clip_vision, clip_path, cpu_runtime, intra_op_threads, inter_op_threads,
+                checkpoint_key=clip_vision.checkpoint_key)
         return (clip_vision,)
 
 
@@ -49,6 +101,12 @@ class CLIPVisionEncodeWrapper:
             "required": {
                 "clip_vision": ("CLIP_VISION",),
                 "image": ("IMAGE",),
+            },
+            "optional": {
+                # 嵌入存储目录：留空则不缓存；填写后已编码过的图像直接从磁盘读取
+                "embedding_store": ("STRING", {"default": "", "multiline": False}),
+                # 推理精度，auto 表示沿用加载器中的设置
+                "precision": (["auto"] + list(PRECISION_MODES), {"default": "auto"}),
             }
         }
     
@@ -57,12 +115,32 @@ class CLIPVisionEncodeWrapper:
     FUNCTION = "encode"
     CATEGORY = "character_labeler/clip"
     
-    def encode(self, clip_vision, image):
+    def encode(self, clip_vision, image, embedding_store="", precision="auto"):
         # 这里使用ComfyUI的CLIP视觉编码器
-        # 注意：实际上ComfyUI的CLIP视觉编码器输出可能需要特殊处理
-        # 这里我们返回一个模拟的CLIP视觉特征
+        # 批量预处理：整批一次插值 + 融合归一化，直接作用于 [B, H, W, C] 张量
+        pixel_values = image_preprocessor.preprocess(
+            image,
+            size=getattr(clip_vision, "image_size", 224),
+            mean=getattr(clip_vision, "image_mean", CLIP_MEAN),
+            std=getattr(clip_vision, "image_std", CLIP_STD)
+        )
+        
+        precision = None if precision == "auto" else precision
+        image_hashes = hash_images(image)
+        if embedding_store and embedding_store.strip():
+            # 按模型、预处理参数和精度分目录，切换任一项都不会读到旧的嵌入
+            store = get_embedding_store(embedding_store.strip(),
+                                        clip_analyzer.encoder_fingerprint(clip_vision, precision))
+            image_features = clip_analyzer.encode_with_store(clip_vision, pixel_values, image_hashes, store, precision)
+        else:
+            image_features = clip_analyzer.encode_pixels(clip_vision, pixel_values, precision)
+        
         output = {
-            "image_features": image.mean(dim=[1, 2, 3], keepdim=True),  # 简化处理
+            "image_features": image_features,
+            "image_hashes": image_hashes,
+            "pixel_values": pixel_values,
+            # 原始图像（引用，不复制），供多区域分析裁剪
+            "images": image,
             "clip_vision": clip_vision
         }
         return (output,)
@@ -77,76 +155,157 @@ class CLIPImageAnalyzer:
             "required": {
                 "clip_vision_output": ("CLIP_VISION_OUTPUT",),
                 "confidence_threshold": ("FLOAT", {"default": 0.7, "min": 0.0, "max": 1.0, "step": 0.01}),
-                "analysis_mode": (["快速分析", "详细分析"], {"default": "快速分析"}),
+                "analysis_mode": (["快速分析", "详细分析", "自适应分析", "多区域分析"], {"default": "快速分析"}),
+            },
+            "optional": {
+                # 自适应分析的延迟预算（毫秒），0 表示不限时、完整分析
+                "latency_budget_ms": ("INT", {"default": 50, "min": 0, "max": 10000, "step": 1}),
             }
         }
     
-    RETURN_TYPES = ("DICT", "STRING", "CLIP_VISION_OUTPUT")
-    RETURN_NAMES = ("clip_analysis", "analysis_text", "clip_vision_output")
+    RETURN_TYPES = ("DICT", "STRING", "CLIP_VISION_OUTPUT", "CLIP_SCORES")
+    RETURN_NAMES = ("clip_analysis", "analysis_text", "clip_vision_output", "clip_scores")
     FUNCTION = "analyze_image"
     CATEGORY = "character_labeler/clip"
     
-    def analyze_image(self, clip_vision_output, confidence_threshold, analysis_mode):
-        # 这里可以添加真正的CLIP分析逻辑
-        # 目前使用模拟数据
-        
-        # 定义特征文本（中英文对照，便于后续处理）
-        feature_texts = {
-            "长发": "long hair",
-            "短发": "short hair", 
-            "卷发": "curly hair",
-            "直发": "straight hair",
-            "马尾": "ponytail",
-            "双马尾": "twin tails",
-            "微笑": "smile",
-            "愤怒": "angry", 
-            "悲伤": "sad",
-            "惊讶": "surprised",
-            "害羞": "shy",
-            "站立": "standing",
-            "坐姿": "sitting", 
-            "奔跑": "running",
-            "跳跃": "jumping",
-            "城市背景": "city background",
-            "自然背景": "nature background",
-            "室内": "indoor",
-            "室外": "outdoor",
-            "白天": "daytime", 
-            "夜晚": "night",
-            "黄昏": "dusk",
-            "动漫风格": "anime style",
-            "写实风格": "realistic style",
-            "油画风格": "oil painting style",
-            "男性": "male",
-            "女性": "female", 
-            "年轻": "young",
-            "老年": "old"
+    def analyze_image(self, clip_vision_output, confidence_threshold, analysis_mode, latency_budget_ms=50):
+        embeddings = clip_vision_output["image_features"]
+        skipped = []
+        region_sources = {}
+        
+        if analysis_mode == "多区域分析" and clip_vision_output.get("images") is not None:
+            # 中心/上三分之一/面部网格的裁剪合并为一个批次编码，整图嵌入直接复用
+            results, region_scores = multi_crop_analyzer.analyze_regions(
+                clip_vision_output.get("clip_vision"), clip_vision_output["images"],
+                full_embeddings=embeddings, threshold=confidence_threshold)
+            region_sources = multi_crop_analyzer.winning_regions(results, region_scores)[0]
+        elif analysis_mode == "自适应分析":
+            # 按类别优先级打分，最高结果已确定或超出预算时提前结束
+            results, skipped = clip_analyzer.analyze_adaptive(
+                embeddings, threshold=confidence_threshold, latency_budget_ms=latency_budget_ms)
+        else:
+            # 根据分析模式选择参与打分的特征（词表索引）
+            if analysis_mode == "快速分析":
+                feature_ids = clip_analyzer.quick_feature_ids
+            else:
+                feature_ids = clip_analyzer.all_feature_ids
+            
+            # 整个批次一次打分，结果为共享词表 + NumPy数组的紧凑类型
+            results = clip_analyzer.analyze(embeddings, threshold=confidence_threshold, feature_ids=feature_ids)
+        
+        analysis_text = "CLIP分析结果: "
+        for feature, data in results.items():
+            analysis_text += f"{feature}({data['confidence']:.2f}), "
+        analysis_text = analysis_text.rstrip(", ") + "。"
+        if skipped:
+            analysis_text += f"\n已跳过类别: {'、'.join(skipped)}"
+        regional = [f"{feature}({region})" for feature, region in region_sources.items() if region != "全图"]
+        if regional:
+            analysis_text += f"\n来自局部区域: {', '.join(regional)}"
+        
+        # 未过滤的原始分数（与 results 共享同一组数组），交给CLIP分数过滤器调整阈值时无需重新分析
+        return (results, analysis_text, clip_vision_output, results.raw())
+
+
+class CLIPScoreFilter:
+    """CLIP分数过滤器节点：在原始分数上应用阈值、top-k 和类别掩码"""
+    
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "clip_scores": ("CLIP_SCORES",),
+                "confidence_threshold": ("FLOAT", {"default": 0.7, "min": 0.0, "max": 1.0, "step": 0.01}),
+                # 每张图像最多保留的特征数，0 表示不限
+                "top_k": ("INT", {"default": 0, "min": 0, "max": 1000, "step": 1}),
+            },
+            "optional": {
+                # 逗号分隔的类别名称（如 "表情, 服装"），为空时不按类别过滤
+                "categories": ("STRING", {"default": ""}),
+                "category_mode": (["包含", "排除"], {"default": "包含"}),
+            }
         }
+    
+    RETURN_TYPES = ("DICT", "STRING")
+    RETURN_NAMES = ("clip_analysis", "analysis_text")
+    FUNCTION = "filter_scores"
+    CATEGORY = "character_labeler/clip"
+    
+    def filter_scores(self, clip_scores, confidence_threshold, top_k, categories="", category_mode="包含"):
+        category_list = [c.strip() for c in categories.replace("，", ",").split(",") if c.strip()]
+        unknown = [c for c in category_list if clip_scores.vocabulary.category_id(c) < 0]
+        if unknown:
+            print(f"⚠️ 未知的CLIP特征类别: {', '.join(unknown)}")
+        
+        # 只生成新的视图，分数矩阵不复制
+        results = (clip_scores
+                   .with_threshold(confidence_threshold)
+                   .with_top_k(top_k if top_k > 0 else None)
+                   .with_categories(category_list, exclude=category_mode == "排除"))
         
-        # 模拟分析结果
-        results = {}
+        counts = results.selection_mask().sum(axis=1)
         analysis_text = "CLIP分析结果: "
+        for feature, data in results.items():
+            analysis_text += f"{feature}({data['confidence']:.2f}), "
+        analysis_text = analysis_text.rstrip(", ") + "。"
+        if results.batch_size > 1:
+            analysis_text += f"\n每张图像保留特征数: {', '.join(str(int(n)) for n in counts)}"
         
-        # 根据分析模式选择分析的特征数量
+        return (results, analysis_text)
+
+
+class FrameSequenceLabeler:
+    """帧序列标签器节点：只对关键帧做完整分析，其余帧插值传播"""
+    
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "clip_vision": ("CLIP_VISION",),
+                "images": ("IMAGE",),
+                # 与上一关键帧的签名差异超过该值时视为新关键帧
+                "change_threshold": ("FLOAT", {"default": 0.05, "min": 0.0, "max": 1.0, "step": 0.005}),
+                "signature_method": (list(SIGNATURE_METHODS), {"default": SIGNATURE_METHODS[0]}),
+                "confidence_threshold": ("FLOAT", {"default": 0.7, "min": 0.0, "max": 1.0, "step": 0.01}),
+                "analysis_mode": (["快速分析", "详细分析"], {"default": "快速分析"}),
+                "smoothing_window": ("INT", {"default": 3, "min": 1, "max": 31, "step": 1}),
+                "language": (["中文", "英文"], {"default": "中文"}),
+            }
+        }
+    
+    RETURN_TYPES = ("DICT", "STRING", "STRING")
+    RETURN_NAMES = ("clip_analysis", "frame_labels", "keyframe_info")
+    FUNCTION = "label_frames"
+    CATEGORY = "character_labeler/video"
+    
+    def label_frames(self, clip_vision, images, change_threshold, signature_method,
+                     confidence_threshold, analysis_mode, smoothing_window, language):
         if analysis_mode == "快速分析":
-            num_features = 8
+            feature_ids = clip_analyzer.quick_feature_ids
         else:
-            num_features = 15
-        
-        # 模拟置信度分数
-        features_to_check = list(feature_texts.keys())[:num_features]
-        for feature in features_to_check:
-            confidence = np.random.uniform(0.5, 0.95)
-            if confidence > confidence_threshold:
-                results[feature] = {
-                    "confidence": float(confidence),
-                    "english": feature_texts[feature]
-                }
-                analysis_text += f"{feature}({confidence:.2f}), "
+            feature_ids = clip_analyzer.all_feature_ids
         
-        analysis_text = analysis_text.rstrip(", ") + "。"
+        results, keyframes = sequence_labeler.label_sequence(
+            clip_vision, images,
+            change_threshold=change_threshold,
+            method=signature_method,
+            threshold=confidence_threshold,
+            language=language,
+            feature_ids=feature_ids,
+            smoothing_window=smoothing_window
+        )
+        
+        lines = []
+        for i in range(results.batch_size):
+            lines.append(f"帧{i}: " + ", ".join(results.image(i).tags()))
+        frame_labels = "\n".join(lines)
+        
+        num_frames = results.batch_size
+        keyframe_info = (f"关键帧: {len(keyframes)}/{num_frames} "
+                         f"(编码比例 {len(keyframes) / max(num_frames, 1):.1%})，"
+                         f"索引: {', '.join(str(i) for i in keyframes)}")
         
-        return (results, analysis_text, clip_vision_output)
+        return (results, frame_labels, keyframe_info)
 
 
 class CoreVariableSelector:
@@ -167,7 +326,7 @@ class CoreVariableSelector:
         for category, variables in core_vars.items():
             for var_name, options in variables.items():
                 if options:  # 确保选项列表不为空
-                    input_dict["required"][var_name] = (options, {"default": options[0]})
+                    input_dict["required"][var_name] = ([UNSET_OPTION] + options, {"default": UNSET_OPTION})
         
         return input_dict
     
@@ -184,7 +343,7 @@ class CoreVariableSelector:
         for category, variables in core_vars.items():
             selected[category] = {}
             for var_name in variables.keys():
-                if var_name in kwargs:
+                if var_name in kwargs and kwargs[var_name] != UNSET_OPTION:
                     value = kwargs[var_name]
                     selected[category][var_name] = value
                     # 中文显示
@@ -215,20 +374,20 @@ class VariableVariableSelector:
                     level1_options = levels["一级"]
                     if level1_options:
                         input_dict["required"][f"{category}_{sub_name}_level1"] = (
-                            level1_options, 
-                            {"default": level1_options[0]}
+                            [UNSET_OPTION] + level1_options, 
+                            {"default": UNSET_OPTION}
                         )
                     
                     # 如果有二级选项，创建二级选择框
                     if "二级" in levels and isinstance(levels["二级"], dict):
-                        # 获取默认的一级值，用于确定二级选项
+                        # 取第一个一级选项，用于确定二级选项
                         default_level1 = level1_options[0] if level1_options else ""
                         level2_options = levels["二级"].get(default_level1, [])
                         
                         if level2_options:
                             input_dict["required"][f"{category}_{sub_name}_level2"] = (
-                                level2_options,
-                                {"default": level2_options[0] if level2_options else ""}
+                                [UNSET_OPTION] + level2_options,
+                                {"default": UNSET_OPTION}
                             )
         
         return input_dict
@@ -250,7 +409,7 @@ class VariableVariableSelector:
                     key_level1 = f"{category}_{sub_name}_level1"
                     key_level2 = f"{category}_{sub_name}_level2"
                     
-                    if key_level1 in kwargs:
+                    if key_level1 in kwargs and kwargs[key_level1] != UNSET_OPTION:
                         value_level1 = kwargs[key_level1]
                         selected[category][sub_name] = {
                             "一级": value_level1,
@@ -258,7 +417,7 @@ class VariableVariableSelector:
                         }
                         
                         # 如果有二级选择且存在对应选项
-                        if key_level2 in kwargs and kwargs[key_level2]:
+                        if key_level2 in kwargs and kwargs[key_level2] and kwargs[key_level2] != UNSET_OPTION:
                             value_level2 = kwargs[key_level2]
                             selected[category][sub_name]["二级"] = value_level2
                             text_parts.append(f"{sub_name}: {value_level1}({value_level2})")
@@ -269,6 +428,95 @@ class VariableVariableSelector:
         return (selected, variables_text)
 
 
+class CombinationPromptGenerator:
+    """组合提示词生成器节点：按索引范围枚举可变变量组合，用于合成数据集"""
+    
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "core_variables": ("DICT",),
+                # 全局组合索引，小于分片起点时从分片起点开始；可用上次输出的 next_index 续接
+                "start_index": ("INT", {"default": 0, "min": 0, "max": 0xffffffffffffffff}),
+                "count": ("INT", {"default": 100, "min": 1, "max": 100000}),
+                "num_workers": ("INT", {"default": 1, "min": 1, "max": 1024}),
+                "worker_id": ("INT", {"default": 0, "min": 0, "max": 1023}),
+                "expand_level2": (["否", "是"], {"default": "否"}),
+                "output_format": (["标签列表", "提示词格式"] + template_registry.names(), {"default": "标签列表"}),
+                "separator": ("STRING", {"default": ", ", "multiline": False}),
+                "language": (["中文", "英文"], {"default": "中文"}),
+            }
+        }
+    
+    RETURN_TYPES = ("STRING", "INT", "INT")
+    RETURN_NAMES = ("prompts", "next_index", "total_combinations")
+    FUNCTION = "generate_prompts"
+    CATEGORY = "character_labeler/variables"
+    
+    def generate_prompts(self, core_variables, start_index, count, num_workers, worker_id,
+                         expand_level2, output_format, separator, language):
+        if not 0 <= worker_id < num_workers:
+            # 截断会让多个工作进程生成同一分片，直接报错
+            raise ValueError(f"worker_id 必须在 0 到 num_workers - 1 之间: worker_id={worker_id}, num_workers={num_workers}")
+        enumerator = CombinationEnumerator.from_config(expand_level2=(expand_level2 == "是"))
+        shard_start, shard_stop = shard_range(len(enumerator), num_workers, worker_id)
+        start = max(shard_start, start_index)
+        stop = min(shard_stop, start + count)
+        
+        prompts = [
+            formatted for _, _, formatted in enumerator.stream_labels(
+                core_variables, start, stop,
+                output_format=output_format, language=language, separator=separator)
+        ]
+        return ("\n".join(prompts), max(start, stop), len(enumerator))
+
+
+class WeightedVariableSampler:
+    """加权随机变量抽样器节点：按 configs/option_weights.json 中的权重批量抽取变量组合"""
+    
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "count": ("INT", {"default": 16, "min": 1, "max": 100000}),
+                "seed": ("INT", {"default": 0, "min": 0, "max": 0xffffffffffffffff}),
+                "sample_core": (["是", "否"], {"default": "是"}),
+                "sample_variable": (["是", "否"], {"default": "是"}),
+                "include_level2": (["是", "否"], {"default": "是"}),
+                "separator": ("STRING", {"default": ", ", "multiline": False}),
+                "language": (["中文", "英文"], {"default": "中文"}),
+            }
+        }
+    
+    RETURN_TYPES = ("SELECTION_LIST", "DICT", "DICT", "STRING")
+    RETURN_NAMES = ("selections", "core_variables", "variable_variables", "labels")
+    FUNCTION = "sample"
+    CATEGORY = "character_labeler/variables"
+    
+    def sample(self, count, seed, sample_core, sample_variable, include_level2, separator, language):
+        selections = weighted_sampler.sample(
+            count, seed,
+            include_core=(sample_core == "是"),
+            include_variable=(sample_variable == "是"),
+            include_level2=(include_level2 == "是")
+        )
+        
+        labels = []
+        for selection in selections:
+            tags, _ = LabelGenerator.generate_labels(
+                core_variables=selection["core_variables"],
+                variable_variables=selection["variable_variables"],
+                language=language,
+                separator=separator,
+                include_clip=False
+            )
+            labels.append(tags)
+        
+        # 第一组同时单独输出，可直接连接到人物标签生成器
+        first = selections[0]
+        return (selections, first["core_variables"], first["variable_variables"], "\n".join(labels))
+
+
 class CharacterLabelGenerator:
     """人物标签生成器主节点"""
     
@@ -279,7 +527,7 @@ class CharacterLabelGenerator:
                 "clip_analysis": ("DICT",),
                 "core_variables": ("DICT",),
                 "variable_variables": ("DICT",),
-                "output_format": (["标签列表", "详细描述", "JSON格式", "提示词格式"], {"default": "标签列表"}),
+                "output_format": (["标签列表", "详细描述", "JSON格式", "提示词格式"] + template_registry.names(), {"default": "标签列表"}),
                 "include_clip_analysis": (["是", "否"], {"default": "是"}),
                 "separator": ("STRING", {"default": ", ", "multiline": False}),
                 "language": (["中文", "英文"], {"default": "中文"}),
@@ -287,6 +535,8 @@ class CharacterLabelGenerator:
             "optional": {
                 "additional_prompt": ("STRING", {"default": "", "multiline": True}),
                 "clip_vision_output": ("CLIP_VISION_OUTPUT", {"optional": True}),
+                # 从附加提示词中提取结构化变量：补充选择器未提供的变量，或覆盖选择器的输出
+                "prompt_parsing": (["关闭"] + list(MERGE_POLICIES), {"default": "关闭"}),
             }
         }
     
@@ -297,21 +547,185 @@ class CharacterLabelGenerator:
     
     def generate_labels(self, clip_analysis, core_variables, variable_variables, 
                        output_format, include_clip_analysis, separator, language, 
-                       additional_prompt="", clip_vision_output=None):
+                       additional_prompt="", clip_vision_output=None, prompt_parsing="关闭"):
+        
+        if prompt_parsing != "关闭" and additional_prompt and additional_prompt.strip():
+            # 一次扫描匹配所有选项和别名，未匹配的片段仍作为附加标签
+            core_variables, variable_variables, additional_prompt = prompt_extractor.apply(
+                core_variables, variable_variables, additional_prompt, prompt_parsing)
+        
+        include_clip = include_clip_analysis == "是"
+        if (include_clip and isinstance(clip_analysis, AnalysisResult) and clip_analysis.image_index is None
+                and clip_analysis.batch_size > 1):
+            # 整个批次的结果：每张图像生成一行标签，可直接连接到标注文件写入器
+            per_image = clip_analysis.with_language(language).to_dicts()
+        else:
+            per_image = [clip_analysis if include_clip else None]
         
         # 使用LabelGenerator工具生成标签
-        labels, formatted = LabelGenerator.generate_labels(
-            core_variables=core_variables,
-            variable_variables=variable_variables,
-            clip_analysis=clip_analysis if include_clip_analysis == "是" else None,
-            additional_prompt=additional_prompt,
-            output_format=output_format,
-            language=language,
-            separator=separator,
-            include_clip=(include_clip_analysis == "是")
-        )
+        outputs = [
+            LabelGenerator.generate_labels(
+                core_variables=core_variables,
+                variable_variables=variable_variables,
+                clip_analysis=analysis,
+                additional_prompt=additional_prompt,
+                output_format=output_format,
+                language=language,
+                separator=separator,
+                include_clip=include_clip
+            )
+            for analysis in per_image
+        ]
         
-        return (labels, formatted)
+        return ("\n".join(labels for labels, _ in outputs), "\n\n".join(formatted for _, formatted in outputs))
+
+
+class CaptionFileWriter:
+    """标注文件写入器节点：增量写入 kohya 风格的 .txt 标注文件"""
+    
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                # 每行一条标注；只有一行时写入所有文件
+                "captions": ("STRING", {"forceInput": True}),
+                "output_dir": ("STRING", {"default": "", "multiline": False}),
+                "merge_mode": (list(MERGE_MODES), {"default": MERGE_MODES[0]}),
+                "separator": ("STRING", {"default": ", ", "multiline": False}),
+            },
+            "optional": {
+                # 每行一个图像文件名（与标注逐行对应）；留空则按 前缀+序号 命名
+                "filenames": ("STRING", {"default": "", "multiline": True}),
+                "filename_prefix": ("STRING", {"default": "image_", "multiline": False}),
+                "extension": ("STRING", {"default": ".txt", "multiline": False}),
+            }
+        }
+    
+    RETURN_TYPES = ("STRING",)
+    RETURN_NAMES = ("report",)
+    FUNCTION = "write_captions"
+    CATEGORY = "character_labeler/main"
+    OUTPUT_NODE = True
+    
+    def write_captions(self, captions, output_dir, merge_mode, separator,
+                       filenames="", filename_prefix="image_", extension=".txt"):
+        if not output_dir or not output_dir.strip():
+            return ("❌ 请填写输出目录",)
+        
+        caption_lines = [line.strip() for line in captions.splitlines() if line.strip()] or [""]
+        names = [line.strip() for line in filenames.splitlines() if line.strip()]
+        if not names:
+            names = [f"{filename_prefix}{i:05d}" for i in range(len(caption_lines))]
+        if len(caption_lines) == 1:
+            caption_lines = caption_lines * len(names)
+        if len(caption_lines) != len(names):
+            return (f"❌ 标注行数({len(caption_lines)})与文件名数({len(names)})不一致",)
+        
+        writer = get_caption_writer(output_dir.strip(), extension)
+        report = writer.write(list(zip(names, caption_lines)), merge_mode, separator)
+        
+        message = (f"✅ 标注写入完成: 写入 {len(report['written'])}，"
+                   f"未变化跳过 {len(report['skipped'])}，失败 {len(report['failed'])}")
+        if report["failed"]:
+            message += "\n⚠️ 失败文件: " + "; ".join(report["failed"][:20])
+        return (message,)
+
+
+class TagStatisticsCollector:
+    """标签统计收集器节点：跨多次执行流式累积标签频率与共现，并写出JSON报告"""
+    
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                # 每行一条标注
+                "captions": ("STRING", {"forceInput": True}),
+                # 报告路径同时作为本次统计的名称，同一路径的多次执行累积到一起
+                "report_path": ("STRING", {"default": "tag_report.json", "multiline": False}),
+                "action": (["累积", "重置后累积"], {"default": "累积"}),
+                "top_n": ("INT", {"default": 100, "min": 1, "max": 10000, "step": 1}),
+            },
+            "optional": {
+                # 只有一条标注时，用核心变量选择精确统计核心变量分布
+                "core_variables": ("DICT",),
+            }
+        }
+    
+    RETURN_TYPES = ("STRING",)
+    RETURN_NAMES = ("summary",)
+    FUNCTION = "collect"
+    CATEGORY = "character_labeler/main"
+    OUTPUT_NODE = True
+    
+    def collect(self, captions, report_path, action, top_n, core_variables=None):
+        if not report_path or not report_path.strip():
+            return ("❌ 请填写报告路径",)
+        report_path = os.path.abspath(os.path.expanduser(report_path.strip()))
+        statistics = get_tag_statistics(report_path, reset=(action == "重置后累积"))
+        
+        caption_lines = [line.strip() for line in captions.splitlines() if line.strip()]
+        for line in caption_lines:
+            statistics.add(line, core_variables if len(caption_lines) == 1 else None)
+        
+        try:
+            report = statistics.write_report(report_path, top_n)
+        except Exception as e:
+            return (f"❌ 写出统计报告失败: {e}",)
+        
+        top_tags = ", ".join(f"{item['tag']}({item['count']})" for item in report["vocabulary"]["top"][:10])
+        summary = (f"✅ 已统计 {report['captions']} 条标注，报告: {report_path}\n"
+                   f"高频标签: {top_tags}")
+        for change in statistics.take_notices():
+            summary += (f"\n⚠️ 配置变化导致标签词表变化（新增 {change['added']} 个、移除 {change['removed']} 个标签），"
+                        f"之前的 {change['captions_before']} 条统计已按标签名保留，移除的标签转入自由标签统计")
+        return (summary,)
+
+
+class ResultsStoreWriter:
+    """结果存储写入器节点：把每张图像的变量、CLIP分数和标签写入 SQLite 数据库"""
+    
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "clip_vision_output": ("CLIP_VISION_OUTPUT",),
+                # 每行一条标签（与批次中的图像逐行对应）；只有一行时用于整个批次
+                "character_labels": ("STRING", {"forceInput": True}),
+                # 相对路径位于 ComfyUI 输出目录下
+                "database": ("STRING", {"default": "labels.sqlite", "multiline": False}),
+            },
+            "optional": {
+                "clip_scores": ("CLIP_SCORES",),
+                "core_variables": ("DICT",),
+                "variable_variables": ("DICT",),
+                "language": (["中文", "英文"], {"default": "中文"}),
+            }
+        }
+    
+    RETURN_TYPES = ("STRING",)
+    RETURN_NAMES = ("report",)
+    FUNCTION = "store_results"
+    CATEGORY = "character_labeler/main"
+    OUTPUT_NODE = True
+    
+    def store_results(self, clip_vision_output, character_labels, database, clip_scores=None,
+                      core_variables=None, variable_variables=None, language="中文"):
+        if not database or not database.strip():
+            return ("❌ 请填写数据库路径",)
+        database = os.path.expanduser(database.strip())
+        if not os.path.isabs(database):
+            database = os.path.join(folder_paths.get_output_directory(), database)
+        
+        image_hashes = clip_vision_output["image_hashes"]
+        labels = [line.strip() for line in character_labels.splitlines() if line.strip()] or [""]
+        try:
+            records = records_from_batch(image_hashes, labels, clip_scores, core_variables,
+                                         variable_variables, language)
+            # 整个批次在一个事务中提交
+            written = get_results_store(database).add(records)
+        except Exception as e:
+            return (f"❌ 写入结果数据库失败: {e}",)
+        return (f"✅ 已写入 {written} 张图像的标注结果: {database}",)
 
 
 class ConfigManager:
@@ -340,7 +754,10 @@ class ConfigManager:
         try:
             if action == "重新加载配置":
                 # 重新加载配置
-                message = "✅ 配置已重新加载"
+                snapshot = variable_processor.reload()
+                template_registry.refresh()
+                text_embedding_bank.refresh()
+                message = f"✅ 配置已重新加载（版本 {snapshot.version}）"
                 
                 if config_type == "核心变量" or config_type == "全部":
                     core_config = variable_processor.load_core_variables()
@@ -354,16 +771,12 @@ class ConfigManager:
                 # 导出配置
                 if config_type == "核心变量" or config_type == "全部":
                     core_config = variable_processor.load_core_variables()
-                    core_config_path = os.path.join(CONFIG_DIR, "core_variables.json")
-                    with open(core_config_path, 'w', encoding='utf-8') as f:
-                        json.dump(core_config, f, ensure_ascii=False, indent=2)
+                    core_config_path = variable_processor.save_core_variables(core_config)
                     message += f"📤 核心变量配置已导出到: {core_config_path}\n"
                 
                 if config_type == "可变变量" or config_type == "全部":
                     var_config = variable_processor.load_variable_variables()
-                    var_config_path = os.path.join(CONFIG_DIR, "variable_variables.json")
-                    with open(var_config_path, 'w', encoding='utf-8') as f:
-                        json.dump(var_config, f, ensure_ascii=False, indent=2)
+                    var_config_path = variable_processor.save_variable_variables(var_config)
                     message += f"📤 可变变量配置已导出到: {var_config_path}"
             
             elif action == "重置为默认":
@@ -414,13 +827,22 @@ NODE_CLASS_MAPPINGS = {
     "CLIPVisionLoaderWrapper": CLIPVisionLoaderWrapper,
     "CLIPVisionEncodeWrapper": CLIPVisionEncodeWrapper,
     "CLIPImageAnalyzer": CLIPImageAnalyzer,
+    "CLIPScoreFilter": CLIPScoreFilter,
+    
+    # 视频节点
+    "FrameSequenceLabeler": FrameSequenceLabeler,
     
     # 变量选择器节点
     "CoreVariableSelector": CoreVariableSelector,
     "VariableVariableSelector": VariableVariableSelector,
+    "CombinationPromptGenerator": CombinationPromptGenerator,
+    "WeightedVariableSampler": WeightedVariableSampler,
     
     # 主节点
     "CharacterLabelGenerator": CharacterLabelGenerator,
+    "CaptionFileWriter": CaptionFileWriter,
+    "TagStatisticsCollector": TagStatisticsCollector,
+    "ResultsStoreWriter": ResultsStoreWriter,
     
     # 配置管理节点
     "ConfigManager": ConfigManager,
@@ -431,13 +853,22 @@ NODE_DISPLAY_NAME_MAPPINGS = {
     "CLIPVisionLoaderWrapper": "🔤 CLIP视觉模型加载器",
     "CLIPVisionEncodeWrapper": "🔤 CLIP视觉编码器",
     "CLIPImageAnalyzer": "🔤 CLIP图像分析器",
+    "CLIPScoreFilter": "🔤 CLIP分数过滤器",
+    
+    # 视频节点
+    "FrameSequenceLabeler": "🎬 帧序列标签器",
     
     # 变量选择器节点
     "CoreVariableSelector": "🎯 核心变量选择器",
     "VariableVariableSelector": "🎯 可变变量选择器",
+    "CombinationPromptGenerator": "🎯 组合提示词生成器",
+    "WeightedVariableSampler": "🎲 加权变量抽样器",
     
     # 主节点
     "CharacterLabelGenerator": "✨ 人物标签生成器",
+    "CaptionFileWriter": "✨ 标注文件写入器",
+    "TagStatisticsCollector": "📊 标签统计收集器",
+    "ResultsStoreWriter": "✨ 结果存储写入器",
     
     # 配置管理节点
     "ConfigManager": "⚙️ 配置管理器",
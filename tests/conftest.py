@@ -0,0 +1,27 @@
+"""
+测试环境：在仓库内直接运行 pytest
+
+插件根目录带有 __init__.py，pytest 会把它作为包导入，而包会导入 nodes.py（依赖 comfy 与 folder_paths）。
+没有ComfyUI环境时安装 workflow_replay 的桩模块，测试结束后恢复。
+"""
+
+import importlib.util
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.workflow_replay import install_stub_modules, restore_modules  # noqa: E402
+
+_stub_dir = None
+_replaced_modules = None
+if importlib.util.find_spec("comfy") is None:
+    _stub_dir = tempfile.TemporaryDirectory(prefix="character_labeler_tests_")
+    _replaced_modules = install_stub_modules(_stub_dir.name)
+
+
+def pytest_unconfigure(config):
+    if _replaced_modules is not None:
+        restore_modules(_replaced_modules)
+        _stub_dir.cleanup()
@@ -0,0 +1,83 @@
+"""
+自适应分析：相似度上界确定最高结果后提前结束，超出延迟预算时跳过剩余类别
+"""
+
+import zlib
+
+import numpy as np
+import pytest
+import torch
+
+from utils.clip_analyzer import CLIPAnalyzerTool
+from utils.text_embeddings import text_embedding_bank
+
+EMBED_DIM = 32
+
+
+def clustered_encoder(vocabulary):
+    """每个类别的提示词聚集在各自的坐标轴附近"""
+    prompts, owners = text_embedding_bank.prompts_for(vocabulary)
+    category_of = {prompt: int(vocabulary.category_ids[owner]) for prompt, owner in zip(prompts, owners)}
+
+    def encode_text(batch):
+        rows = np.zeros((len(batch), EMBED_DIM), dtype=np.float32)
+        for i, prompt in enumerate(batch):
+            rows[i, category_of[prompt]] = 1.0
+            rows[i] += 0.05 * np.random.default_rng(zlib.crc32(prompt.encode("utf-8"))).standard_normal(EMBED_DIM)
+        return rows
+    return encode_text
+
+
+@pytest.fixture
+def analyzer():
+    analyzer = CLIPAnalyzerTool()
+    analyzer.set_text_encoder(clustered_encoder(analyzer.vocabulary), "test_adaptive_clustered")
+    return analyzer
+
+
+def unit(vector):
+    return torch.nn.functional.normalize(torch.as_tensor(vector, dtype=torch.float32)[None], dim=-1)
+
+
+def test_early_exit_once_top_result_is_settled(analyzer):
+    vocab = analyzer.vocabulary
+    first = vocab.categories[0]
+    embeddings = unit(np.eye(EMBED_DIM)[vocab.category_id(first)])
+
+    result, skipped = analyzer.analyze_adaptive(embeddings)
+    assert skipped == list(vocab.categories[1:])
+
+    # 提前结束不改变最高结果
+    full = analyzer.analyze(embeddings, feature_ids=analyzer.all_feature_ids)
+    assert vocab.names_cn[result.feature_ids[result.scores[0].argmax()]] == \
+        vocab.names_cn[full.feature_ids[full.scores[0].argmax()]]
+
+
+def test_no_early_exit_without_a_clear_winner(analyzer):
+    vocab = analyzer.vocabulary
+    # 与每个类别方向都有相同的相似度，任何类别都可能给出最高结果
+    direction = np.zeros(EMBED_DIM)
+    direction[[vocab.category_id(c) for c in vocab.categories]] = 1.0
+    embeddings = unit(direction)
+
+    result, skipped = analyzer.analyze_adaptive(embeddings)
+    assert skipped == []
+    full = analyzer.analyze(embeddings, feature_ids=analyzer.all_feature_ids)
+    order = np.argsort(result.feature_ids)
+    np.testing.assert_allclose(result.scores[:, order], full.scores[:, np.argsort(full.feature_ids)], rtol=1e-5)
+
+
+def test_latency_budget_cuts_off_remaining_groups(analyzer):
+    vocab = analyzer.vocabulary
+    direction = np.zeros(EMBED_DIM)
+    direction[[vocab.category_id(c) for c in vocab.categories]] = 1.0
+    embeddings = unit(direction)
+    # 每个类别组单独一个阶段，预算在组之间检查
+    analyzer.adaptive_stage_features = 1
+
+    result, skipped = analyzer.analyze_adaptive(embeddings, latency_budget_ms=1e-9)
+    assert skipped == list(vocab.categories[1:])
+    assert set(result.feature_ids) == set(np.flatnonzero(vocab.category_ids == vocab.category_id(vocab.categories[0])))
+
+    _, skipped = analyzer.analyze_adaptive(embeddings, latency_budget_ms=0)
+    assert skipped == []
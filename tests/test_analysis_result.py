@@ -0,0 +1,45 @@
+"""
+分析结果：Mapping 接口复用同一份字典，批次结果逐图生成标签
+"""
+
+import numpy as np
+
+from utils.analysis_result import AnalysisResult, FeatureVocabulary
+from utils.workflow_replay import load_plugin
+
+VOCABULARY = FeatureVocabulary(["长发", "微笑", "城市"], ["long hair", "smiling", "city"], ["人物", "表情", "环境"])
+SCORES = np.array([[0.9, 0.2, 0.8],
+                   [0.1, 0.95, 0.3]], dtype=np.float32)
+
+
+def test_mapping_lookups_build_the_dict_once(monkeypatch):
+    result = AnalysisResult(VOCABULARY, SCORES, np.arange(3), threshold=0.5)
+    calls = []
+    monkeypatch.setattr(AnalysisResult, "to_dict",
+                        lambda self, image_index=None, _inner=AnalysisResult.to_dict: calls.append(1) or
+                        _inner(self, image_index))
+
+    assert list(result) == ["长发", "城市"]
+    assert result["长发"]["confidence"] == np.float32(0.9)
+    assert "微笑" not in result and len(result) == 2
+    assert [data["english"] for data in result.values()] == ["long hair", "city"]
+    assert calls == [1]
+
+    # 视图是新对象，各自缓存自己的字典
+    assert list(result.image(1)) == ["微笑"]
+    assert dict(result.with_threshold(0.0).items()).keys() == {"长发", "城市", "微笑"}
+
+
+def test_label_generator_node_labels_every_image_in_a_batch():
+    # 插件以包的形式导入，使用包内的结果类型
+    nodes = load_plugin().nodes
+    result = nodes.AnalysisResult(VOCABULARY, SCORES, np.arange(3), threshold=0.5)
+
+    labels, formatted = nodes.CharacterLabelGenerator().generate_labels(
+        result, {}, {}, "标签列表", "是", ", ", "英文")
+    assert labels.splitlines() == ["long hair, city", "smiling"]
+    assert len(formatted.split("\n\n")) == 2
+
+    single, _ = nodes.CharacterLabelGenerator().generate_labels(
+        result.image(1), {}, {}, "标签列表", "是", ", ", "中文")
+    assert single == "微笑"
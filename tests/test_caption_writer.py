@@ -0,0 +1,19 @@
+"""
+标注写入器：扩展名统一写法后再作为缓存键，同一目录只有一份清单
+"""
+
+from utils.caption_writer import get_caption_writer, normalize_extension
+
+
+def test_extension_spellings_share_one_writer(tmp_path):
+    writer = get_caption_writer(str(tmp_path), ".txt")
+    assert get_caption_writer(str(tmp_path), "txt") is writer
+    assert get_caption_writer(str(tmp_path), " .txt ") is writer
+    assert get_caption_writer(str(tmp_path), ".caption") is not writer
+
+    assert writer.write([("a.png", "长发, 微笑")])["written"] == ["a.txt"]
+    # 另一种写法拿到同一个实例与清单，内容未变时跳过
+    assert get_caption_writer(str(tmp_path), "txt").write([("a.png", "长发, 微笑")])["skipped"] == ["a.txt"]
+    assert sorted(p.name for p in tmp_path.iterdir() if p.name.startswith(".caption_manifest")) == \
+        [".caption_manifest.txt.json"]
+    assert normalize_extension("") == ".txt"
@@ -0,0 +1,89 @@
+"""
+组合枚举：混合进制索引与 itertools.product 顺序一致，可按分片或任意索引恢复
+"""
+
+import itertools
+
+import pytest
+
+from utils.combination_enumerator import (
+    CombinationEnumerator, build_axes, incompatible, level1_excludes, shard_range
+)
+
+VARIABLES = {
+    "environment": {
+        "background": {"一级": ["城市", "森林", "水下"], "二级": {"城市": ["街道", "屋顶"]}},
+        "time": {"一级": ["白天", "夜晚"]},
+        "ignored": {"二级": {"x": ["y"]}},
+    },
+    "state_action": {
+        "pose": {"一级": ["站立", "飞行"]},
+    },
+}
+
+
+def selection_tuple(selection):
+    return tuple((levels["一级"], levels["二级"]) for subs in selection.values() for levels in subs.values())
+
+
+def test_indices_follow_product_order():
+    enumerator = CombinationEnumerator(build_axes(VARIABLES))
+    assert [axis.key for axis in enumerator.axes] == ["environment.background", "environment.time", "state_action.pose"]
+    assert enumerator.radices == [3, 2, 2] and len(enumerator) == 12
+
+    expected = list(itertools.product(*[axis.choices for axis in enumerator.axes]))
+    enumerated = list(enumerator.iter_range())
+    assert [index for index, _ in enumerated] == list(range(12))
+    assert [selection_tuple(selection) for _, selection in enumerated] == expected
+    for index, selection in enumerated:
+        assert enumerator.digits(index) == [axis.choices.index(choice)
+                                            for axis, choice in zip(enumerator.axes, selection_tuple(selection))]
+        assert enumerator.index_of(selection) == index
+        assert enumerator[index] == selection
+
+    with pytest.raises(IndexError):
+        enumerator.digits(12)
+
+
+def test_level2_expansion_and_allowed_values():
+    expanded = build_axes(VARIABLES, expand_level2=True)
+    assert expanded[0].choices == (("城市", "街道"), ("城市", "屋顶"), ("森林", ""), ("水下", ""))
+    narrowed = build_axes(VARIABLES, allowed={"environment.background": ["水下", "城市"]})
+    assert [axis.key for axis in narrowed] == ["environment.background"]
+    assert narrowed[0].choices == (("城市", ""), ("水下", ""))
+
+
+@pytest.mark.parametrize("total, workers", [(12, 5), (7, 7), (3, 4), (1000, 3)])
+def test_shards_cover_the_range_without_overlap(total, workers):
+    bounds = [shard_range(total, workers, worker) for worker in range(workers)]
+    assert bounds[0][0] == 0 and bounds[-1][1] == total
+    assert all(stop == next_start for (_, stop), (next_start, _) in zip(bounds, bounds[1:]))
+    assert max(stop - start for start, stop in bounds) - min(stop - start for start, stop in bounds) <= 1
+    with pytest.raises(ValueError):
+        shard_range(total, workers, workers)
+
+
+def test_resume_and_predicates():
+    enumerator = CombinationEnumerator(build_axes(VARIABLES), predicates=[
+        level1_excludes("environment", "time", ["夜晚"]),
+        incompatible(("environment", "background", "水下"), ("state_action", "pose", "飞行")),
+    ])
+    kept = list(enumerator.iter_range())
+    assert [selection_tuple(s) for _, s in kept] == [
+        (("城市", ""), ("白天", ""), ("站立", "")),
+        (("城市", ""), ("白天", ""), ("飞行", "")),
+        (("森林", ""), ("白天", ""), ("站立", "")),
+        (("森林", ""), ("白天", ""), ("飞行", "")),
+        (("水下", ""), ("白天", ""), ("站立", "")),
+    ]
+    assert enumerator.count() == 5
+
+    # 从任意索引恢复得到的是同一序列的后缀
+    resumed = list(enumerator.iter_shard(worker_id=1, num_workers=2, resume_from=7))
+    assert resumed == [(index, s) for index, s in kept if index >= 7]
+
+
+def test_fingerprint_tracks_axes_only():
+    first = CombinationEnumerator(build_axes(VARIABLES))
+    assert CombinationEnumerator(build_axes(VARIABLES), predicates=[lambda s: False]).fingerprint == first.fingerprint
+    assert CombinationEnumerator(build_axes(VARIABLES, expand_level2=True)).fingerprint != first.fingerprint
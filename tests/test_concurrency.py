@@ -0,0 +1,138 @@
+"""
+并发压力测试：多线程读取配置快照、批量分析与配置保存同时进行
+"""
+
+import threading
+import time
+import zlib
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+import torch
+
+from utils.clip_analyzer import CLIPAnalyzerTool
+from utils.variable_processor import VariableProcessor
+
+EMBED_DIM = 16
+
+
+def fake_text_encoder(prompts):
+    """按提示词哈希生成确定的文本嵌入"""
+    rows = [np.random.default_rng(zlib.crc32(p.encode("utf-8"))).standard_normal(EMBED_DIM) for p in prompts]
+    return np.asarray(rows, dtype=np.float32)
+
+
+class SlowVisionModel:
+    """记录同时进行的推理数的假视觉模型"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.active = 0
+        self.peak = 0
+
+    def __call__(self, pixel_values, intermediate_output=None):
+        with self._lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        time.sleep(0.005)
+        with self._lock:
+            self.active -= 1
+        return None, None, pixel_values.flatten(1)[:, :EMBED_DIM]
+
+
+def run_threads(targets, duration=1.0):
+    """并发运行各线程函数，返回收集到的异常"""
+    stop = threading.Event()
+    errors = []
+
+    def wrap(target):
+        try:
+            while not stop.is_set():
+                target()
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+
+    threads = [threading.Thread(target=wrap, args=(target,)) for target in targets]
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return errors
+
+
+def test_snapshot_and_analyze_during_config_save(tmp_path):
+    processor = VariableProcessor(str(tmp_path))
+    base = processor.load_core_variables()
+    analyzer = CLIPAnalyzerTool(max_concurrent_inference=2)
+    analyzer.set_text_encoder(fake_text_encoder, "test_concurrency")
+
+    embeddings = torch.nn.functional.normalize(
+        torch.from_numpy(np.random.default_rng(0).standard_normal((4, EMBED_DIM)).astype(np.float32)), dim=-1)
+    expected = analyzer.analyze(embeddings).scores
+    written = {0}
+    counter = iter(range(1, 1_000_000))
+
+    def save_config():
+        revision = next(counter)
+        processor.save_core_variables(dict(base, revision=revision))
+        written.add(revision)
+
+    def read_snapshot():
+        versions = []
+        for _ in range(20):
+            snapshot = processor.get_snapshot()
+            # 快照必须完整，且只能是已写入过的某个版本
+            assert snapshot.core_variables.keys() >= base.keys()
+            assert snapshot.core_variables.get("revision", 0) in written
+            versions.append(snapshot.version)
+        assert versions == sorted(versions)
+
+    def analyze():
+        np.testing.assert_allclose(analyzer.analyze(embeddings).scores, expected, rtol=1e-6)
+
+    errors = run_threads([save_config, read_snapshot, read_snapshot, analyze, analyze])
+    assert not errors, errors
+    assert len(written) > 1
+
+
+def test_inference_slots_limit_concurrency():
+    analyzer = CLIPAnalyzerTool(max_concurrent_inference=2)
+    model = SlowVisionModel()
+    clip_vision = SimpleNamespace(model=model, precision="float32", load_device=torch.device("cpu"))
+    pixel_values = torch.rand(1, 3, 8, 8)
+
+    errors = run_threads([lambda: analyzer.encode_pixels(clip_vision, pixel_values)] * 6, duration=0.5)
+    assert not errors, errors
+    assert model.peak == 2
+
+    analyzer.configure_concurrency(max_concurrent_inference=3, intra_op_threads=torch.get_num_threads())
+    model.peak = 0
+    errors = run_threads([lambda: analyzer.encode_pixels(clip_vision, pixel_values)] * 6, duration=0.5)
+    assert not errors, errors
+    assert model.peak == 3
+
+
+def test_snapshot_is_read_only_and_loads_are_copies(tmp_path):
+    processor = VariableProcessor(str(tmp_path))
+    snapshot = processor.get_snapshot()
+    with pytest.raises(TypeError):
+        snapshot.core_variables["新类别"] = {}
+
+    core = processor.load_core_variables()
+    category = next(iter(core))
+    core[category].clear()
+    assert processor.get_snapshot().core_variables[category]
+    assert processor.load_core_variables() != core
+
+
+def test_fallback_warning_printed_once_across_threads(capsys):
+    analyzer = CLIPAnalyzerTool()
+    embeddings = torch.nn.functional.normalize(torch.randn(2, EMBED_DIM), dim=-1)
+
+    errors = run_threads([lambda: analyzer.score_embeddings(embeddings)] * 4, duration=0.2)
+    assert not errors, errors
+    assert capsys.readouterr().out.count("⚠️") == 1
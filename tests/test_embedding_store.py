@@ -0,0 +1,36 @@
+"""
+嵌入存储：增量合并的排序索引与逐分片花式索引读取
+"""
+
+import numpy as np
+
+from utils.embedding_store import EmbeddingStore
+
+DIM = 8
+
+
+def test_incremental_index_and_sharded_get(tmp_path):
+    rng = np.random.default_rng(0)
+    store = EmbeddingStore(str(tmp_path), dim=DIM, shard_rows=16)
+    reader = EmbeddingStore(str(tmp_path), readonly=True)
+    keys = np.unique(rng.integers(0, 2 ** 64, size=120, dtype=np.uint64))[:100]
+    rng.shuffle(keys)
+    embeddings = rng.standard_normal((100, DIM)).astype(np.float32)
+
+    # 分多次提交，每次刷新都把新哈希合并进已排序的索引
+    for start in range(0, 100, 23):
+        assert store.add(keys[start:start + 23], embeddings[start:start + 23]) == len(keys[start:start + 23])
+        assert reader.refresh() == min(start + 23, 100)
+    assert store.add(keys[:10], embeddings[:10]) == 0
+
+    for opened in (store, reader):
+        sorted_keys, sorted_rows = opened._index
+        assert np.all(sorted_keys[1:] > sorted_keys[:-1])
+        np.testing.assert_array_equal(keys[sorted_rows], sorted_keys)
+        np.testing.assert_array_equal(opened.lookup(keys), np.arange(100))
+
+    query = np.concatenate([keys[::-7], np.array([12345], dtype=np.uint64)])
+    values, found = reader.get(query)
+    np.testing.assert_array_equal(found, np.r_[np.ones(len(query) - 1, dtype=bool), False])
+    np.testing.assert_array_equal(values[:-1], embeddings[::-7])
+    assert not values[-1].any()
@@ -0,0 +1,46 @@
+"""
+批量预处理：与逐张PIL + torchvision的参考流程结果一致
+"""
+
+import pytest
+import torch
+
+from utils.image_preprocess import CLIP_MEAN, CLIP_STD, ImagePreprocessor, _pil_preprocess
+
+pytest.importorskip("torchvision")
+
+
+def smooth_images(height: int, width: int, batch_size: int = 2) -> torch.Tensor:
+    """平滑的渐变图像，量化为8位以便与PIL输入一致"""
+    y = torch.linspace(0, 1, height)[:, None, None]
+    x = torch.linspace(0, 1, width)[None, :, None]
+    images = []
+    for i in range(batch_size):
+        image = torch.cat([y * x, (1 - y) * x, 0.5 + 0.5 * torch.sin(6 * y + 3 * x + i)], dim=-1)
+        images.append((image * 255).round() / 255)
+    return torch.stack(images)
+
+
+@pytest.mark.parametrize("height, width", [(300, 400), (512, 384), (160, 200), (224, 224)])
+def test_batched_preprocess_matches_pil(height, width):
+    images = smooth_images(height, width)
+    batched = ImagePreprocessor(size=224).preprocess(images)
+    reference = _pil_preprocess(images, 224, CLIP_MEAN, CLIP_STD)
+
+    assert batched.shape == reference.shape == (2, 3, 224, 224)
+    assert batched.is_contiguous(memory_format=torch.channels_last)
+    # 比较归一化前的像素值（0~1）
+    difference = ((batched - reference) * torch.tensor(CLIP_STD).view(1, 3, 1, 1)).abs()
+    assert difference.mean() < 2e-3
+    assert difference.max() < 1e-2
+
+
+def test_preprocess_list_groups_resolutions_and_keeps_order():
+    preprocessor = ImagePreprocessor(size=64)
+    images = [smooth_images(80, 120, 1)[0], smooth_images(96, 96, 1)[0], smooth_images(80, 120, 1)]
+    batched = preprocessor.preprocess_list(images)
+
+    assert batched.shape == (3, 3, 64, 64)
+    for i, image in enumerate(images):
+        torch.testing.assert_close(batched[i], preprocessor.preprocess(image)[0])
+    assert len(preprocessor._plans) == 2
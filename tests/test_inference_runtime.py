@@ -0,0 +1,53 @@
+"""
+CPU推理运行时：导出缓存复用已计算的检查点指纹，精度对比表与线程设置失败提示
+"""
+
+import torch
+
+from utils import inference_runtime
+from utils.clip_analyzer import CLIPAnalyzerTool
+from utils.inference_runtime import (
+    PRECISION_MODES, benchmark_precision_modes, configure_cpu_threads, export_vision_encoder, format_benchmark_table
+)
+from utils.workflow_replay import FakeCLIPVision, fake_text_encoder
+
+
+def test_export_uses_the_loaded_checkpoint_key(tmp_path, monkeypatch):
+    def no_rehash(path):
+        raise AssertionError("导出时不应重新读取检查点计算指纹")
+
+    monkeypatch.setattr(inference_runtime, "checkpoint_hash", no_rehash)
+    clip_vision = FakeCLIPVision(dim=16)
+    clip_vision.checkpoint_key = "loaded"
+
+    encoder = export_vision_encoder(clip_vision, str(tmp_path / "missing.safetensors"), "torchscript",
+                                    cache_dir=str(tmp_path))
+    assert encoder is not None
+    assert encoder.path == str(tmp_path / "loaded_224.pt")
+
+    pixels = torch.rand(2, 3, 224, 224)
+    torch.testing.assert_close(encoder(pixels), clip_vision.model(pixels)[2], rtol=1e-4, atol=1e-5)
+
+    explicit = export_vision_encoder(clip_vision, "", "torchscript", cache_dir=str(tmp_path), checkpoint_key="other")
+    assert explicit.path == str(tmp_path / "other_224.pt")
+
+
+def test_benchmark_table_lists_every_precision_mode():
+    analyzer = CLIPAnalyzerTool()
+    analyzer.set_text_encoder(fake_text_encoder(16), "benchmark")
+    report = benchmark_precision_modes(FakeCLIPVision(dim=16), torch.rand(2, 3, 224, 224), analyzer, repeats=1)
+
+    assert list(report) == list(PRECISION_MODES)
+    assert report["float32"]["topk_agreement"] == 1.0
+    table = format_benchmark_table(report).splitlines()
+    assert len(table) == 1 + len(PRECISION_MODES)
+    assert [line.split()[0] for line in table[1:]] == list(PRECISION_MODES)
+
+
+def test_interop_thread_failure_is_reported(monkeypatch, capsys):
+    def already_started(threads):
+        raise RuntimeError("cannot set number of interop threads after parallel work has started")
+
+    monkeypatch.setattr(torch, "set_num_interop_threads", already_started)
+    configure_cpu_threads(0, torch.get_num_interop_threads() + 1)
+    assert "⚠️" in capsys.readouterr().out
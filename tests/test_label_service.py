@@ -0,0 +1,115 @@
+"""
+本地标签服务：在 localhost 的临时端口上离线测试批处理、错误请求与统计接口
+"""
+
+import asyncio
+import io
+import json
+import zlib
+from urllib.parse import quote
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from utils.clip_analyzer import clip_analyzer
+from utils.label_service import LabelService
+
+# 没有视觉模型时，图像特征为 4×4 平均池化后的像素（3×16 维）
+EMBED_DIM = 48
+
+
+def fake_text_encoder(prompts):
+    rows = [np.random.default_rng(zlib.crc32(p.encode("utf-8"))).standard_normal(EMBED_DIM) for p in prompts]
+    return np.asarray(rows, dtype=np.float32)
+
+
+def png_bytes(seed: int, size=(32, 24)) -> bytes:
+    pixels = np.random.default_rng(seed).integers(0, 256, (size[1], size[0], 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+async def request(port: int, method: str, path: str, body: bytes = b"", request_line: str = None):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    request_line = request_line or f"{method} {path} HTTP/1.1"
+    writer.write(f"{request_line}\r\nHost: localhost\r\nContent-Length: {len(body)}\r\n\r\n".encode("latin-1") + body)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, payload = response.partition(b"\r\n\r\n")
+    return int(head.split(b" ", 2)[1]), json.loads(payload.decode("utf-8"))
+
+
+@pytest.fixture
+def text_encoder():
+    previous = (clip_analyzer._text_encoder, clip_analyzer._text_encoder_key)
+    clip_analyzer.set_text_encoder(fake_text_encoder, "test_label_service")
+    yield
+    clip_analyzer.set_text_encoder(*previous)
+
+
+def run_service(scenario, **kwargs):
+    async def main():
+        service = LabelService(port=0, **kwargs)
+        port = await service.start()
+        try:
+            return await scenario(service, port)
+        finally:
+            await service.stop()
+    return asyncio.run(main())
+
+
+def test_concurrent_requests_are_batched(text_encoder):
+    async def scenario(service, port):
+        responses = await asyncio.gather(*[
+            request(port, "POST", f"/label?threshold={0.1 * (i % 3)}&language={quote('英文' if i % 2 else '中文')}",
+                    png_bytes(i))
+            for i in range(6)
+        ])
+        _, stats = await request(port, "GET", "/stats")
+        return responses, stats
+
+    responses, stats = run_service(scenario, max_batch_size=8, max_wait_ms=200)
+    assert [status for status, _ in responses] == [200] * 6
+    for i, (_, payload) in enumerate(responses):
+        assert set(payload) == {"labels", "formatted", "clip_analysis", "analysis_text"}
+        confidences = [data["confidence"] for data in payload["clip_analysis"].values()]
+        assert min(confidences, default=1.0) >= 0.1 * (i % 3) - 1e-6
+    assert stats["requests"] == 6
+    assert stats["batch_size_max"] > 1
+    assert stats["batches"] < 6
+
+
+def test_batched_scores_match_single_requests(text_encoder):
+    async def scenario(service, port):
+        batched = await asyncio.gather(*[request(port, "POST", "/label?threshold=0", png_bytes(i)) for i in range(3)])
+        single = [await request(port, "POST", "/label?threshold=0", png_bytes(i)) for i in range(3)]
+        return batched, single
+
+    batched, single = run_service(scenario, max_batch_size=8, max_wait_ms=100)
+    for (_, a), (_, b) in zip(batched, single):
+        assert a["clip_analysis"].keys() == b["clip_analysis"].keys()
+        for name in a["clip_analysis"]:
+            assert a["clip_analysis"][name]["confidence"] == pytest.approx(b["clip_analysis"][name]["confidence"],
+                                                                           rel=1e-5)
+
+
+@pytest.mark.parametrize("path, body, request_line", [
+    ("/label?threshold=2", png_bytes(0), None),
+    ("/label?threshold=abc", png_bytes(0), None),
+    ("/label", b"not an image", None),
+    ("/label", b"", None),
+    ("/label", b"", "GARBAGE"),
+])
+def test_bad_requests_return_400(text_encoder, path, body, request_line):
+    async def scenario(service, port):
+        status, payload = await request(port, "POST", path, body, request_line)
+        health = await request(port, "GET", "/health")
+        return status, payload, health
+
+    status, payload, health = run_service(scenario, max_wait_ms=1)
+    assert status == 400
+    assert "error" in payload
+    assert health == (200, {"status": "ok"})
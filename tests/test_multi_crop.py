@@ -0,0 +1,86 @@
+"""
+多区域分析：裁剪为原张量的视图，所有裁剪一次编码，区域分数只路由到对应类别
+"""
+
+import numpy as np
+import pytest
+import torch
+
+from utils.clip_analyzer import clip_analyzer
+from utils.multi_crop import REGION_ROUTING, MultiCropAnalyzerTool
+from utils.workflow_replay import FakeCLIPVision, fake_text_encoder
+
+EMBED_DIM = 16
+
+
+@pytest.fixture
+def text_encoder():
+    previous = (clip_analyzer._text_encoder, clip_analyzer._text_encoder_key)
+    clip_analyzer.set_text_encoder(fake_text_encoder(EMBED_DIM), "test_multi_crop")
+    yield
+    clip_analyzer.set_text_encoder(*previous)
+
+
+def counting_vision_model():
+    clip_vision = FakeCLIPVision(dim=EMBED_DIM)
+    calls = []
+    forward = clip_vision.model.forward
+    clip_vision.model.forward = lambda pixel_values, **kwargs: calls.append(len(pixel_values)) or \
+        forward(pixel_values, **kwargs)
+    return clip_vision, calls
+
+
+def test_crop_views_are_slices_of_the_input():
+    images = torch.rand(2, 90, 60, 3)
+    crops = dict(MultiCropAnalyzerTool(center_ratio=0.6, grid_size=3).crop_views(images))
+
+    torch.testing.assert_close(crops["中心"], images[:, 27:63, 12:48])
+    assert crops["中心"].untyped_storage().data_ptr() == images.untyped_storage().data_ptr()
+    torch.testing.assert_close(crops["上三分之一"], images[:, :30])
+
+    # 上半部分（45行）按20像素单元切成 2×3 个网格，每张图像的单元连续排列
+    grid = crops["面部网格"]
+    assert grid.shape == (12, 20, 20, 3)
+    torch.testing.assert_close(grid[6 + 1 * 3 + 2], images[1, 20:40, 40:60])
+
+
+def test_regions_are_encoded_once_and_routed_by_category(text_encoder):
+    clip_vision, calls = counting_vision_model()
+    tool = MultiCropAnalyzerTool(full_image_weight=0.25)
+    images = torch.rand(2, 96, 64, 3)
+
+    result, region_scores = tool.analyze_regions(clip_vision, images)
+    assert calls == [2 + 2 + 2 + 2 * 6]
+    assert set(region_scores) == {"全图", *REGION_ROUTING}
+
+    vocab = clip_analyzer.vocabulary
+    full = region_scores["全图"]
+    routed = {region: np.isin(result.feature_ids, vocab.ids_for_categories(categories))
+              for region, categories in REGION_ROUTING.items()}
+    local_count = sum(mask.astype(int) for mask in routed.values())
+    for region, mask in routed.items():
+        assert not region_scores[region][:, ~mask].any()
+
+    unrouted = local_count == 0
+    assert unrouted.any()
+    np.testing.assert_array_equal(result.scores[:, unrouted], full[:, unrouted])
+    local_mean = sum(region_scores[r] for r in REGION_ROUTING)[:, ~unrouted] / local_count[~unrouted]
+    np.testing.assert_allclose(result.scores[:, ~unrouted], 0.25 * full[:, ~unrouted] + 0.75 * local_mean,
+                               rtol=1e-5)
+
+    winners = tool.winning_regions(result.with_threshold(0.0), region_scores)
+    assert len(winners) == 2
+    assert all(region in region_scores for sources in winners for region in sources.values())
+
+
+def test_precomputed_full_embeddings_are_not_encoded_again(text_encoder):
+    clip_vision, calls = counting_vision_model()
+    images = torch.rand(1, 64, 64, 3)
+    full_embeddings = clip_analyzer.encode_images(clip_vision, images)
+    calls.clear()
+
+    result, region_scores = MultiCropAnalyzerTool().analyze_regions(clip_vision, images, full_embeddings)
+    # 中心 + 上三分之一 + 上半部分（32行）的 1×3 个21像素网格单元
+    assert calls == [1 + 1 + 3]
+    np.testing.assert_allclose(region_scores["全图"], clip_analyzer.score_embeddings(full_embeddings, result.feature_ids),
+                               rtol=1e-6)
@@ -0,0 +1,79 @@
+"""
+自由文本变量提取：补充模式下未生效的匹配必须保留在附加标签中，选择器的默认值视为未指定
+"""
+
+import os
+
+from utils.prompt_extractor import prompt_extractor
+from utils.variable_processor import variable_processor
+from utils.workflow_replay import load_plugin
+
+TEXT = "金色长发的精灵少女在森林里微笑, masterpiece"
+
+
+def full_selection():
+    """模拟选择器为每个变量都选了取值的输出"""
+    snapshot = variable_processor.get_snapshot()
+    core = {
+        category: {name: options[0] for name, options in variables.items() if isinstance(options, list)}
+        for category, variables in snapshot.core_variables.items()
+    }
+    variable = {
+        category: {name: {"一级": levels["一级"][0], "二级": ""}
+                   for name, levels in subcategories.items() if isinstance(levels, dict)}
+        for category, subcategories in snapshot.variable_variables.items()
+    }
+    return core, variable
+
+
+def test_supplement_with_every_selector_filled_keeps_free_text():
+    core, variable = full_selection()
+    merged_core, merged_variable, remainder = prompt_extractor.apply(core, variable, TEXT, "补充")
+
+    assert merged_core == core
+    assert merged_variable == variable
+    assert remainder.split(", ") == ["金色长发的精灵少女在森林里微笑", "masterpiece"]
+
+
+def test_supplement_with_empty_selectors_consumes_matched_segments():
+    merged_core, merged_variable, remainder = prompt_extractor.apply({}, {}, TEXT, "补充")
+
+    assert merged_core and merged_variable
+    assert remainder == "masterpiece"
+
+
+def test_override_consumes_matched_segments():
+    core, variable = full_selection()
+    merged_core, _, remainder = prompt_extractor.apply(core, variable, TEXT, "覆盖")
+
+    assert merged_core != core
+    assert remainder == "masterpiece"
+
+
+def test_stock_selectors_leave_variables_unset_for_supplement():
+    nodes = load_plugin().nodes
+    defaults = {
+        name: spec[1]["default"]
+        for selector in (nodes.CoreVariableSelector, nodes.VariableVariableSelector)
+        for name, spec in selector.INPUT_TYPES()["required"].items()
+    }
+    assert set(defaults.values()) == {nodes.UNSET_OPTION}
+
+    core, _ = nodes.CoreVariableSelector().select_core_variables(**defaults)
+    variable, _ = nodes.VariableVariableSelector().select_variable_variables(**defaults)
+    assert not any(core.values()) and not any(variable.values())
+
+    merged_core, merged_variable, remainder = nodes.prompt_extractor.apply(core, variable, TEXT, "补充")
+    assert merged_core and merged_variable
+    assert remainder == "masterpiece"
+
+
+def test_extract_batch_checks_config_once(monkeypatch):
+    prompt_extractor.automaton()
+    stats = []
+    real_stat = os.stat
+    monkeypatch.setattr(os, "stat", lambda *args, **kwargs: stats.append(args) or real_stat(*args, **kwargs))
+
+    results = prompt_extractor.extract_batch([TEXT] * 20)
+    assert len(stats) == 3
+    assert all(result == results[0] for result in results)
@@ -0,0 +1,100 @@
+"""
+结果存储：标签交集查询（置信度、来源、类别过滤），分数还原与标签ID写入
+"""
+
+import sqlite3
+
+import numpy as np
+import pytest
+
+from utils.analysis_result import AnalysisResult, FeatureVocabulary
+from utils.results_store import (ResultsStore, SOURCE_CLIP, SOURCE_CORE, SOURCE_VARIABLE, records_from_batch,
+                                 _to_sql_key)
+
+VOCABULARY = FeatureVocabulary(["夜晚", "城市", "森林", "微笑"], ["night", "city", "forest", "smiling"],
+                               ["环境", "环境", "环境", "表情"])
+# 第三张图像的哈希超过 2^63，以负数主键存储
+HASHES = [1, 2, (1 << 64) - 5]
+SCORES = np.array([
+    [0.90, 0.85, 0.10, 0.60],
+    [0.95, 0.40, 0.70, 0.55],
+    [0.70, 0.90, 0.20, 0.95],
+], dtype=np.float32)
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ResultsStore(str(tmp_path / "results.db"), index_floor=0.5)
+    clip_scores = AnalysisResult(VOCABULARY, SCORES, np.arange(4))
+    core = {"appearance": {"hair_style": "长发"}}
+    variable = {"environment": {"time": {"一级": "夜晚", "二级": "深夜"}}}
+    store.add(records_from_batch(HASHES, ["a", "b", "c"], clip_scores, core, variable))
+    yield store
+    store.close()
+
+
+def test_find_intersects_all_tags(store):
+    assert sorted(store.find(["夜晚"])) == sorted(HASHES)
+    assert sorted(store.find(["夜晚", "城市"])) == [1, HASHES[2]]
+    assert store.find(["夜晚", "城市", "森林"]) == []
+    assert store.find(["不存在"]) == []
+    assert store.find([]) == []
+
+
+def test_find_filters_confidence_source_and_category(store):
+    # "夜晚" 同时来自可变变量（置信度1）和CLIP；只看CLIP时才受分数影响
+    assert sorted(store.find(["夜晚"], min_confidence=0.92)) == sorted(HASHES)
+    assert store.find(["夜晚"], min_confidence=0.92, source=SOURCE_CLIP) == [2]
+    assert sorted(store.find(["城市", "微笑"], min_confidence=0.8)) == [HASHES[2]]
+    assert sorted(store.find(["夜晚"], category="环境")) == sorted(HASHES)
+    assert sorted(store.find(["夜晚"], category="environment.time")) == sorted(HASHES)
+    assert store.find(["夜晚"], category="表情") == []
+    assert store.find(["长发", "深夜"], source=SOURCE_CORE) == []
+    assert sorted(store.find(["深夜"], source=SOURCE_VARIABLE)) == sorted(HASHES)
+    assert len(store.find(["夜晚"], limit=2)) == 2
+
+
+def test_get_restores_scores_and_tags(store):
+    record = store.get(HASHES[2])
+    assert record["labels"] == "c"
+    assert record["clip_scores"] == pytest.approx(dict(zip(VOCABULARY.names_cn, SCORES[2].tolist())))
+    tags = {(tag["name"], tag["source"]) for tag in record["tags"]}
+    assert ("长发", SOURCE_CORE) in tags and ("深夜", SOURCE_VARIABLE) in tags
+    # 低于 index_floor 的CLIP分数只保存在分数向量中
+    assert ("森林", SOURCE_CLIP) not in tags
+    assert store.get(3) is None
+    assert store.category_counts("环境") == {"夜晚": 3, "城市": 2, "森林": 1}
+
+
+def test_get_without_vocabulary_keys_scores_by_feature_index(store):
+    connection = store.connection()
+    connection.execute("UPDATE images SET vocabulary_id = NULL WHERE image_id = ?", (_to_sql_key(1),))
+    connection.execute("UPDATE images SET vocabulary_id = 999 WHERE image_id = ?", (_to_sql_key(2),))
+    for image_hash in (1, 2):
+        row = HASHES.index(image_hash)
+        assert store.get(image_hash)["clip_scores"] == pytest.approx(dict(enumerate(SCORES[row].tolist())))
+
+
+def test_tag_ids_are_reused_across_stores(store, tmp_path):
+    tag_ids = dict(store._tag_ids)
+    assert len(tag_ids) == len(set(tag_ids.values()))
+    rows = store.connection().execute("SELECT name, category, tag_id FROM tags").fetchall()
+    assert {(name, category): tag_id for name, category, tag_id in rows} == tag_ids
+
+    # 另一个连接（缓存为空）写入已存在的标签时沿用原ID，不产生重复行
+    other = ResultsStore(store.path)
+    statements = []
+    other.connection().set_trace_callback(statements.append)
+    clip_scores = AnalysisResult(VOCABULARY, SCORES[:1], np.arange(4))
+    other.add(records_from_batch([7], ["d"], clip_scores, {"appearance": {"hair_style": "短发"}}))
+    # 新标签由 lastrowid 取得ID，只有已存在的标签才查询
+    lookups = [sql for sql in statements if sql.startswith("SELECT tag_id")]
+    assert len(lookups) == len([name for name in VOCABULARY.names_cn if name != "森林"])
+    assert not any("短发" in sql for sql in lookups)
+    assert other._tag_ids[("夜晚", "环境")] == tag_ids[("夜晚", "环境")]
+    assert ("短发", "appearance.hair_style") not in tag_ids
+    assert other._vocabulary_ids == store._vocabulary_ids
+    assert sorted(other.find(["夜晚", "城市"])) == [1, 7, HASHES[2]]
+    with pytest.raises(sqlite3.IntegrityError):
+        other.connection().execute("INSERT INTO tags (name, category) VALUES ('夜晚', '环境')")
+    other.close()
@@ -0,0 +1,91 @@
+"""
+帧序列标签：低成本签名选出关键帧，只编码关键帧，分数插值传播到所有帧
+"""
+
+import numpy as np
+import pytest
+import torch
+import torch.nn.functional as F
+
+from utils.clip_analyzer import clip_analyzer
+from utils.sequence_labeler import SIGNATURE_METHODS, SequenceLabelerTool
+from utils.workflow_replay import FakeCLIPVision, fake_text_encoder
+
+EMBED_DIM = 16
+
+
+def scene_clip(scenes: int = 3, frames_per_scene: int = 5, size: int = 64) -> torch.Tensor:
+    """每个镜头为一张平滑的随机图像，镜头内各帧只有轻微噪声"""
+    frames = []
+    for scene in range(scenes):
+        generator = torch.Generator().manual_seed(scene)
+        base = F.interpolate(torch.rand(1, 3, 4, 4, generator=generator), size=(size, size),
+                             mode="bilinear", align_corners=False)[0].permute(1, 2, 0)
+        for _ in range(frames_per_scene):
+            frames.append((base + 0.003 * torch.randn(size, size, 3, generator=generator)).clamp(0, 1))
+    return torch.stack(frames)
+
+
+@pytest.fixture
+def text_encoder():
+    previous = (clip_analyzer._text_encoder, clip_analyzer._text_encoder_key)
+    clip_analyzer.set_text_encoder(fake_text_encoder(EMBED_DIM), "test_sequence_labeler")
+    yield
+    clip_analyzer.set_text_encoder(*previous)
+
+
+def test_signatures_shapes_and_dhash_brightness_invariance():
+    labeler = SequenceLabelerTool(thumbnail_size=16, hash_size=8)
+    frames = scene_clip(scenes=1, frames_per_scene=2)
+
+    thumbnails = labeler.frame_signatures(frames, "缩略图")
+    assert thumbnails.shape == (2, 256) and thumbnails.dtype == np.float32
+    hashes = labeler.frame_signatures(frames, "差异哈希")
+    assert hashes.shape == (2, 64) and hashes.dtype == bool
+
+    # 差异哈希只比较相邻像素，整体亮度变化不改变签名
+    brighter = labeler.frame_signatures((frames * 0.8 + 0.1), "差异哈希")
+    np.testing.assert_array_equal(brighter, hashes)
+
+
+@pytest.mark.parametrize("method", SIGNATURE_METHODS)
+def test_keyframes_at_scene_cuts(method):
+    labeler = SequenceLabelerTool()
+    signatures = labeler.frame_signatures(scene_clip(), method)
+    assert labeler.select_keyframes(signatures, 0.05) == [0, 5, 10]
+    # 阈值为1时只有第一帧是关键帧
+    assert labeler.select_keyframes(signatures, 1.0) == [0]
+
+
+def test_propagate_interpolates_between_keyframes_and_holds_after_last():
+    key_scores = np.array([[0.0, 1.0], [1.0, 0.0], [0.5, 0.5]], dtype=np.float32)
+    scores = SequenceLabelerTool.propagate_scores([0, 4, 6], key_scores, 9)
+
+    np.testing.assert_allclose(scores[:, 0], [0.0, 0.25, 0.5, 0.75, 1.0, 0.75, 0.5, 0.5, 0.5])
+    np.testing.assert_allclose(scores.sum(axis=1), 1.0)
+    single = SequenceLabelerTool.propagate_scores([0], key_scores[:1], 3)
+    np.testing.assert_array_equal(single, np.repeat(key_scores[:1], 3, axis=0))
+
+    smoothed = SequenceLabelerTool.propagate_scores([0, 4, 6], key_scores, 9, smoothing_window=3)
+    assert smoothed.shape == (9, 2)
+    np.testing.assert_allclose(smoothed[2], scores[1:4].mean(axis=0), rtol=1e-6)
+    np.testing.assert_allclose(smoothed[-1], scores[-1])
+
+
+def test_label_sequence_encodes_only_keyframes(text_encoder):
+    clip_vision = FakeCLIPVision(dim=EMBED_DIM)
+    encoded = []
+    forward = clip_vision.model.forward
+    clip_vision.model.forward = lambda pixel_values, **kwargs: encoded.append(len(pixel_values)) or \
+        forward(pixel_values, **kwargs)
+
+    frames = scene_clip()
+    result, keyframes = SequenceLabelerTool().label_sequence(clip_vision, frames, change_threshold=0.05,
+                                                              threshold=0.0, smoothing_window=1)
+    assert keyframes == [0, 5, 10]
+    assert sum(encoded) == 3
+    assert result.batch_size == len(frames)
+
+    # 关键帧上的分数等于单独分析该帧
+    direct = clip_analyzer.score_embeddings(clip_analyzer.encode_images(clip_vision, frames[[5]]), result.feature_ids)
+    np.testing.assert_allclose(result.scores[5], direct[0], rtol=1e-4, atol=1e-7)
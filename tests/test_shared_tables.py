@@ -0,0 +1,109 @@
+"""
+共享内存表：其他进程附加后退出不会删除发布者的段，并发读取与释放不会拿到 None
+"""
+
+import multiprocessing
+import os
+import subprocess
+import sys
+import threading
+import uuid
+
+import numpy as np
+import pytest
+
+from utils.analysis_result import FeatureVocabulary
+from utils.shared_tables import SharedTableManager, attach_tables, publish_tables, _tracker_identity
+
+pytestmark = pytest.mark.skipif(os.name != "posix", reason="resource_tracker 只在 POSIX 上使用")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+VOCABULARY = FeatureVocabulary(["长发", "微笑", "城市"], ["long hair", "smiling", "city"], ["人物", "表情", "环境"])
+EMBEDDINGS = np.arange(12, dtype=np.float32).reshape(3, 4)
+
+
+def unique_key() -> str:
+    return uuid.uuid4().hex
+
+
+def attach_in_child(key: str, queue):
+    tables = attach_tables(key, timeout=5.0)
+    if tables is None:
+        queue.put(None)
+        return
+    queue.put((float(tables.embeddings.sum()), tables.vocabulary.names_en, _tracker_identity()))
+    tables.close()
+
+
+def test_spawned_child_shares_tracker_and_leaves_owner_registration(capfd):
+    key = unique_key()
+    tables = publish_tables(key, VOCABULARY, EMBEDDINGS)
+    try:
+        context = multiprocessing.get_context("spawn")
+        queue = context.Queue()
+        child = context.Process(target=attach_in_child, args=(key, queue))
+        child.start()
+        checksum, names, child_tracker = queue.get(timeout=60)
+        child.join(timeout=60)
+        assert child.exitcode == 0
+        assert checksum == float(EMBEDDINGS.sum())
+        assert names == VOCABULARY.names_en
+        # 子进程继承了同一个 resource_tracker，附加时不应取消发布者的登记
+        assert child_tracker == _tracker_identity()
+    finally:
+        assert tables.close()
+    assert attach_tables(key, timeout=0.1) is None
+
+
+def test_independent_process_exit_keeps_segment():
+    key = unique_key()
+    tables = publish_tables(key, VOCABULARY, EMBEDDINGS)
+    try:
+        code = (
+            "import sys; from utils.shared_tables import attach_tables\n"
+            f"tables = attach_tables({key!r})\n"
+            "sys.exit(0 if tables is not None and float(tables.embeddings.sum()) == 66.0 else 1)\n"
+        )
+        result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, timeout=120)
+        assert result.returncode == 0, result.stderr
+        assert "leaked shared_memory" not in result.stderr
+
+        # 独立进程的 resource_tracker 退出后，段仍然存在
+        again = attach_tables(key, timeout=1.0)
+        assert again is not None
+        np.testing.assert_array_equal(again.embeddings, EMBEDDINGS)
+        assert again.close()
+    finally:
+        assert tables.close()
+
+
+def test_get_or_build_never_returns_none_during_release():
+    manager = SharedTableManager(enabled=True)
+    key = unique_key()
+    errors = []
+    stop = threading.Event()
+
+    def reader():
+        try:
+            while not stop.is_set():
+                embeddings = manager.get_or_build(key, VOCABULARY, lambda: EMBEDDINGS.copy())
+                assert embeddings is not None
+                assert float(embeddings.sum()) == float(EMBEDDINGS.sum())
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+
+    def releaser():
+        while not stop.is_set():
+            manager.release()
+
+    threads = [threading.Thread(target=reader) for _ in range(3)] + [threading.Thread(target=releaser)]
+    for thread in threads:
+        thread.start()
+    stop.wait(1.0)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    manager.release(detach=True)
+    assert errors == []
@@ -0,0 +1,139 @@
+"""
+标签统计：Count-Min Sketch 的估计上下界与合并，词表变化时计数按标签名迁移
+"""
+
+import numpy as np
+import pytest
+
+from utils.tag_statistics import CountMinSketch, TagStatistics, _TagVocabulary, split_tags
+from utils.variable_processor import variable_processor
+
+
+def zipf_stream(rng, size: int, tags: int = 2000):
+    ranks = np.minimum(rng.zipf(1.3, size), tags)
+    return [f"free_{rank}" for rank in ranks.tolist()]
+
+
+def test_sketch_never_underestimates_and_stays_within_bound():
+    rng = np.random.default_rng(0)
+    stream = zipf_stream(rng, 20000)
+    sketch = CountMinSketch(width=256, depth=4)
+    for start in range(0, len(stream), 500):
+        sketch.add(stream[start:start + 500])
+
+    tags, truth = np.unique(stream, return_counts=True)
+    estimates = sketch.estimate(list(tags))
+    assert sketch.total == len(stream)
+    assert np.all(estimates >= truth)
+    # 误差上界以 1 - e^-depth 的概率成立，绝大多数标签都应在界内
+    assert np.mean(estimates - truth <= sketch.error_bound) > 0.95
+    assert sketch.estimate([]).size == 0
+
+
+def test_sketch_merge_matches_single_sketch():
+    stream = zipf_stream(np.random.default_rng(1), 5000)
+    whole, first, second = CountMinSketch(512, 3), CountMinSketch(512, 3), CountMinSketch(512, 3)
+    whole.add(stream)
+    first.add(stream[:2000])
+    second.add(stream[2000:], [1] * 3000)
+    first.merge(second)
+    np.testing.assert_array_equal(first.table, whole.table)
+    assert first.total == whole.total
+
+    with pytest.raises(ValueError):
+        first.merge(CountMinSketch(256, 3))
+
+
+def test_split_tags_separates_levels_and_deduplicates():
+    assert split_tags("长发，夜晚(深夜), 长发, night (late night),") == ["长发", "夜晚", "深夜", "night", "late night"]
+
+
+def test_heavy_hitters_keep_most_frequent_free_tags():
+    statistics = TagStatistics(sketch_width=1024, heavy_hitters=10)
+    stream = zipf_stream(np.random.default_rng(2), 10000)
+    for start in range(0, len(stream), 5):
+        statistics.add(", ".join(stream[start:start + 5]))
+
+    tags, truth = np.unique(stream, return_counts=True)
+    expected = set(tags[np.argsort(-truth, kind="stable")[:5]].tolist())
+    found = [tag for tag, _ in statistics.heavy_hitters(10)]
+    assert expected <= set(found)
+    assert len(statistics._candidates) <= 2 * statistics.heavy_capacity
+
+
+@pytest.fixture
+def vocabulary_change():
+    """把第一个核心变量的一个选项换成新选项，返回 (变量键, 被移除的选项, 保留的选项, 新选项, 新配置快照)"""
+    snapshot = variable_processor.get_snapshot()
+    category, variables = next(iter(snapshot.core_variables.items()))
+    var_name, options = next(iter(variables.items()))
+    added = "测试新增选项"
+
+    def changed_snapshot(removed):
+        core = {c: dict(v) for c, v in snapshot.core_variables.items()}
+        core[category][var_name] = [option for option in options if option != removed] + [added]
+        return snapshot._replace(version=snapshot.version + 1, core_variables=core)
+
+    # 选一个只在这个变量中出现的选项，移除后它会离开词表
+    for removed in options:
+        changed = changed_snapshot(removed)
+        if removed not in _TagVocabulary(changed).index:
+            break
+    else:
+        pytest.skip("没有只属于第一个核心变量的选项")
+    kept = next(option for option in options if option != removed)
+    return f"{category}.{var_name}", removed, kept, added, changed
+
+
+def test_refresh_vocabulary_remaps_counts_by_name(vocabulary_change, monkeypatch):
+    key, removed, kept, added, changed = vocabulary_change
+    statistics = TagStatistics()
+    other = statistics.vocabulary.names[-1]
+    for _ in range(3):
+        statistics.add(f"{removed}, {other}")
+    for _ in range(2):
+        statistics.add(f"{kept}, {other}, 自由标签")
+    assert statistics.core_distributions()[key]["counts"][removed] == 3
+
+    monkeypatch.setattr(variable_processor, "get_snapshot", lambda: changed)
+    change = statistics.refresh_vocabulary()
+    assert change["added"] == 1 and change["removed"] == 1
+    assert statistics.take_notices() == [change]
+    assert statistics.take_notices() == []
+
+    index = statistics.vocabulary.index
+    assert removed not in index and added in index
+    assert statistics.counts[index[kept]] == 2
+    assert statistics.counts[index[other]] == 5
+    assert statistics.counts[index[added]] == 0
+    # 移出词表的标签转入自由标签统计
+    heavy = dict(statistics.heavy_hitters())
+    assert heavy[removed] >= 3
+    assert heavy["自由标签"] >= 2
+
+    # 只剩两端都在新词表中的标签对，按新下标重新编码
+    first, second = sorted((kept, other), key=index.get)
+    assert statistics.top_pairs() == [(first, second, 2)]
+
+    distribution = statistics.core_distributions()[key]
+    assert distribution["counts"][kept] == 2
+    assert distribution["counts"][added] == 0
+    assert distribution["not_in_config"] == {removed: 3}
+    assert statistics.report()["vocabulary_changes"] == [change]
+
+    # 新词表下继续累积
+    statistics.add(f"{added}, {other}")
+    assert statistics.counts[index[added]] == 1
+
+
+def test_version_change_with_same_vocabulary_keeps_statistics(monkeypatch):
+    snapshot = variable_processor.get_snapshot()
+    statistics = TagStatistics()
+    statistics.add(statistics.vocabulary.names[0])
+    bumped = snapshot._replace(version=snapshot.version + 1)
+    monkeypatch.setattr(variable_processor, "get_snapshot", lambda: bumped)
+
+    assert statistics.refresh_vocabulary() is None
+    assert statistics.config_version == bumped.version
+    assert statistics.vocabulary_changes == []
+    assert statistics.counts[0] == 1
@@ -0,0 +1,70 @@
+"""
+输出模板：编译后的函数与槽位语义，模板文件在读取时校验
+"""
+
+import json
+
+import pytest
+
+from utils.template_registry import TemplateRegistry, compile_template, TEMPLATE_CONFIG_FILE
+
+
+def write_templates(tmp_path, data):
+    with open(tmp_path / TEMPLATE_CONFIG_FILE, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+
+
+def test_compiled_template_skips_empty_sections():
+    render = compile_template({
+        "sections": ["人物特征为{core|、}", "{clip}", "全部: {all|/}"],
+        "joiner": "，", "prefix": "[", "suffix": "]",
+    })
+    assert render(["长发", "微笑"], [], [], [], ", ") == "[人物特征为长发、微笑，全部: 长发/微笑]"
+    assert render([], [], ["城市", "夜晚"], [], " | ") == "[城市 | 夜晚，全部: 城市/夜晚]"
+    assert render([], [], [], [], ", ") == ""
+
+
+@pytest.mark.parametrize("definition, message", [
+    ({"sections": ["{face}"]}, "未知槽位"),
+    ({"sections": []}, "sections"),
+    ({"sections": [1]}, "字符串"),
+])
+def test_compile_rejects_invalid_definitions(definition, message):
+    with pytest.raises(ValueError, match=message):
+        compile_template(definition)
+
+
+def test_language_overrides(tmp_path):
+    registry = TemplateRegistry(str(tmp_path))
+    assert registry.render("自然语言", ["长发"], [], ["城市"], [], language="中文") == "人物特征为长发，画面中可以看到城市。"
+    assert registry.render("自然语言", ["long hair"], [], [], [], language="英文") == "A character with long hair."
+
+
+def test_non_object_file_falls_back_to_defaults(tmp_path, capsys):
+    write_templates(tmp_path, ["kohya"])
+    registry = TemplateRegistry(str(tmp_path))
+    assert registry.names() == ["kohya", "danbooru", "自然语言"]
+    assert "❌" in capsys.readouterr().out
+
+
+def test_invalid_templates_are_dropped_when_loaded(tmp_path, capsys):
+    write_templates(tmp_path, {
+        "好": {"sections": ["{core}", "{clip}"]},
+        "未知槽位": {"sections": ["{core}", "{face}"]},
+        "英文未知槽位": {"sections": ["{core}"], "languages": {"英文": {"sections": ["{hair}"]}}},
+        "不是对象": "{core}",
+    })
+    registry = TemplateRegistry(str(tmp_path))
+    assert registry.names() == ["好"]
+    output = capsys.readouterr().out
+    assert all(name in output for name in ("未知槽位", "英文未知槽位", "不是对象"))
+    assert registry.lookup("未知槽位") is None
+    assert registry.render("好", ["长发"], [], ["城市"], []) == "长发, 城市"
+
+
+def test_refresh_picks_up_edits(tmp_path):
+    write_templates(tmp_path, {"a": {"sections": ["{core}"]}})
+    registry = TemplateRegistry(str(tmp_path))
+    assert registry.names() == ["a"]
+    write_templates(tmp_path, {"a": {"sections": ["{core}"]}, "b": {"sections": ["{clip}"]}})
+    assert registry.names() == ["a", "b"]
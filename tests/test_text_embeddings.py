@@ -0,0 +1,66 @@
+"""
+文本嵌入表：折叠后的矩阵与打分参数只构建一次，模板文件只在 refresh() 时检查
+"""
+
+import json
+import os
+import zlib
+
+import numpy as np
+import torch
+
+from utils.clip_analyzer import CLIPAnalyzerTool
+from utils.text_embeddings import TextEmbeddingBank, PROMPT_TEMPLATE_FILE, text_embedding_bank
+
+EMBED_DIM = 16
+
+
+def fake_text_encoder(prompts):
+    rows = [np.random.default_rng(zlib.crc32(p.encode("utf-8"))).standard_normal(EMBED_DIM) for p in prompts]
+    return np.asarray(rows, dtype=np.float32)
+
+
+def test_tables_are_memoized_per_vocabulary_and_encoder(tmp_path, monkeypatch):
+    bank = TextEmbeddingBank(str(tmp_path))
+    vocabulary = CLIPAnalyzerTool().vocabulary
+    calls = []
+    monkeypatch.setattr(bank, "prompts_for", lambda vocab, _inner=bank.prompts_for: calls.append(1) or _inner(vocab))
+
+    first = bank.tables(vocabulary, fake_text_encoder, "memo")
+    stats = []
+    real_stat = os.stat
+    monkeypatch.setattr(os, "stat", lambda *args, **kwargs: stats.append(args) or real_stat(*args, **kwargs))
+    for _ in range(10):
+        assert bank.tables(vocabulary, fake_text_encoder, "memo") is first
+
+    assert len(calls) == 1
+    assert stats == []
+    assert first.embeddings.shape == (len(vocabulary), EMBED_DIM)
+    assert bank.tables(vocabulary, fake_text_encoder, "other") is not first
+
+
+def test_refresh_picks_up_new_logit_parameters(tmp_path):
+    bank = TextEmbeddingBank(str(tmp_path))
+    vocabulary = CLIPAnalyzerTool().vocabulary
+    before = bank.tables(vocabulary, fake_text_encoder, "refresh")
+    assert before.logit_scale == 100.0
+
+    with open(tmp_path / PROMPT_TEMPLATE_FILE, 'w', encoding='utf-8') as f:
+        json.dump({"logit_scale": 50.0, "logit_bias": -10.0}, f)
+    # 未调用 refresh() 时沿用已构建的表
+    assert bank.tables(vocabulary, fake_text_encoder, "refresh") is before
+
+    bank.refresh()
+    after = bank.tables(vocabulary, fake_text_encoder, "refresh")
+    assert (after.logit_scale, after.logit_bias) == (50.0, -10.0)
+    np.testing.assert_allclose(after.confidence(np.array([0.2])), 1 / (1 + np.exp(-(50.0 * 0.2 - 10.0))), rtol=1e-6)
+
+
+def test_score_embeddings_uses_built_tables():
+    analyzer = CLIPAnalyzerTool()
+    analyzer.set_text_encoder(fake_text_encoder, "score")
+    embeddings = torch.nn.functional.normalize(torch.randn(3, EMBED_DIM), dim=-1)
+
+    tables = text_embedding_bank.tables(analyzer.vocabulary, fake_text_encoder, "score")
+    expected = tables.confidence(embeddings.numpy() @ tables.embeddings[analyzer.all_feature_ids].T)
+    np.testing.assert_allclose(analyzer.score_embeddings(embeddings, analyzer.all_feature_ids), expected, rtol=1e-6)
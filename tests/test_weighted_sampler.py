@@ -0,0 +1,97 @@
+"""
+加权抽样：Vose 别名表还原给定的权重分布，抽样频率与权重一致，相同种子结果相同
+"""
+
+import json
+
+import numpy as np
+import pytest
+
+from utils.variable_processor import variable_processor
+from utils.weighted_sampler import OPTION_WEIGHTS_FILE, WeightedVariableSampler, build_alias_table, draw_alias
+
+
+def table_distribution(table):
+    """别名表隐含的精确分布：每格 1/n，按 prob 分给自身，其余分给 alias"""
+    n = len(table.options)
+    distribution = table.prob / n
+    np.add.at(distribution, table.alias, (1.0 - table.prob) / n)
+    return distribution
+
+
+@pytest.mark.parametrize("weights", [
+    [1, 1, 1, 1],
+    [5, 1, 1, 3],
+    [0.1, 100, 0.001, 7, 7, 2.5],
+    [0, 3, 0, 1],
+    [42],
+])
+def test_alias_table_reproduces_weights(weights):
+    options = [f"选项{i}" for i in range(len(weights))]
+    table = build_alias_table(options, weights)
+    assert table.options == tuple(options)
+    assert np.all((table.prob >= 0) & (table.prob <= 1))
+    np.testing.assert_allclose(table_distribution(table), np.asarray(weights) / np.sum(weights), atol=1e-12)
+
+
+def test_all_zero_weights_are_uniform_and_invalid_weights_raise():
+    table = build_alias_table(["a", "b", "c"], [0, 0, 0])
+    np.testing.assert_allclose(table_distribution(table), [1 / 3] * 3)
+    with pytest.raises(ValueError):
+        build_alias_table([], [])
+    with pytest.raises(ValueError):
+        build_alias_table(["a", "b"], [1, -1])
+
+
+def test_draw_frequencies_match_weights():
+    weights = np.array([6, 3, 0, 1], dtype=np.float64)
+    table = build_alias_table(["a", "b", "c", "d"], weights)
+    drawn = draw_alias(table, np.random.default_rng(0), 200_000)
+    frequencies = np.bincount(drawn, minlength=len(weights)) / len(drawn)
+    # 零权重的选项永远不会被抽中
+    assert frequencies[2] == 0
+    np.testing.assert_allclose(frequencies, weights / weights.sum(), atol=0.005)
+
+
+@pytest.fixture
+def expression():
+    snapshot = variable_processor.get_snapshot()
+    for category, subcategories in snapshot.variable_variables.items():
+        for sub_name, levels in subcategories.items():
+            if isinstance(levels, dict) and levels.get("一级") and levels.get("二级"):
+                level1 = next(option for option in levels["一级"] if levels["二级"].get(option))
+                return category, sub_name, level1, levels["二级"][level1]
+    pytest.skip("没有带二级选项的可变变量")
+
+
+def test_sampler_applies_weights_file_and_is_seeded(tmp_path, expression):
+    category, sub_name, level1, level2_options = expression
+    snapshot = variable_processor.get_snapshot()
+    core_category, core_variables = next(iter(snapshot.core_variables.items()))
+    core_name, core_options = next(iter(core_variables.items()))
+
+    prefix = f"{category}.{sub_name}"
+    weights = {
+        "core_variables": {f"{core_category}.{core_name}": {option: 0 for option in core_options[1:]}},
+        "variable_variables": {
+            prefix: {option: 0 for option in snapshot.variable_variables[category][sub_name]["一级"]
+                     if option != level1},
+            f"{prefix}/{level1}": {option: 0 for option in level2_options[1:]},
+        },
+    }
+    with open(tmp_path / OPTION_WEIGHTS_FILE, 'w', encoding='utf-8') as f:
+        json.dump(weights, f, ensure_ascii=False)
+
+    sampler = WeightedVariableSampler(str(tmp_path))
+    selections = sampler.sample(50, seed=7)
+    assert sampler.tables() is sampler.tables()
+    for selection in selections:
+        assert selection["core_variables"][core_category][core_name] == core_options[0]
+        assert selection["variable_variables"][category][sub_name] == {"一级": level1, "二级": level2_options[0]}
+
+    assert sampler.sample(20, seed=3) == sampler.sample(20, seed=3)
+    assert sampler.sample(20, seed=3) != sampler.sample(20, seed=4)
+
+    without_level2 = sampler.sample(5, seed=7, include_core=False, include_level2=False)
+    assert all(selection["core_variables"] == {} for selection in without_level2)
+    assert all(selection["variable_variables"][category][sub_name]["二级"] == "" for selection in without_level2)
@@ -0,0 +1,121 @@
+"""
+工作流回放：节点图按拓扑顺序执行并缓存不依赖图像的节点，回放结束后恢复桩模块
+"""
+
+import json
+import os
+import sys
+from collections import defaultdict
+
+import pytest
+import torch
+
+from utils.workflow_replay import (
+    PACKAGE_NAME, PLUGIN_ROOT, STUB_MODULE_NAMES, SyntheticLoadImage, WorkflowGraph, check_regression, replay
+)
+
+
+class Brightness:
+    RETURN_TYPES = ("FLOAT",)
+    FUNCTION = "measure"
+    calls = 0
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {"required": {"image": ("IMAGE",), "scale": ("FLOAT", {"default": 2.0})}}
+
+    def measure(self, image, scale):
+        Brightness.calls += 1
+        return (float(image.mean()) * scale,)
+
+
+class Prefix:
+    RETURN_TYPES = ("STRING",)
+    FUNCTION = "make"
+    calls = 0
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {"required": {"mode": (["亮度", "对比度"],)}}
+
+    def make(self, mode):
+        Prefix.calls += 1
+        return (mode,)
+
+
+class Report:
+    RETURN_TYPES = ("STRING",)
+    FUNCTION = "report"
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {"required": {"prefix": ("STRING",), "value": ("FLOAT",)}}
+
+    def report(self, prefix, value):
+        return {"ui": {}, "result": (f"{prefix}: {value:.2f}",)}
+
+
+NODE_CLASSES = {"LoadImage": SyntheticLoadImage, "Brightness": Brightness, "Prefix": Prefix, "Report": Report}
+
+WORKFLOW = {
+    "10": {"class_type": "Report", "inputs": {"prefix": ["2", 0], "value": ["3", 0]}},
+    "3": {"class_type": "Brightness", "inputs": {"image": ["1", 0]}},
+    "2": {"class_type": "Prefix", "inputs": {}},
+    "1": {"class_type": "LoadImage", "inputs": {"image": "example.png"}},
+}
+
+
+def test_graph_executes_in_order_and_caches_static_nodes():
+    graph = WorkflowGraph(WORKFLOW, NODE_CLASSES)
+    assert graph.order == ["1", "2", "3", "10"]
+    assert graph.static == {"2"}
+    assert graph.constants["2"] == {"mode": "亮度"} and graph.constants["3"] == {"scale": 2.0}
+
+    Brightness.calls = Prefix.calls = 0
+    instances, cache, node_times = graph.instantiate(), {}, defaultdict(float)
+    for value in (0.25, 0.5):
+        outputs = graph.execute(instances, torch.full((1, 4, 4, 3), value), node_times, cache)
+        assert outputs["10"] == (f"亮度: {value * 2:.2f}",)
+    assert (Prefix.calls, Brightness.calls) == (1, 2)
+    assert set(node_times) == {"LoadImage", "Prefix", "Brightness", "Report"}
+
+
+@pytest.mark.parametrize("workflow, message", [
+    ({"1": {"class_type": "Missing", "inputs": {}}}, "未知的节点类型"),
+    ({"1": {"class_type": "Report", "inputs": {"prefix": ["9", 0], "value": 1.0}}}, "不存在的节点"),
+    ({"1": {"class_type": "Brightness", "inputs": {}}}, "缺少必需输入"),
+    ({"1": {"class_type": "Report", "inputs": {"prefix": ["2", 0], "value": ["1", 0]}},
+      "2": {"class_type": "Report", "inputs": {"prefix": ["1", 0], "value": 1.0}}}, "循环"),
+    ({"nodes": [], "links": []}, "API格式"),
+])
+def test_invalid_graphs_are_rejected(workflow, message):
+    with pytest.raises(ValueError, match=message):
+        WorkflowGraph(workflow, NODE_CLASSES)
+
+
+def test_check_regression_flags_each_metric():
+    baseline = {"throughput_images_per_s": 100.0, "latency_ms": {"p99": 10.0}, "peak_rss_mb": 500.0}
+    assert check_regression(baseline, baseline) == []
+    within = {"throughput_images_per_s": 85.0, "latency_ms": {"p99": 11.5}, "peak_rss_mb": 590.0}
+    assert check_regression(within, baseline, tolerance=0.2) == []
+
+    worse = {"throughput_images_per_s": 70.0, "latency_ms": {"p99": 13.0}, "peak_rss_mb": 700.0}
+    failures = check_regression(worse, baseline, tolerance=0.2)
+    assert len(failures) == 3
+    assert check_regression({**worse, "peak_rss_mb": None}, baseline, tolerance=0.2) == failures[:2]
+
+
+def test_replay_restores_stub_modules_and_plugin():
+    with open(os.path.join(PLUGIN_ROOT, "example_workflow.json"), 'r', encoding='utf-8') as f:
+        workflow = json.load(f)
+    before = {name: sys.modules.get(name) for name in STUB_MODULE_NAMES}
+    plugin_loaded = PACKAGE_NAME in sys.modules
+
+    report = replay(workflow, replays=3, batch_size=2, height=64, width=64, warmup=1, dim=32)
+    assert report["replays"] == 3
+    assert report["batch_size"] == 2 and report["resolution"] == [64, 64]
+    assert "CLIPImageAnalyzer" in report["node_mean_ms"]
+    assert check_regression(report, report) == []
+
+    assert {name: sys.modules.get(name) for name in STUB_MODULE_NAMES} == before
+    assert (PACKAGE_NAME in sys.modules) == plugin_loaded
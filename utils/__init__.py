@@ -5,5 +5,9 @@
 from .clip_analyzer import clip_analyzer
 from .variable_processor import variable_processor
 from .label_generator import LabelGenerator
+from .image_preprocess import image_preprocessor, ImagePreprocessor
+from .analysis_result import AnalysisResult, FeatureVocabulary
+from .text_embeddings import text_embedding_bank
 
-__all__ = ['clip_analyzer', 'variable_processor', 'LabelGenerator']
\ No newline at end of file
+__all__ = ['clip_analyzer', 'variable_processor', 'LabelGenerator', 'image_preprocessor', 'ImagePreprocessor',
+           'AnalysisResult', 'FeatureVocabulary', 'text_embedding_bank']
\ No newline at end of file
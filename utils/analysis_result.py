@@ -0,0 +1,241 @@
+"""
+紧凑的CLIP分析结果类型
+"""
+
+from collections.abc import Mapping
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+class FeatureVocabulary:
+    """
+    共享的特征词表
+
+    每个特征只存一次中英文名称和类别，分析结果中只保存词表索引。
+    """
+
+    __slots__ = ("names_cn", "names_en", "categories", "category_ids", "_index", "_category_index")
+
+    def __init__(self, names_cn: Sequence[str], names_en: Sequence[str], categories: Sequence[str]):
+        if not (len(names_cn) == len(names_en) == len(categories)):
+            raise ValueError("词表中英文名称与类别数量不一致")
+        self.names_cn = tuple(names_cn)
+        self.names_en = tuple(names_en)
+        self.categories = tuple(dict.fromkeys(categories))
+        self._category_index = {name: i for i, name in enumerate(self.categories)}
+        self.category_ids = np.array([self._category_index[c] for c in categories], dtype=np.int16)
+        self.category_ids.setflags(write=False)
+        self._index = {}
+        for i, (cn, en) in enumerate(zip(self.names_cn, self.names_en)):
+            self._index.setdefault(cn, i)
+            self._index.setdefault(en, i)
+
+    @classmethod
+    def from_feature_texts(cls, feature_texts_cn: Dict[str, List[str]],
+                           feature_texts_en: Dict[str, List[str]]) -> "FeatureVocabulary":
+        """由按类别分组、位置对齐的中英文特征表构建词表（类别使用中文名）"""
+        names_cn, names_en, categories = [], [], []
+        for (category, texts_cn), texts_en in zip(feature_texts_cn.items(), feature_texts_en.values()):
+            for cn, en in zip(texts_cn, texts_en):
+                names_cn.append(cn)
+                names_en.append(en)
+                categories.append(category)
+        return cls(names_cn, names_en, categories)
+
+    def __len__(self) -> int:
+        return len(self.names_cn)
+
+    def names(self, language: str = "中文") -> Tuple[str, ...]:
+        return self.names_en if language == "英文" else self.names_cn
+
+    def index_of(self, name: str) -> int:
+        """按中文或英文名称查找词表索引，不存在时返回 -1"""
+        return self._index.get(name, -1)
+
+    def category_id(self, category: str) -> int:
+        return self._category_index.get(category, -1)
+
+    def ids_for_categories(self, categories: Sequence[str]) -> np.ndarray:
+        """返回属于指定类别的特征索引"""
+        wanted = [self._category_index[c] for c in categories if c in self._category_index]
+        return np.flatnonzero(np.isin(self.category_ids, wanted)).astype(np.int32)
+
+
+class AnalysisResult(Mapping):
+    """
+    数组存储的CLIP分析结果
+
+    scores 为 [B, N] 的置信度矩阵，feature_ids 为对应的 N 个词表索引。
+    阈值、top-k、类别掩码、语言和图像选择都只生成共享同一组数组的新视图，不复制数据。
+
+    作为 Mapping 使用时，表现为第一张图像（或当前选中图像）按阈值过滤后的
+    {特征名: {"confidence", "english", "category"}} 字典，兼容旧的工作流。
+    image_index 为 None 表示整个批次（尚未用 image() 选中某张图像）。
+    """
+
+    __slots__ = ("vocabulary", "scores", "feature_ids", "threshold", "top_k", "language", "image_index",
+                 "feature_mask", "_current")
+
+    def __init__(self, vocabulary: FeatureVocabulary, scores: np.ndarray, feature_ids: np.ndarray,
+                 threshold: float = 0.0, top_k: Optional[int] = None, language: str = "中文",
+                 image_index: Optional[int] = None, feature_mask: Optional[np.ndarray] = None):
+        scores = np.asarray(scores, dtype=np.float32)
+        if scores.ndim == 1:
+            scores = scores[None, :]
+        self.vocabulary = vocabulary
+        self.scores = scores
+        self.feature_ids = np.asarray(feature_ids, dtype=np.int32)
+        self.threshold = float(threshold)
+        self.top_k = top_k
+        self.language = language
+        self.image_index = image_index
+        # 可选的 [N] 布尔掩码，只有为 True 的列参与选择
+        self.feature_mask = feature_mask
+        # Mapping 接口使用的当前图像字典，首次访问时构建；视图参数不变，构建后一直有效
+        self._current = None
+
+    def _view(self, **changes) -> "AnalysisResult":
+        params = {
+            "threshold": self.threshold,
+            "top_k": self.top_k,
+            "language": self.language,
+            "image_index": self.image_index,
+            "feature_mask": self.feature_mask,
+        }
+        params.update(changes)
+        return AnalysisResult(self.vocabulary, self.scores, self.feature_ids, **params)
+
+    # ---- 视图 ----
+
+    def with_threshold(self, threshold: float) -> "AnalysisResult":
+        return self._view(threshold=threshold)
+
+    def with_top_k(self, top_k: Optional[int]) -> "AnalysisResult":
+        return self._view(top_k=top_k)
+
+    def with_language(self, language: str) -> "AnalysisResult":
+        return self._view(language=language)
+
+    def with_categories(self, categories: Optional[Sequence[str]], exclude: bool = False) -> "AnalysisResult":
+        """
+        只保留（exclude 为 True 时排除）指定类别的特征
+
+        Args:
+            categories: 类别名称，为 None 或空时取消类别掩码
+        """
+        if not categories:
+            return self._view(feature_mask=None)
+        wanted = [self.vocabulary.category_id(c) for c in categories]
+        mask = np.isin(self.vocabulary.category_ids[self.feature_ids], [c for c in wanted if c >= 0])
+        if exclude:
+            mask = ~mask
+        mask.setflags(write=False)
+        return self._view(feature_mask=mask)
+
+    def raw(self) -> "AnalysisResult":
+        """不带阈值、top-k 和类别掩码的原始分数视图"""
+        return self._view(threshold=0.0, top_k=None, feature_mask=None)
+
+    def image(self, index: int) -> "AnalysisResult":
+        """选中批次中的某张图像"""
+        if not -self.batch_size <= index < self.batch_size:
+            raise IndexError(f"图像索引越界: {index}")
+        return self._view(image_index=index % self.batch_size)
+
+    @property
+    def batch_size(self) -> int:
+        return self.scores.shape[0]
+
+    # ---- 选择 ----
+
+    def selected(self, image_index: int = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        返回某张图像通过阈值/top-k的 (词表索引, 置信度)，按置信度降序
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: 词表索引与置信度
+        """
+        if image_index is None:
+            image_index = self.image_index or 0
+        row = self.scores[image_index]
+        passing = row >= self.threshold
+        if self.feature_mask is not None:
+            passing &= self.feature_mask
+        keep = np.flatnonzero(passing)
+        if self.top_k is not None and keep.size > self.top_k:
+            keep = keep[np.argpartition(-row[keep], self.top_k - 1)[:self.top_k]]
+        keep = keep[np.argsort(-row[keep], kind="stable")]
+        return self.feature_ids[keep], row[keep]
+
+    def selection_mask(self) -> np.ndarray:
+        """
+        整个批次通过阈值、类别掩码和 top-k 的 [B, N] 布尔矩阵（一次向量化计算，不逐图循环）
+        """
+        mask = self.scores >= self.threshold
+        if self.feature_mask is not None:
+            mask &= self.feature_mask
+        if self.top_k is not None and self.top_k < mask.shape[1]:
+            if self.top_k <= 0:
+                return np.zeros_like(mask)
+            masked = np.where(mask, self.scores, -np.inf)
+            top = np.argpartition(-masked, self.top_k - 1, axis=1)[:, :self.top_k]
+            in_top = np.zeros_like(mask)
+            np.put_along_axis(in_top, top, True, axis=1)
+            mask &= in_top
+        return mask
+
+    def tags(self, image_index: int = None) -> List[str]:
+        """某张图像的标签名称（当前语言）"""
+        ids, _ = self.selected(image_index)
+        names = self.vocabulary.names(self.language)
+        return [names[i] for i in ids]
+
+    def to_dict(self, image_index: int = None) -> Dict[str, Dict]:
+        """转换为旧的字典格式"""
+        ids, confidences = self.selected(image_index)
+        names = self.vocabulary.names(self.language)
+        vocab = self.vocabulary
+        return {
+            names[i]: {
+                "confidence": float(confidence),
+                "english": vocab.names_en[i],
+                "category": vocab.categories[vocab.category_ids[i]],
+            }
+            for i, confidence in zip(ids, confidences)
+        }
+
+    def to_dicts(self) -> List[Dict[str, Dict]]:
+        """整个批次转换为字典列表"""
+        return [self.to_dict(i) for i in range(self.batch_size)]
+
+    # ---- Mapping 兼容接口（当前选中图像） ----
+
+    def _current_dict(self) -> Dict[str, Dict]:
+        current = self._current
+        if current is None:
+            current = self._current = self.to_dict()
+        return current
+
+    def __getitem__(self, name: str) -> Dict:
+        return self._current_dict()[name]
+
+    def __contains__(self, name) -> bool:
+        return name in self._current_dict()
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._current_dict())
+
+    def __len__(self) -> int:
+        return len(self._current_dict())
+
+    def items(self):
+        return self._current_dict().items()
+
+    def values(self):
+        return self._current_dict().values()
+
+    def __repr__(self) -> str:
+        masked = "" if self.feature_mask is None else f", masked={int(self.feature_mask.size - self.feature_mask.sum())}"
+        return (f"AnalysisResult(batch={self.batch_size}, features={self.feature_ids.size}, "
+                f"threshold={self.threshold}, top_k={self.top_k}, language={self.language!r}{masked})")
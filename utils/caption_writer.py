@@ -0,0 +1,246 @@
+"""
+标注文件写入工具模块
+
+把生成的标签写成 kohya 风格的同名 .txt 标注文件。目录中每种扩展名一个清单文件，记录每个文件上次写入的
+内容哈希与文件戳：内容未变化的文件直接跳过，不读取也不重写，避免在网络存储上大量无谓的写入，
+也不会使训练器的缓存失效。写入通过线程池并行，每个文件先写临时文件再重命名，保证原子性。
+"""
+
+import hashlib
+import json
+import os
+import stat
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple
+
+MANIFEST_FILE = ".caption_manifest.json"
+MERGE_MODES = ("替换", "前置", "追加")
+
+
+def normalize_extension(extension: str) -> str:
+    """统一扩展名写法：txt、.txt 与带空格的写法都视为 .txt，留空时为 .txt"""
+    extension = (extension or "").strip() or ".txt"
+    return extension if extension.startswith(".") else f".{extension}"
+
+
+def manifest_filename(extension: str) -> str:
+    """某种标注扩展名对应的清单文件名，例如 .caption_manifest.txt.json"""
+    stem, suffix = os.path.splitext(MANIFEST_FILE)
+    return f"{stem}{extension}{suffix}"
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def _file_stamp(path: str) -> Optional[List[int]]:
+    try:
+        info = os.stat(path)
+        return [info.st_mtime_ns, info.st_size]
+    except OSError:
+        return None
+
+
+def merge_captions(base: str, generated: str, mode: str, separator: str = ", ") -> str:
+    """
+    合并已有标注与生成的标签
+
+    Args:
+        base: 已有的标注（原始标注，不含本工具之前写入的内容）
+        generated: 生成的标签
+        mode: "替换"、"前置"（生成的标签在前）或 "追加"（生成的标签在后）
+        separator: 标签分隔符，合并时按逗号拆分并去重
+    """
+    if mode == "替换" or not base.strip():
+        return generated
+    if not generated.strip():
+        return base.strip()
+    first, second = (generated, base) if mode == "前置" else (base, generated)
+    tags, seen = [], set()
+    for text in (first, second):
+        for tag in text.replace("，", ",").split(","):
+            tag = tag.strip()
+            if tag and tag not in seen:
+                seen.add(tag)
+                tags.append(tag)
+    return separator.join(tags)
+
+
+class CaptionWriter:
+    """增量标注文件写入器（每个输出目录一个实例）"""
+
+    def __init__(self, output_dir: str, extension: str = ".txt", max_workers: int = 8, fsync: bool = False):
+        self.output_dir = output_dir
+        self.extension = normalize_extension(extension)
+        self.max_workers = max(1, max_workers)
+        self.fsync = fsync
+        # 每种扩展名单独一个清单，同一目录下的多个写入器不会互相覆盖
+        self.manifest_path = os.path.join(output_dir, manifest_filename(self.extension))
+        self._lock = threading.Lock()
+        self._manifest: Dict[str, Dict] = self._load_manifest()
+        self._dirty = False
+
+    def _load_manifest(self) -> Dict[str, Dict]:
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return self._load_legacy_manifest()
+        except Exception as e:
+            print(f"⚠️ 标注清单读取失败，将重新生成: {e}")
+            return {}
+
+    def _load_legacy_manifest(self) -> Dict[str, Dict]:
+        """从旧版的共享清单中取出本扩展名的条目"""
+        try:
+            with open(os.path.join(self.output_dir, MANIFEST_FILE), 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except Exception:
+            return {}
+        return {key: entry for key, entry in manifest.items() if key.endswith(self.extension)}
+
+    def _save_manifest(self):
+        fd, tmp_path = tempfile.mkstemp(dir=self.output_dir, prefix=f"{os.path.basename(self.manifest_path)}.",
+                                        suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(self._manifest, f, ensure_ascii=False)
+            os.replace(tmp_path, self.manifest_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def caption_path(self, name: str) -> str:
+        """图像文件名（或不带扩展名的名称）对应的标注文件路径"""
+        stem = os.path.splitext(os.path.basename(name))[0]
+        return os.path.join(self.output_dir, stem + self.extension)
+
+    def _write_atomic(self, path: str, text: str):
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".caption.", suffix=".tmp")
+        try:
+            # mkstemp 创建的文件权限为0600，沿用原文件权限（新文件为0644）
+            try:
+                permissions = stat.S_IMODE(os.stat(path).st_mode)
+            except OSError:
+                permissions = 0o644
+            os.chmod(tmp_path, permissions)
+            with os.fdopen(fd, 'w', encoding='utf-8', newline="") as f:
+                f.write(text)
+                if self.fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _write_one(self, name: str, generated: str, mode: str, separator: str) -> str:
+        """
+        写入单个标注文件
+
+        Returns:
+            str: "written"、"skipped" 或 "failed: <原因>"
+        """
+        path = self.caption_path(name)
+        key = os.path.basename(path)
+        entry = self._manifest.get(key)
+        stamp = _file_stamp(path)
+
+        try:
+            if entry is not None and stamp is not None and entry.get("stamp") == stamp:
+                # 文件戳与清单一致：文件仍是上次写入的内容，无需读取，原始标注取清单中保存的版本
+                base = "" if mode == "替换" else entry.get("base", "")
+                text = merge_captions(base, generated, mode, separator)
+                if entry.get("hash") == content_hash(text):
+                    return "skipped"
+            else:
+                # 新文件、清单缺失或文件被外部修改：以文件当前内容作为原始标注
+                current = ""
+                if stamp is not None:
+                    with open(path, 'r', encoding='utf-8') as f:
+                        current = f.read()
+                base = "" if mode == "替换" else current.strip()
+                text = merge_captions(base, generated, mode, separator)
+                if stamp is not None and current == text:
+                    with self._lock:
+                        self._manifest[key] = {"hash": content_hash(text), "stamp": stamp, "base": base}
+                        self._dirty = True
+                    return "skipped"
+
+            self._write_atomic(path, text)
+            with self._lock:
+                self._manifest[key] = {"hash": content_hash(text), "stamp": _file_stamp(path), "base": base}
+                self._dirty = True
+            return "written"
+        except Exception as e:
+            return f"failed: {e}"
+
+    def write(self, items: Sequence[Tuple[str, str]], mode: str = "替换", separator: str = ", ") -> Dict[str, List[str]]:
+        """
+        批量写入标注
+
+        Args:
+            items: (图像文件名, 生成的标签) 列表
+            mode: 合并模式，见 MERGE_MODES
+
+        Returns:
+            Dict[str, List[str]]: {"written": [...], "skipped": [...], "failed": [...]}，值为标注文件名
+        """
+        if mode not in MERGE_MODES:
+            raise ValueError(f"未知的合并模式: {mode}")
+        os.makedirs(self.output_dir, exist_ok=True)
+
+        report: Dict[str, List[str]] = {"written": [], "skipped": [], "failed": []}
+
+        # 同名不同扩展名的图像（a.png 与 a.jpg）会写同一个标注文件，结果取决于线程先后，全部报告为失败
+        sources: Dict[str, List[str]] = {}
+        for name, _ in items:
+            sources.setdefault(self.caption_path(name), []).append(os.path.basename(name))
+        unique_items = []
+        for name, caption in items:
+            names = sources[self.caption_path(name)]
+            if len(names) > 1:
+                filename = os.path.basename(self.caption_path(name))
+                report["failed"].append(
+                    f"{filename} ({os.path.basename(name)}: 同批次的 {', '.join(names)} 对应同一标注文件)")
+            else:
+                unique_items.append((name, caption))
+
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, max(1, len(unique_items)))) as pool:
+            futures = [(name, pool.submit(self._write_one, name, caption, mode, separator))
+                       for name, caption in unique_items]
+            for name, future in futures:
+                status = future.result()
+                filename = os.path.basename(self.caption_path(name))
+                if status.startswith("failed"):
+                    report["failed"].append(f"{filename} ({status[len('failed: '):]})")
+                else:
+                    report[status].append(filename)
+
+        with self._lock:
+            if self._dirty:
+                self._save_manifest()
+                self._dirty = False
+        return report
+
+
+_writers: Dict[Tuple[str, str], CaptionWriter] = {}
+_writers_lock = threading.Lock()
+
+
+def get_caption_writer(output_dir: str, extension: str = ".txt") -> CaptionWriter:
+    """获取（并缓存）某目录对应的标注写入器，清单只在首次使用时读取"""
+    output_dir = os.path.abspath(os.path.expanduser(output_dir))
+    extension = normalize_extension(extension)
+    # 同一目录、同一扩展名只有一个写入器（和一份清单），不同写法不会得到两个实例
+    key = (output_dir, extension)
+    with _writers_lock:
+        writer = _writers.get(key)
+        if writer is None:
+            writer = CaptionWriter(output_dir, extension)
+            _writers[key] = writer
+        return writer
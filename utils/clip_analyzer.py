@@ -2,22 +2,51 @@
 CLIP分析器工具模块
 """
 
+import hashlib
+import json
+import os
+import threading
+import time
+import weakref
+
 import numpy as np
 import torch
+import torch.nn.functional as F
 from typing import Dict, List, Tuple, Any
-import comfy.clip_vision
+
+from .image_preprocess import image_preprocessor, CLIP_MEAN, CLIP_STD
+from .analysis_result import AnalysisResult, FeatureVocabulary
+from .text_embeddings import text_embedding_bank, load_transformers_text_encoder
+from .inference_runtime import (
+    configure_cpu_threads, default_inference_slots, get_quantized_model, precision_context
+)
+
+# 模型对象 -> 参数指纹，模型释放后条目自动移除
+_parameter_fingerprints: "weakref.WeakKeyDictionary[torch.nn.Module, str]" = weakref.WeakKeyDictionary()
 
 class CLIPAnalyzerTool:
-    """CLIP分析器工具类"""
+    """
+    CLIP分析器工具类
+
+    实例可被多个线程共享；模型推理通过信号量限制并发数，
+    并配合 torch 线程数设置避免多个执行器争抢CPU核心。
+    运行期可变的状态（文本编码器、并发信号量、回退提示记录）在 _state_lock 下修改；
+    词表与自适应分组缓存只做整体替换，读取方拿到的总是完整的旧值或新值。
+    """
     
-    def __init__(self):
+    def __init__(self, max_concurrent_inference: int = 0):
+        self._state_lock = threading.Lock()
+        self.max_concurrent_inference = max_concurrent_inference or default_inference_slots()
+        self._inference_slots = threading.BoundedSemaphore(self.max_concurrent_inference)
         self.feature_texts_cn = {
             "人物": ["长发", "短发", "卷发", "直发", "马尾", "双马尾", "丸子头", "男性", "女性", "年轻", "老年"],
             "表情": ["微笑", "愤怒", "悲伤", "惊讶", "平静", "害羞", "严肃", "调皮", "困惑", "恐惧"],
             "姿势": ["站立", "坐姿", "卧姿", "跪姿", "跳跃", "奔跑", "飞行", "游泳"],
             "环境": ["城市", "荒野", "室内", "室外", "白天", "夜晚", "黄昏", "黎明"],
             "风格": ["动漫", "写实", "油画", "水彩", "像素", "卡通", "水墨", "赛博朋克"],
-            "服装": ["和服", "西装", "裙子", "T恤", "盔甲", "制服", "泳装", "礼服"]
+            "服装": ["和服", "西装", "裙子", "T恤", "盔甲", "制服", "泳装", "礼服"],
+            "构图": ["特写", "半身", "全身", "远景"],
+            "视角": ["平视", "俯视", "仰视"]
         }
         
         self.feature_texts_en = {
@@ -26,8 +55,28 @@ class CLIPAnalyzerTool:
             "pose": ["standing", "sitting", "lying", "kneeling", "jumping", "running", "flying", "swimming"],
             "environment": ["city", "wilderness", "indoor", "outdoor", "daytime", "night", "dusk", "dawn"],
             "style": ["anime", "realistic", "oil painting", "watercolor", "pixel", "cartoon", "ink wash", "cyberpunk"],
-            "clothing": ["kimono", "suit", "dress", "t-shirt", "armor", "uniform", "swimsuit", "gown"]
+            "clothing": ["kimono", "suit", "dress", "t-shirt", "armor", "uniform", "swimsuit", "gown"],
+            "composition": ["close-up", "upper body", "full body", "long shot"],
+            "viewpoint": ["at eye level", "from above", "from below"]
         }
+
+        # 共享词表：分析结果只保存词表索引
+        self.vocabulary = FeatureVocabulary.from_feature_texts(self.feature_texts_cn, self.feature_texts_en)
+        # 快速分析：每个类别取前3个特征
+        self.quick_feature_ids = np.array([
+            i for category in self.vocabulary.categories
+            for i in np.flatnonzero(self.vocabulary.category_ids == self.vocabulary.category_id(category))[:3]
+        ], dtype=np.int32)
+        self.all_feature_ids = np.arange(len(self.vocabulary), dtype=np.int32)
+
+        # 文本编码器（可选），用于构建提示词集成的文本嵌入
+        self._text_encoder = None
+        self._text_encoder_key = None
+        self._fallback_warnings = set()
+        # (文本嵌入, 优先级, 分组与上界参数)，自适应分析使用
+        self._bounds_cache = None
+        # 自适应分析每个打分阶段至少包含的特征数：小词表一次矩阵乘法完成，大词表分阶段以便按预算提前结束
+        self.adaptive_stage_features = 64
     
     def analyze_with_clip(self, clip_vision_model, image_tensor, language="中文"):
         """
@@ -64,12 +113,398 @@ class CLIPAnalyzerTool:
                 }
         
         # 生成分析文本
-        analysis_text = self._generate_analysis_text(results, language)
+        analysis_text = self.generate_analysis_text(results, language)
         
         return results, analysis_text
-    
-    def _generate_analysis_text(self, results, language):
-        """生成分析文本"""
+
+    def preprocess_images(self, clip_vision_model, images) -> torch.Tensor:
+        """
+        将图像预处理为模型输入
+
+        Args:
+            clip_vision_model: CLIP视觉模型（可为None）
+            images: 图像张量 [B, H, W, 3]，或分辨率各异的 [H, W, 3] 张量列表
+
+        Returns:
+            torch.Tensor: [B, 3, S, S]
+        """
+        kwargs = {
+            "size": getattr(clip_vision_model, "image_size", 224),
+            "mean": getattr(clip_vision_model, "image_mean", CLIP_MEAN),
+            "std": getattr(clip_vision_model, "image_std", CLIP_STD),
+        }
+        if isinstance(images, (list, tuple)):
+            return image_preprocessor.preprocess_list(images, **kwargs)
+        return image_preprocessor.preprocess(images, **kwargs)
+
+    def configure_concurrency(self, max_concurrent_inference: int = 0, intra_op_threads: int = 0,
+                              inter_op_threads: int = 0, device=None):
+        """
+        配置并发推理数与 torch 线程数
+
+        Args:
+            max_concurrent_inference: 允许同时进行的模型推理数，0 表示按设备自动选择
+            intra_op_threads: torch intra-op 线程数，0 表示在CPU上按 核心数 / 并发推理数 均分
+            inter_op_threads: torch inter-op 线程数，0 表示保持默认
+            device: 推理设备，用于选择默认并发数
+        """
+        slots = int(max_concurrent_inference) or default_inference_slots(device)
+        with self._state_lock:
+            if slots != self.max_concurrent_inference:
+                # 正在进行的推理仍在旧信号量上释放，不受替换影响
+                self.max_concurrent_inference = slots
+                self._inference_slots = threading.BoundedSemaphore(slots)
+        if intra_op_threads <= 0 and (device is None or torch.device(device).type == "cpu"):
+            intra_op_threads = max(1, (os.cpu_count() or 1) // slots)
+        configure_cpu_threads(intra_op_threads, inter_op_threads)
+
+    def encode_pixels(self, clip_vision_model, pixel_values: torch.Tensor, precision: str = None) -> torch.Tensor:
+        """
+        对预处理后的像素批量编码，返回L2归一化的图像嵌入 [B, D]
+
+        没有可用模型时（例如脱离ComfyUI运行），退化为基于像素统计的模拟特征。
+
+        Args:
+            precision: "float32"、"bf16"（autocast）或 "int8"（Linear层动态量化，CPU），
+                默认使用模型加载时设置的精度
+        """
+        if precision is None:
+            precision = getattr(clip_vision_model, "precision", "float32")
+
+        exported = getattr(clip_vision_model, "exported_encoder", None)
+        if precision == "float32" and exported is not None and exported.available:
+            try:
+                with self._inference_slots:
+                    return F.normalize(exported(pixel_values).float(), dim=-1)
+            except Exception as e:
+                # 导出的推理图不可用时自动回退到 eager 模式
+                exported.available = False
+                print(f"⚠️ 导出的推理图运行失败，回退到eager模式: {e}")
+
+        model = getattr(clip_vision_model, "model", None)
+        if model is None:
+            features = F.adaptive_avg_pool2d(pixel_values.float(), 4).flatten(1)
+            return F.normalize(features, dim=-1)
+
+        if precision == "int8":
+            # 动态量化模型按原模型缓存在注册表中，只在CPU上运行
+            model = get_quantized_model(model)
+            device = torch.device("cpu")
+        else:
+            patcher = getattr(clip_vision_model, "patcher", None)
+            if patcher is not None:
+                import comfy.model_management
+                comfy.model_management.load_model_gpu(patcher)
+            device = getattr(clip_vision_model, "load_device", pixel_values.device)
+        with self._inference_slots, torch.no_grad(), precision_context(precision, device):
+            outputs = model(pixel_values=pixel_values.to(device), intermediate_output=-2)
+        return F.normalize(outputs[2].float(), dim=-1)
+
+    def encoder_fingerprint(self, clip_vision_model, precision: str = None) -> str:
+        """
+        编码配置指纹：模型检查点 + 预处理参数 + 推理精度
+
+        任一项变化都会得到不同的嵌入，嵌入存储按该指纹分目录保存。
+        没有检查点指纹的模型（例如脱离加载器构建）按参数名、形状和少量权重取样计算。
+        """
+        if precision is None:
+            precision = getattr(clip_vision_model, "precision", "float32")
+        model = getattr(clip_vision_model, "model", None)
+        if model is None:
+            model_key = "mock"
+        else:
+            model_key = getattr(clip_vision_model, "checkpoint_key", None) or self._parameter_fingerprint(model)
+        payload = json.dumps({
+            "model": model_key,
+            "size": getattr(clip_vision_model, "image_size", 224),
+            "mean": [float(v) for v in getattr(clip_vision_model, "image_mean", CLIP_MEAN)],
+            "std": [float(v) for v in getattr(clip_vision_model, "image_std", CLIP_STD)],
+            "precision": precision,
+        }, sort_keys=True)
+        return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16]
+
+    @staticmethod
+    def _parameter_fingerprint(model: torch.nn.Module) -> str:
+        """按参数名、形状和每个参数的前16个值计算模型指纹，按模型对象缓存"""
+        fingerprint = _parameter_fingerprints.get(model)
+        if fingerprint is None:
+            digest = hashlib.sha1()
+            with torch.no_grad():
+                for name, parameter in model.named_parameters():
+                    digest.update(f"{name}{tuple(parameter.shape)}".encode("utf-8"))
+                    digest.update(parameter.detach().flatten()[:16].float().cpu().numpy().tobytes())
+            fingerprint = digest.hexdigest()[:32]
+            _parameter_fingerprints[model] = fingerprint
+        return fingerprint
+
+    def encode_with_store(self, clip_vision_model, pixel_values: torch.Tensor, keys: np.ndarray, store,
+                          precision: str = None) -> torch.Tensor:
+        """
+        借助嵌入存储编码：已存在的图像直接从磁盘读取，只编码未命中的图像并追加写入
+
+        存储的维度与模型输出不一致时视为全部未命中，直接编码且不写入。
+
+        Args:
+            pixel_values: 预处理后的像素 [B, 3, S, S]
+            keys: 每张图像的64位哈希 [B]
+            store: EmbeddingStore 实例（应按 encoder_fingerprint 分目录）
+        """
+        if store.initialized:
+            cached, found = store.get(keys)
+        else:
+            cached, found = None, np.zeros(len(keys), dtype=bool)
+        missing = np.flatnonzero(~found)
+        if not len(missing):
+            return torch.from_numpy(np.array(cached, dtype=np.float32))
+
+        encoded = self.encode_pixels(clip_vision_model, pixel_values[torch.from_numpy(missing)], precision)
+        if store.initialized and encoded.shape[1] != store.dim:
+            print(f"⚠️ 嵌入存储维度为 {store.dim}，模型输出为 {encoded.shape[1]}，跳过缓存: {store.root}")
+            if len(missing) == len(keys):
+                return encoded
+            return self.encode_pixels(clip_vision_model, pixel_values, precision)
+        store.add(keys[missing], encoded.cpu().numpy())
+        if cached is None:
+            return encoded
+        embeddings = torch.from_numpy(np.array(cached, dtype=np.float32)).to(encoded.device)
+        embeddings[torch.from_numpy(missing).to(encoded.device)] = encoded
+        return embeddings
+
+    def encode_images(self, clip_vision_model, images) -> torch.Tensor:
+        """预处理并批量编码图像"""
+        return self.encode_pixels(clip_vision_model, self.preprocess_images(clip_vision_model, images))
+
+    def set_text_encoder(self, encode_text, encoder_key: str = None):
+        """
+        设置文本编码器
+
+        Args:
+            encode_text: 输入提示词列表、输出 [P, D] 嵌入的函数；None 表示清除
+            encoder_key: 文本嵌入的缓存键，默认取函数的限定名
+        """
+        with self._state_lock:
+            self._text_encoder = encode_text
+            self._text_encoder_key = encoder_key or getattr(encode_text, "__qualname__", "default")
+            self._fallback_warnings.clear()
+
+    @property
+    def text_encoder_key(self):
+        """当前文本编码器的缓存键，未设置时为 None"""
+        with self._state_lock:
+            return self._text_encoder_key if self._text_encoder is not None else None
+
+    def use_transformers_text_encoder(self, model_name: str, device: str = "cpu"):
+        """
+        使用 transformers 的CLIP文本塔作为文本编码器（可选依赖），同一模型不会重复加载
+
+        Args:
+            model_name: Hugging Face 模型名或本地目录，需与CLIP视觉模型配套
+        """
+        key = f"transformers:{model_name}"
+        if self.text_encoder_key != key:
+            self.set_text_encoder(load_transformers_text_encoder(model_name, device), key)
+            print(f"✅ 已加载CLIP文本编码器: {model_name}")
+
+    def text_tables(self):
+        """
+        词表的文本嵌入表（嵌入矩阵 [N, D] 与打分参数）
+
+        每个特征的多个提示词模板在构建时已折叠为一个向量，结果按词表和文本编码器缓存；
+        未设置文本编码器时返回 None。启用共享内存时改用共享段中发布的词表，
+        之后的分析结果、标签生成和统计都引用这一份词表。
+        """
+        with self._state_lock:
+            encode_text, encoder_key = self._text_encoder, self._text_encoder_key
+        if encode_text is None:
+            return None
+        tables = text_embedding_bank.tables(self.vocabulary, encode_text, encoder_key)
+        if tables.vocabulary is not self.vocabulary:
+            # 共享词表与本地词表内容相同，单次赋值替换，并发读取方看到任意一份都是一致的
+            self.vocabulary = tables.vocabulary
+        return tables
+
+    def text_embeddings(self):
+        """词表的文本嵌入矩阵 [N, D]，未设置文本编码器时返回 None"""
+        tables = self.text_tables()
+        return tables.embeddings if tables is not None else None
+
+    def score_embeddings(self, embeddings: torch.Tensor, feature_ids: np.ndarray = None) -> np.ndarray:
+        """
+        计算批次中每张图像对各特征的置信度
+
+        Returns:
+            np.ndarray: [B, N] float32
+        """
+        if feature_ids is None:
+            feature_ids = self.quick_feature_ids
+
+        tables = self.text_tables()
+        if tables is not None and embeddings.shape[-1] == tables.embeddings.shape[1]:
+            # 一次矩阵乘法得到余弦相似度，再映射为 0~1 的置信度
+            similarity = self._as_numpy(embeddings) @ tables.embeddings[feature_ids].T
+            return tables.confidence(similarity)
+
+        # 没有可用的文本编码器时返回模拟数据，并明确提示分数不可信
+        if tables is None:
+            reason = ("未设置CLIP文本编码器，CLIP分数为随机模拟数据！"
+                      "请在 CLIP视觉模型加载器 的 text_encoder 中填写与视觉模型配套的文本塔")
+        else:
+            reason = (f"文本嵌入维度 {tables.embeddings.shape[1]} 与图像嵌入维度 {embeddings.shape[-1]} 不一致，"
+                      f"CLIP分数为随机模拟数据！请使用与视觉模型配套的文本编码器")
+        with self._state_lock:
+            first_warning = reason not in self._fallback_warnings
+            self._fallback_warnings.add(reason)
+        if first_warning:
+            print(f"⚠️ {reason}")
+        return np.random.uniform(0.4, 0.95, size=(embeddings.shape[0], len(feature_ids))).astype(np.float32)
+
+    @staticmethod
+    def _as_numpy(embeddings) -> np.ndarray:
+        if isinstance(embeddings, torch.Tensor):
+            embeddings = embeddings.detach().float().cpu().numpy()
+        return np.asarray(embeddings, dtype=np.float32)
+
+    def _adaptive_plan(self, tables, priority: List[str] = None) -> Tuple:
+        """
+        自适应分析的分组、打分阶段与上界参数，按 (文本嵌入表, 优先级, 阶段大小) 缓存
+
+        组内的文本向量都落在以单位中心方向 u 为轴、半角 θ = max∠(t, u) 的球冠内，
+        因此对任意图像嵌入 x 有 x·t ≤ ‖x‖·cos(max(∠(x, u) - θ, 0))。
+        相邻的类别组合并为至少 adaptive_stage_features 个特征的阶段，每个阶段一次矩阵乘法。
+
+        Returns:
+            Tuple: (类别, 每组词表索引, 按优先级排列的文本矩阵 [D, N], 组边界 [G+1],
+                    阶段 [(首组, 尾组+1)], 组轴 [G, D], 组半角 [G])
+        """
+        key = (tuple(priority) if priority else None, self.adaptive_stage_features)
+        cached = self._bounds_cache
+        if cached is not None and cached[0] is tables.embeddings and cached[1] == key:
+            return cached[2]
+
+        vocab, text = tables.vocabulary, tables.embeddings
+        categories = [c for c in (priority or vocab.categories) if vocab.category_id(c) >= 0]
+        groups = [np.flatnonzero(vocab.category_ids == vocab.category_id(c)).astype(np.int32) for c in categories]
+        offsets = np.cumsum([0] + [len(ids) for ids in groups])
+        ordered = np.ascontiguousarray(text[np.concatenate(groups)].T)
+
+        axes = np.stack([text[ids].mean(axis=0) for ids in groups])
+        axes /= np.maximum(np.linalg.norm(axes, axis=1, keepdims=True), 1e-12)
+        half_angles = np.array([np.arccos(np.clip(text[ids] @ axes[g], -1.0, 1.0)).max()
+                                for g, ids in enumerate(groups)], dtype=np.float32)
+
+        stages, first = [], 0
+        for g in range(len(groups)):
+            if offsets[g + 1] - offsets[first] >= self.adaptive_stage_features or g == len(groups) - 1:
+                stages.append((first, g + 1))
+                first = g + 1
+
+        plan = (categories, groups, ordered, offsets, stages, axes, half_angles)
+        # 整体替换，并发调用看到的总是完整的一组缓存
+        self._bounds_cache = (text, key, plan)
+        return plan
+
+    def analyze_adaptive(self, embeddings, language="中文", threshold=0.0, latency_budget_ms: float = 0.0,
+                         priority: List[str] = None) -> Tuple[AnalysisResult, List[str]]:
+        """
+        自适应分析：按优先级逐个类别组打分，满足条件时提前结束
+
+        提前结束的条件：
+            1. 剩余类别组的相似度上界都不超过当前最高相似度（不可能改变最高结果）；
+            2. 已用时间超过 latency_budget_ms（为0时不限时，始终完整分析）。
+
+        上界在相似度空间比较，不受 sigmoid 饱和的影响。类别组按阶段批量打分，
+        条件1在阶段内逐组判断（结果与逐组打分相同），条件2在阶段之间检查；
+        文本嵌入表每次调用只获取一次，全部打分完成后统一映射为置信度。
+
+        Args:
+            priority: 类别优先级，默认按词表中的类别顺序
+
+        Returns:
+            Tuple[AnalysisResult, List[str]]: 分析结果与被跳过的类别
+        """
+        start = time.perf_counter()
+        tables = self.text_tables()
+        x = self._as_numpy(embeddings)
+        if tables is None or x.shape[-1] != tables.embeddings.shape[1]:
+            # 没有可用的文本嵌入时无法估计上界，直接给出全部类别的（模拟）分数
+            vocab = self.vocabulary
+            ids = np.concatenate([np.flatnonzero(vocab.category_ids == vocab.category_id(c))
+                                  for c in (priority or vocab.categories) if vocab.category_id(c) >= 0])
+            return self.analyze(embeddings, language, threshold, ids.astype(np.int32)), []
+
+        categories, groups, ordered, offsets, stages, axes, half_angles = self._adaptive_plan(tables, priority)
+        norms = np.linalg.norm(x, axis=1, keepdims=True)
+        angles = np.arccos(np.clip(x @ axes.T / np.maximum(norms, 1e-12), -1.0, 1.0))
+        bounds = norms * np.cos(np.maximum(angles - half_angles, 0.0))
+        # remaining[:, g]：第 g 组及之后各组上界的最大值；末尾补 -inf 表示没有剩余的组
+        remaining = np.maximum.accumulate(bounds[:, ::-1], axis=1)[:, ::-1]
+        remaining = np.concatenate([remaining, np.full((x.shape[0], 1), -np.inf, dtype=remaining.dtype)], axis=1)
+
+        blocks, stop = [], len(groups)
+        top = np.full((x.shape[0], 1), -np.inf, dtype=np.float32)
+        for first, last in stages:
+            if blocks and latency_budget_ms > 0 and (time.perf_counter() - start) * 1000 >= latency_budget_ms:
+                stop = first
+                break
+            block = x @ ordered[:, offsets[first]:offsets[last]]
+            # reached[:, i]：打完第 first+i 组后的最高相似度
+            reached = np.maximum.accumulate(
+                np.maximum(np.maximum.reduceat(block, offsets[first:last] - offsets[first], axis=1), top), axis=1)
+            # 第 g 组（first < g ≤ last）之前的最高相似度已不低于剩余上界时，从第 g 组起跳过
+            settled = np.flatnonzero((remaining[:, first + 1:last + 1] <= reached).all(axis=0))
+            if len(settled):
+                stop = first + 1 + int(settled[0])
+                blocks.append(block[:, :offsets[stop] - offsets[first]])
+                break
+            blocks.append(block)
+            top = reached[:, -1:]
+
+        skipped = categories[stop:]
+        scores = tables.confidence(np.concatenate(blocks, axis=1))
+        result = AnalysisResult(tables.vocabulary, scores, np.concatenate(groups[:stop]),
+                                threshold=threshold, language=language)
+        return result, skipped
+
+    def analyze(self, embeddings: torch.Tensor, language="中文", threshold=0.0,
+                feature_ids: np.ndarray = None) -> AnalysisResult:
+        """
+        批量分析图像嵌入，返回紧凑的 AnalysisResult
+
+        Args:
+            embeddings: 图像嵌入 [B, D]
+            language: 语言
+            threshold: 置信度阈值
+            feature_ids: 参与打分的词表索引，默认使用快速分析的特征集
+        """
+        if feature_ids is None:
+            feature_ids = self.quick_feature_ids
+        scores = self.score_embeddings(embeddings, feature_ids)
+        return AnalysisResult(self.vocabulary, scores, feature_ids, threshold=threshold, language=language)
+
+    def analyze_embeddings(self, embeddings: torch.Tensor, language="中文", threshold=0.0) -> List[Dict]:
+        """
+        根据图像嵌入为批次中每张图像生成分析结果
+
+        Returns:
+            List[Dict]: 每张图像一个结果字典
+        """
+        return self.analyze(embeddings, language, threshold).to_dicts()
+
+    def analyze_batch(self, clip_vision_model, images, language="中文", threshold=0.0) -> List[Tuple[Dict, str]]:
+        """
+        一次批量编码后逐张生成分析结果
+
+        Returns:
+            List[Tuple[Dict, str]]: 每张图像的 (分析结果, 分析文本)
+        """
+        embeddings = self.encode_images(clip_vision_model, images)
+        return [
+            (results, self.generate_analysis_text(results, language))
+            for results in self.analyze_embeddings(embeddings, language, threshold)
+        ]
+
+    def generate_analysis_text(self, results, language):
+        """生成分析文本（列出前5个特征），results 为 AnalysisResult 或旧的字典格式"""
         if language == "英文":
             text = "CLIP analysis detected: "
             for feature, data in list(results.items())[:5]:  # 显示前5个
@@ -85,6 +520,8 @@ class CLIPAnalyzerTool:
     
     def filter_results_by_threshold(self, results, threshold=0.7):
         """按阈值过滤结果"""
+        if isinstance(results, AnalysisResult):
+            return results.with_threshold(threshold)
         filtered = {}
         for feature, data in results.items():
             if data["confidence"] >= threshold:
@@ -93,6 +530,8 @@ class CLIPAnalyzerTool:
     
     def get_top_features(self, results, top_n=10):
         """获取置信度最高的特征"""
+        if isinstance(results, AnalysisResult):
+            return results.with_top_k(top_n)
         sorted_features = sorted(results.items(), key=lambda x: x[1]["confidence"], reverse=True)
         return dict(sorted_features[:top_n])
 
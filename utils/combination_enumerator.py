@@ -0,0 +1,242 @@
+"""
+变量组合枚举工具模块
+
+按需枚举 variable_variables.json 中一级/二级选项的笛卡尔积，用于合成训练提示词。
+组合不会被整体展开：每个组合与一个整数索引一一对应（混合进制，最后一个变量变化最快），
+因此可以从任意索引恢复、按 (start, stop) 或 worker_id 切分，内存占用与组合总数无关。
+"""
+
+import hashlib
+import json
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Sequence, Tuple
+
+from .label_generator import LabelGenerator
+from .variable_processor import variable_processor
+
+# 过滤条件：输入一个组合（与可变变量选择器输出格式相同的字典），返回是否保留
+SelectionPredicate = Callable[[Dict], bool]
+
+
+class VariableAxis(NamedTuple):
+    """一个可变变量维度：类别、子类别及其全部取值 (一级, 二级)"""
+    category: str
+    name: str
+    choices: Tuple[Tuple[str, str], ...]
+
+    @property
+    def key(self) -> str:
+        return f"{self.category}.{self.name}"
+
+
+def build_axes(variable_variables: Dict, expand_level2: bool = False,
+               allowed: Dict[str, Sequence[str]] = None) -> List[VariableAxis]:
+    """
+    由可变变量配置构建枚举维度
+
+    Args:
+        variable_variables: 可变变量配置
+        expand_level2: 为True时每个一级选项展开为其各个二级选项（没有二级选项时保留一级本身）
+        allowed: 可选的 {"类别.子类别": [允许的一级选项]}，只枚举列出的维度和取值，
+            在枚举前缩小进制，比逐个组合过滤更省时
+
+    Returns:
+        List[VariableAxis]: 与可变变量选择器相同顺序的维度列表
+    """
+    axes = []
+    for category, subcategories in variable_variables.items():
+        for sub_name, levels in subcategories.items():
+            # 与可变变量选择器一致，只处理带一级选项的变量
+            if not isinstance(levels, dict) or not levels.get("一级"):
+                continue
+            key = f"{category}.{sub_name}"
+            if allowed is not None and key not in allowed:
+                continue
+            level1_options = levels["一级"]
+            if allowed is not None:
+                wanted = set(allowed[key])
+                level1_options = [option for option in level1_options if option in wanted]
+
+            level2_map = levels.get("二级", {}) if isinstance(levels.get("二级"), dict) else {}
+            choices = []
+            for level1 in level1_options:
+                level2_options = level2_map.get(level1, []) if expand_level2 else []
+                if level2_options:
+                    choices.extend((level1, level2) for level2 in level2_options)
+                else:
+                    choices.append((level1, ""))
+            if choices:
+                axes.append(VariableAxis(category, sub_name, tuple(choices)))
+    return axes
+
+
+def shard_range(total: int, num_workers: int, worker_id: int) -> Tuple[int, int]:
+    """把 [0, total) 均分给 num_workers 个工作进程，返回 worker_id 对应的 (start, stop)"""
+    if not 0 <= worker_id < num_workers:
+        raise ValueError(f"worker_id 超出范围: {worker_id} / {num_workers}")
+    base, extra = divmod(total, num_workers)
+    start = worker_id * base + min(worker_id, extra)
+    return start, start + base + (1 if worker_id < extra else 0)
+
+
+class CombinationEnumerator:
+    """可变变量组合的惰性枚举器"""
+
+    def __init__(self, axes: List[VariableAxis], predicates: Iterable[SelectionPredicate] = (),
+                 config_version: int = None):
+        self.axes = list(axes)
+        self.radices = [len(axis.choices) for axis in self.axes]
+        self.predicates = list(predicates)
+        self.config_version = config_version
+
+        total = 1
+        for radix in self.radices:
+            total *= radix
+        self.total = total if self.axes else 0
+
+    @classmethod
+    def from_config(cls, expand_level2: bool = False, allowed: Dict[str, Sequence[str]] = None,
+                    predicates: Iterable[SelectionPredicate] = ()) -> "CombinationEnumerator":
+        """基于当前配置快照创建枚举器"""
+        snapshot = variable_processor.get_snapshot()
+        axes = build_axes(snapshot.variable_variables, expand_level2, allowed)
+        return cls(axes, predicates, config_version=snapshot.version)
+
+    def __len__(self) -> int:
+        return self.total
+
+    @property
+    def fingerprint(self) -> str:
+        """
+        维度与取值的指纹
+
+        索引与组合的对应关系只取决于维度，恢复枚举前比较指纹即可确认配置没有变化。
+        """
+        data = json.dumps([[axis.key, axis.choices] for axis in self.axes], ensure_ascii=False)
+        return hashlib.sha1(data.encode("utf-8")).hexdigest()[:16]
+
+    # ---- 索引 <-> 组合 ----
+
+    def digits(self, index: int) -> List[int]:
+        """索引转换为每个维度的取值下标"""
+        if not 0 <= index < self.total:
+            raise IndexError(f"组合索引越界: {index} / {self.total}")
+        digits = [0] * len(self.radices)
+        for position in range(len(self.radices) - 1, -1, -1):
+            index, digits[position] = divmod(index, self.radices[position])
+        return digits
+
+    def index_of(self, selection: Dict) -> int:
+        """组合转换为索引，取值不在维度中时抛出 ValueError"""
+        index = 0
+        for axis, radix in zip(self.axes, self.radices):
+            levels = selection.get(axis.category, {}).get(axis.name, {})
+            choice = (levels.get("一级", ""), levels.get("二级", ""))
+            index = index * radix + axis.choices.index(choice)
+        return index
+
+    def _selection(self, digits: Sequence[int]) -> Dict:
+        selection: Dict[str, Dict] = {}
+        for axis, digit in zip(self.axes, digits):
+            level1, level2 = axis.choices[digit]
+            selection.setdefault(axis.category, {})[axis.name] = {"一级": level1, "二级": level2}
+        return selection
+
+    def __getitem__(self, index: int) -> Dict:
+        return self._selection(self.digits(index))
+
+    # ---- 枚举 ----
+
+    def iter_range(self, start: int = 0, stop: int = None) -> Iterator[Tuple[int, Dict]]:
+        """
+        枚举 [start, stop) 内通过全部过滤条件的组合
+
+        只在起点做一次进制分解，之后按里程表方式逐位进位，不保存已生成的组合。
+
+        Yields:
+            Tuple[int, Dict]: (组合索引, 组合)
+        """
+        stop = self.total if stop is None else min(stop, self.total)
+        if start >= stop:
+            return
+        digits = self.digits(start)
+        last = len(digits) - 1
+        for index in range(start, stop):
+            selection = self._selection(digits)
+            if all(predicate(selection) for predicate in self.predicates):
+                yield index, selection
+            position = last
+            while position >= 0:
+                digits[position] += 1
+                if digits[position] < self.radices[position]:
+                    break
+                digits[position] = 0
+                position -= 1
+
+    def iter_shard(self, worker_id: int, num_workers: int, resume_from: int = None) -> Iterator[Tuple[int, Dict]]:
+        """
+        枚举某个工作进程负责的分片
+
+        Args:
+            resume_from: 从该索引继续（通常为上次处理的最后一个索引 + 1），需位于分片范围内
+        """
+        start, stop = shard_range(self.total, num_workers, worker_id)
+        if resume_from is not None:
+            start = max(start, resume_from)
+        return self.iter_range(start, stop)
+
+    def stream_labels(self, core_variables: Dict, start: int = 0, stop: int = None,
+                      output_format: str = "标签列表", language: str = "中文",
+                      separator: str = ", ", additional_prompt: str = "") -> Iterator[Tuple[int, str, str]]:
+        """
+        逐个组合生成标签
+
+        Yields:
+            Tuple[int, str, str]: (组合索引, 标签, 格式化输出)
+        """
+        for index, selection in self.iter_range(start, stop):
+            labels, formatted = LabelGenerator.generate_labels(
+                core_variables=core_variables,
+                variable_variables=selection,
+                clip_analysis=None,
+                additional_prompt=additional_prompt,
+                output_format=output_format,
+                language=language,
+                separator=separator,
+                include_clip=False
+            )
+            yield index, labels, formatted
+
+    def count(self, start: int = 0, stop: int = None) -> int:
+        """统计范围内通过过滤条件的组合数（没有过滤条件时直接计算）"""
+        stop = self.total if stop is None else min(stop, self.total)
+        if not self.predicates:
+            return max(0, stop - start)
+        return sum(1 for _ in self.iter_range(start, stop))
+
+
+def level1_excludes(category: str, name: str, values: Iterable[str]) -> SelectionPredicate:
+    """过滤条件：排除某个变量的指定一级取值"""
+    excluded = frozenset(values)
+
+    def predicate(selection: Dict) -> bool:
+        return selection.get(category, {}).get(name, {}).get("一级") not in excluded
+
+    return predicate
+
+
+def incompatible(first: Tuple[str, str, str], second: Tuple[str, str, str]) -> SelectionPredicate:
+    """
+    过滤条件：两个一级取值不能同时出现
+
+    Args:
+        first: (类别, 子类别, 一级取值)，例如 ("environment", "background", "水下")
+        second: 同上，例如 ("state_action", "pose", "飞行")
+    """
+    def matches(selection: Dict, spec: Tuple[str, str, str]) -> bool:
+        category, name, value = spec
+        return selection.get(category, {}).get(name, {}).get("一级") == value
+
+    def predicate(selection: Dict) -> bool:
+        return not (matches(selection, first) and matches(selection, second))
+
+    return predicate
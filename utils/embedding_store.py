@@ -0,0 +1,327 @@
+"""
+嵌入存储工具模块
+
+仅追加的分片嵌入存储，用于跨多次运行复用图像嵌入：
+
+    <root>/meta.json          维度、数据类型、每分片行数
+    <root>/keys.u64           按行号顺序追加的64位图像哈希，文件长度即已提交行数
+    <root>/shard_00000.bin    定宽浮点分片（预分配 shard_rows × dim），通过 np.memmap 读写
+
+写入先写分片数据再追加哈希，哈希文件决定可见行数，因此读取方永远不会看到半写入的行。
+多个进程可同时以只读方式打开同一存储；写入通过文件锁串行化（POSIX 使用 fcntl.flock，Windows 使用 msvcrt.locking）。
+"""
+
+import hashlib
+import json
+import os
+import threading
+from typing import Dict, Iterator, Optional, Tuple
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+STORE_META_FILE = "meta.json"
+STORE_KEYS_FILE = "keys.u64"
+STORE_LOCK_FILE = ".lock"
+STORE_VERSION = 1
+
+
+def hash_bytes(data: bytes) -> int:
+    """计算字节内容的64位哈希"""
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "little")
+
+
+def hash_images(images) -> np.ndarray:
+    """
+    计算 [B, H, W, C] 图像批次中每张图像的64位哈希
+
+    图像先量化为8位再哈希，同一张图片重复加载得到相同的键。
+    """
+    import torch
+
+    if isinstance(images, torch.Tensor):
+        images = (images.detach().clamp(0, 1) * 255).round().to(torch.uint8).cpu().numpy()
+    keys = np.empty(len(images), dtype=np.uint64)
+    for i, single in enumerate(images):
+        digest = hashlib.blake2b(digest_size=8)
+        digest.update(np.asarray(single.shape, dtype=np.int64).tobytes())
+        digest.update(np.ascontiguousarray(single).tobytes())
+        keys[i] = int.from_bytes(digest.digest(), "little")
+    return keys
+
+
+class _StoreLock:
+    """进程内线程锁 + 跨进程文件锁"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._thread_lock = threading.Lock()
+        self._file = None
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        try:
+            self._file = open(self.path, "a+b")
+            if fcntl is not None:
+                fcntl.flock(self._file, fcntl.LOCK_EX)
+            else:
+                # 锁定文件首字节；LK_LOCK 重试约10秒后抛出 OSError，持续等待直到拿到锁
+                self._file.seek(0)
+                while True:
+                    try:
+                        msvcrt.locking(self._file.fileno(), msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:
+                        continue
+        except BaseException:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self._thread_lock.release()
+            raise
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+        else:
+            self._file.seek(0)
+            msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        self._file.close()
+        self._file = None
+        self._thread_lock.release()
+
+
+class EmbeddingStore:
+    """内存映射的分片嵌入存储"""
+
+    def __init__(self, root: str, dim: int = None, shard_rows: int = 65536,
+                 dtype: str = "float32", readonly: bool = False):
+        self.root = root
+        self.readonly = readonly
+        self._lock = _StoreLock(os.path.join(root, STORE_LOCK_FILE))
+        self._shards: Dict[int, np.memmap] = {}
+        self._keys = np.empty(0, dtype=np.uint64)
+        # (排序后的哈希, 对应行号)，整体替换，查找时两者总是配套的
+        self._index = (np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.int64))
+
+        meta_path = os.path.join(root, STORE_META_FILE)
+        if os.path.exists(meta_path):
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            if dim is not None and meta["dim"] != dim:
+                raise ValueError(f"嵌入维度不匹配: 存储为 {meta['dim']}，请求为 {dim}")
+            self.dim = meta["dim"]
+            self.dtype = np.dtype(meta["dtype"])
+            self.shard_rows = meta["shard_rows"]
+        else:
+            self.dim = dim
+            self.dtype = np.dtype(dtype)
+            self.shard_rows = shard_rows
+            if dim is not None and not readonly:
+                self._create_meta()
+        self.refresh()
+
+    @property
+    def initialized(self) -> bool:
+        return self.dim is not None
+
+    def _create_meta(self):
+        os.makedirs(self.root, exist_ok=True)
+        with self._lock:
+            meta_path = os.path.join(self.root, STORE_META_FILE)
+            if os.path.exists(meta_path):
+                return
+            tmp_path = meta_path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({
+                    "version": STORE_VERSION,
+                    "dim": self.dim,
+                    "dtype": self.dtype.name,
+                    "shard_rows": self.shard_rows
+                }, f, indent=2)
+            os.replace(tmp_path, meta_path)
+
+    # ---- 读取 ----
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def refresh(self) -> int:
+        """读取其他进程新提交的行，返回当前行数"""
+        keys_path = os.path.join(self.root, STORE_KEYS_FILE)
+        try:
+            committed = os.path.getsize(keys_path) // 8
+        except OSError:
+            committed = 0
+        known = len(self._keys)
+        if committed > known:
+            new_keys = np.fromfile(keys_path, dtype=np.uint64, count=committed - known, offset=known * 8)
+            # 只排序新提交的哈希，再按 searchsorted 的位置插入已排序的索引，不对全部行重新排序
+            order = np.argsort(new_keys, kind="stable")
+            sorted_keys, sorted_rows = self._index
+            positions = np.searchsorted(sorted_keys, new_keys[order], side="right")
+            self._index = (np.insert(sorted_keys, positions, new_keys[order]),
+                           np.insert(sorted_rows, positions, order.astype(np.int64) + known))
+            self._keys = np.concatenate([self._keys, new_keys])
+        return len(self._keys)
+
+    def _shard(self, shard_index: int, writable: bool = False) -> np.memmap:
+        shard = self._shards.get(shard_index)
+        if shard is None or (writable and not shard.flags.writeable):
+            path = os.path.join(self.root, f"shard_{shard_index:05d}.bin")
+            if writable and not os.path.exists(path):
+                with open(path, "wb") as f:
+                    f.truncate(self.shard_rows * self.dim * self.dtype.itemsize)
+            shard = np.memmap(path, dtype=self.dtype, mode="r+" if writable else "r",
+                              shape=(self.shard_rows, self.dim))
+            self._shards[shard_index] = shard
+        return shard
+
+    def lookup(self, keys) -> np.ndarray:
+        """查找哈希对应的行号，不存在时为 -1"""
+        keys = np.asarray(keys, dtype=np.uint64)
+        sorted_keys, sorted_rows = self._index
+        if not len(sorted_keys):
+            return np.full(len(keys), -1, dtype=np.int64)
+        positions = np.searchsorted(sorted_keys, keys)
+        positions = np.minimum(positions, len(sorted_keys) - 1)
+        found = sorted_keys[positions] == keys
+        return np.where(found, sorted_rows[positions], -1)
+
+    def rows(self, start: int, stop: int) -> np.ndarray:
+        """
+        读取连续行
+
+        范围落在单个分片内时返回内存映射视图（零拷贝），跨分片时拼接。
+        """
+        stop = min(stop, len(self))
+        if start >= stop:
+            return np.empty((0, self.dim or 0), dtype=self.dtype)
+        first, last = start // self.shard_rows, (stop - 1) // self.shard_rows
+        if first == last:
+            offset = first * self.shard_rows
+            return self._shard(first)[start - offset:stop - offset]
+        return np.concatenate([
+            self.rows(max(start, s * self.shard_rows), min(stop, (s + 1) * self.shard_rows))
+            for s in range(first, last + 1)
+        ])
+
+    def get(self, keys) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        按哈希取出嵌入
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: [N, dim] 嵌入（未命中的行为0）与命中掩码
+        """
+        self.refresh()
+        rows = self.lookup(keys)
+        found = rows >= 0
+        output = np.zeros((len(rows), self.dim or 0), dtype=self.dtype)
+        hits = np.flatnonzero(found)
+        shard_indices, offsets = np.divmod(rows[hits], self.shard_rows)
+        # 每个分片一次花式索引
+        for shard_index in np.unique(shard_indices):
+            in_shard = shard_indices == shard_index
+            output[hits[in_shard]] = self._shard(int(shard_index))[offsets[in_shard]]
+        return output, found
+
+    def iter_shards(self) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """按分片遍历 (哈希, 嵌入视图)，嵌入为只读内存映射，不复制数据"""
+        self.refresh()
+        for start in range(0, len(self), self.shard_rows):
+            stop = min(start + self.shard_rows, len(self))
+            yield self._keys[start:stop], self.rows(start, stop)
+
+    def rescore(self, analyzer, language: str = "中文", threshold: float = 0.0,
+                feature_ids: np.ndarray = None) -> Iterator[Tuple[np.ndarray, "object"]]:
+        """
+        直接从磁盘重新打分，不重新编码图像
+
+        Args:
+            analyzer: CLIPAnalyzerTool 实例
+
+        Yields:
+            Tuple[np.ndarray, AnalysisResult]: 每个分片的哈希与分析结果
+        """
+        for keys, embeddings in self.iter_shards():
+            yield keys, analyzer.analyze(embeddings, language, threshold, feature_ids)
+
+    # ---- 写入 ----
+
+    def add(self, keys, embeddings) -> int:
+        """
+        追加嵌入，已存在的哈希会被跳过
+
+        Returns:
+            int: 实际新增的行数
+        """
+        if self.readonly:
+            raise PermissionError("嵌入存储以只读方式打开")
+        keys = np.asarray(keys, dtype=np.uint64)
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if embeddings.ndim == 1:
+            embeddings = embeddings[None, :]
+        if self.dim is None:
+            self.dim = embeddings.shape[1]
+            self._create_meta()
+        if embeddings.shape[1] != self.dim:
+            raise ValueError(f"嵌入维度不匹配: 存储为 {self.dim}，写入为 {embeddings.shape[1]}")
+
+        with self._lock:
+            self.refresh()
+            # 跳过已存在的以及批次内重复的哈希
+            _, first_index = np.unique(keys, return_index=True)
+            candidates = np.sort(first_index)
+            candidates = candidates[self.lookup(keys[candidates]) < 0]
+            if not len(candidates):
+                return 0
+
+            new_keys = keys[candidates]
+            new_rows = embeddings[candidates].astype(self.dtype, copy=False)
+            start = len(self)
+            written = 0
+            while written < len(new_rows):
+                row = start + written
+                shard_index, offset = divmod(row, self.shard_rows)
+                count = min(self.shard_rows - offset, len(new_rows) - written)
+                shard = self._shard(shard_index, writable=True)
+                shard[offset:offset + count] = new_rows[written:written + count]
+                shard.flush()
+                written += count
+
+            # 分片数据落盘后再提交哈希
+            with open(os.path.join(self.root, STORE_KEYS_FILE), "ab") as f:
+                f.write(new_keys.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            self.refresh()
+            return len(new_keys)
+
+
+_open_stores: Dict[str, EmbeddingStore] = {}
+_open_stores_lock = threading.Lock()
+
+
+def get_embedding_store(root: str, namespace: str = None) -> EmbeddingStore:
+    """
+    获取（并缓存）某目录对应的嵌入存储
+
+    Args:
+        root: 存储根目录
+        namespace: 子目录名，通常为编码配置指纹，不同模型/预处理/精度的嵌入互不混用
+    """
+    root = os.path.abspath(os.path.expanduser(root))
+    if namespace:
+        root = os.path.join(root, namespace)
+    with _open_stores_lock:
+        store = _open_stores.get(root)
+        if store is None:
+            store = EmbeddingStore(root)
+            _open_stores[root] = store
+        return store
@@ -0,0 +1,201 @@
+"""
+批量图像预处理工具模块
+"""
+
+import time
+from typing import Dict, NamedTuple, Sequence, Tuple
+
+import torch
+import torch.nn.functional as F
+
+# CLIP默认归一化参数
+CLIP_MEAN = (0.48145466, 0.4578275, 0.40821073)
+CLIP_STD = (0.26862954, 0.26130258, 0.27577711)
+
+
+class ResizePlan(NamedTuple):
+    """单一输入分辨率对应的裁剪/缩放计划"""
+    top: int
+    left: int
+    crop_size: int
+    size: int
+    needs_resize: bool
+
+
+class ImagePreprocessor:
+    """
+    直接作用于ComfyUI IMAGE张量 [B, H, W, C] 的批量预处理器
+
+    先以视图方式中心裁剪出最短边大小的正方形，再对整个批次做一次插值，
+    最后用一次 addcmul 完成归一化，全程不经过PIL。
+    """
+
+    def __init__(self, size: int = 224, mean: Sequence[float] = CLIP_MEAN,
+                 std: Sequence[float] = CLIP_STD, interpolation: str = "bicubic"):
+        self.size = size
+        self.mean = tuple(mean)
+        self.std = tuple(std)
+        self.interpolation = interpolation
+        self._plans: Dict[Tuple[int, int, int], ResizePlan] = {}
+        self._norm_cache: Dict[Tuple, Tuple[torch.Tensor, torch.Tensor]] = {}
+
+    def get_plan(self, height: int, width: int, size: int = None) -> ResizePlan:
+        """获取（并缓存）某输入分辨率的缩放计划"""
+        size = size or self.size
+        key = (height, width, size)
+        plan = self._plans.get(key)
+        if plan is None:
+            crop_size = min(height, width)
+            plan = ResizePlan(
+                top=(height - crop_size) // 2,
+                left=(width - crop_size) // 2,
+                crop_size=crop_size,
+                size=size,
+                needs_resize=crop_size != size
+            )
+            self._plans[key] = plan
+        return plan
+
+    def _get_norm(self, mean: Tuple[float, ...], std: Tuple[float, ...],
+                  device: torch.device, dtype: torch.dtype) -> Tuple[torch.Tensor, torch.Tensor]:
+        """获取融合归一化所需的 scale/shift： (x - mean) / std == x * scale + shift"""
+        key = (mean, std, device, dtype)
+        norm = self._norm_cache.get(key)
+        if norm is None:
+            mean_t = torch.tensor(mean, device=device, dtype=dtype).view(1, -1, 1, 1)
+            std_t = torch.tensor(std, device=device, dtype=dtype).view(1, -1, 1, 1)
+            scale = 1.0 / std_t
+            norm = (scale, -mean_t * scale)
+            self._norm_cache[key] = norm
+        return norm
+
+    def preprocess(self, image: torch.Tensor, size: int = None,
+                   mean: Sequence[float] = None, std: Sequence[float] = None) -> torch.Tensor:
+        """
+        批量预处理图像
+
+        Args:
+            image: 图像张量 [B, H, W, C]，取值范围 0~1
+            size: 输出边长，默认使用初始化时的大小
+            mean: 归一化均值
+            std: 归一化标准差
+
+        Returns:
+            torch.Tensor: [B, 3, size, size]，channels_last 内存布局
+        """
+        if image.dim() == 3:
+            image = image.unsqueeze(0)
+        if not image.is_floating_point():
+            image = image.float() / 255.0
+
+        mean = tuple(mean) if mean is not None else self.mean
+        std = tuple(std) if std is not None else self.std
+
+        _, height, width, _ = image.shape
+        plan = self.get_plan(height, width, size)
+
+        # [B, H, W, C] -> [B, C, H, W] 视图，底层内存即为 channels_last
+        pixels = image[..., :3].permute(0, 3, 1, 2)
+        pixels = pixels[:, :, plan.top:plan.top + plan.crop_size, plan.left:plan.left + plan.crop_size]
+
+        if plan.needs_resize:
+            pixels = F.interpolate(
+                pixels.contiguous(memory_format=torch.channels_last),
+                size=(plan.size, plan.size),
+                mode=self.interpolation,
+                align_corners=False,
+                antialias=self.interpolation in ("bilinear", "bicubic")
+            ).clamp_(0.0, 1.0)
+        else:
+            pixels = pixels.contiguous(memory_format=torch.channels_last)
+
+        scale, shift = self._get_norm(mean, std, pixels.device, pixels.dtype)
+        return torch.addcmul(shift, pixels, scale).contiguous(memory_format=torch.channels_last)
+
+    __call__ = preprocess
+
+    def preprocess_list(self, images: Sequence[torch.Tensor], size: int = None,
+                        mean: Sequence[float] = None, std: Sequence[float] = None) -> torch.Tensor:
+        """
+        预处理分辨率各异的图像列表
+
+        相同分辨率的图像合并为一个批次处理，结果按输入顺序返回。
+
+        Args:
+            images: [H, W, C] 或 [1, H, W, C] 张量列表
+
+        Returns:
+            torch.Tensor: [N, 3, size, size]
+        """
+        groups: Dict[Tuple[int, ...], list] = {}
+        for index, single in enumerate(images):
+            if single.dim() == 4:
+                single = single[0]
+            groups.setdefault(tuple(single.shape), []).append((index, single))
+
+        output = None
+        for members in groups.values():
+            indices = [index for index, _ in members]
+            batch = self.preprocess(torch.stack([single for _, single in members]), size, mean, std)
+            if output is None:
+                output = batch.new_empty((len(images),) + tuple(batch.shape[1:])).contiguous(
+                    memory_format=torch.channels_last)
+            output[indices] = batch
+        return output
+
+    def clear_cache(self):
+        """清空缩放计划和归一化缓存"""
+        self._plans.clear()
+        self._norm_cache.clear()
+
+
+def _pil_preprocess(image: torch.Tensor, size: int, mean: Sequence[float], std: Sequence[float]) -> torch.Tensor:
+    """逐张经PIL处理的参考实现，仅用于基准测试对比"""
+    import numpy as np
+    from PIL import Image
+    import torchvision.transforms as transforms
+
+    transform = transforms.Compose([
+        transforms.Resize(size, interpolation=transforms.InterpolationMode.BICUBIC),
+        transforms.CenterCrop(size),
+        transforms.ToTensor(),
+        transforms.Normalize(mean, std),
+    ])
+    outputs = []
+    for single in image:
+        array = (single[..., :3].clamp(0, 1).cpu().numpy() * 255).astype(np.uint8)
+        outputs.append(transform(Image.fromarray(array)))
+    return torch.stack(outputs)
+
+
+def benchmark_against_pil(batch_size: int = 16, height: int = 768, width: int = 512,
+                          size: int = 224, repeats: int = 5) -> Dict[str, float]:
+    """
+    与逐张PIL预处理流程对比的基准测试
+
+    Returns:
+        Dict: 两种方式的平均耗时（毫秒）及加速比
+    """
+    image = torch.rand(batch_size, height, width, 3)
+    preprocessor = ImagePreprocessor(size=size)
+    preprocessor.preprocess(image)  # 预热，生成缩放计划
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        preprocessor.preprocess(image)
+    batched_ms = (time.perf_counter() - start) * 1000 / repeats
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        _pil_preprocess(image, size, CLIP_MEAN, CLIP_STD)
+    pil_ms = (time.perf_counter() - start) * 1000 / repeats
+
+    return {
+        "batched_ms": batched_ms,
+        "pil_ms": pil_ms,
+        "speedup": pil_ms / batched_ms if batched_ms > 0 else float("inf")
+    }
+
+
+# 创建全局实例
+image_preprocessor = ImagePreprocessor()
@@ -0,0 +1,370 @@
+"""
+CPU推理运行时工具模块
+
+将已加载的CLIP视觉塔导出一次（TorchScript 或 ONNX），按检查点哈希缓存到磁盘，
+之后通过优化后的运行时推理，减少小批量时 eager 模式的调度开销。
+导出或推理失败时自动回退到 eager 模式。
+
+对比各精度模式（使用模拟的CLIP视觉模型，不依赖ComfyUI）：
+
+    python -m utils.inference_runtime --batch-size 4 --repeats 10
+"""
+
+import argparse
+import copy
+import hashlib
+import os
+import threading
+import time
+import weakref
+from contextlib import nullcontext
+from typing import Callable, ContextManager, Dict, Optional
+
+import numpy as np
+import torch
+
+# 导出产物缓存目录
+EXPORT_CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cache", "exported")
+
+RUNTIME_BACKENDS = ("eager", "torchscript", "onnx")
+
+# 检查点指纹读取的头尾字节数
+_FINGERPRINT_CHUNK = 16 * 1024 * 1024
+
+
+def checkpoint_hash(path: str) -> str:
+    """
+    检查点指纹：文件大小 + 头尾各16MB内容的sha256
+
+    对数GB的检查点也只需读取少量数据，足以区分不同的模型文件。
+    """
+    digest = hashlib.sha256()
+    size = os.path.getsize(path)
+    digest.update(str(size).encode("ascii"))
+    with open(path, "rb") as f:
+        digest.update(f.read(_FINGERPRINT_CHUNK))
+        if size > 2 * _FINGERPRINT_CHUNK:
+            f.seek(-_FINGERPRINT_CHUNK, os.SEEK_END)
+            digest.update(f.read(_FINGERPRINT_CHUNK))
+    return digest.hexdigest()[:32]
+
+
+def default_inference_slots(device=None) -> int:
+    """
+    按设备选择默认的并发推理数
+
+    GPU 上两个并发推理即可让数据搬运与计算重叠；CPU 上每4个核心一个推理槽，
+    最多4个，避免单次推理的线程数过少。
+    """
+    if device is not None and torch.device(device).type != "cpu":
+        return 2
+    return max(1, min(4, (os.cpu_count() or 1) // 4))
+
+
+def configure_cpu_threads(intra_op_threads: int = 0, inter_op_threads: int = 0):
+    """设置 torch 的 intra/inter-op 线程数，0 表示保持默认"""
+    if intra_op_threads > 0:
+        torch.set_num_threads(intra_op_threads)
+    if inter_op_threads > 0 and inter_op_threads != torch.get_num_interop_threads():
+        try:
+            torch.set_num_interop_threads(inter_op_threads)
+        except RuntimeError:
+            # inter-op 线程池只能在首次并行工作前设置
+            print(f"⚠️ inter-op 线程数只能在首次并行计算前设置，仍为 {torch.get_num_interop_threads()}"
+                  f"（请求 {inter_op_threads}），请在启动后首次推理前配置")
+
+
+class _ImageEmbedsModule(torch.nn.Module):
+    """只输出 image_embeds 的包装模块，便于导出"""
+
+    def __init__(self, model: torch.nn.Module):
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixel_values: torch.Tensor) -> torch.Tensor:
+        return self.model(pixel_values=pixel_values, intermediate_output=-2)[2]
+
+
+class ExportedVisionEncoder:
+    """导出后的视觉编码器：调用时输入像素 [B, 3, S, S]，输出图像嵌入 [B, D]"""
+
+    def __init__(self, backend: str, path: str, run: Callable[[torch.Tensor], torch.Tensor]):
+        self.backend = backend
+        self.path = path
+        self.available = True
+        self._run = run
+
+    def __call__(self, pixel_values: torch.Tensor) -> torch.Tensor:
+        return self._run(pixel_values)
+
+    def __repr__(self) -> str:
+        return f"ExportedVisionEncoder(backend={self.backend!r}, path={self.path!r}, available={self.available})"
+
+
+def _load_torchscript(path: str) -> Callable:
+    module = torch.jit.load(path, map_location="cpu")
+    module.eval()
+
+    def run(pixel_values: torch.Tensor) -> torch.Tensor:
+        with torch.inference_mode():
+            return module(pixel_values.to("cpu", torch.float32).contiguous())
+
+    return run
+
+
+def _load_onnx(path: str, intra_op_threads: int, inter_op_threads: int) -> Callable:
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if intra_op_threads > 0:
+        options.intra_op_num_threads = intra_op_threads
+    if inter_op_threads > 0:
+        options.inter_op_num_threads = inter_op_threads
+    session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+    input_name = session.get_inputs()[0].name
+
+    def run(pixel_values: torch.Tensor) -> torch.Tensor:
+        array = np.ascontiguousarray(pixel_values.detach().to("cpu", torch.float32).numpy())
+        return torch.from_numpy(session.run(None, {input_name: array})[0])
+
+    return run
+
+
+_export_lock = threading.Lock()
+
+
+def export_vision_encoder(clip_vision, checkpoint_path: str, backend: str = "torchscript",
+                          intra_op_threads: int = 0, inter_op_threads: int = 0,
+                          cache_dir: str = EXPORT_CACHE_DIR,
+                          checkpoint_key: str = None) -> Optional[ExportedVisionEncoder]:
+    """
+    导出（或从缓存加载）视觉编码器
+
+    Args:
+        clip_vision: ComfyUI的CLIP视觉模型对象（需要 .model 属性）
+        checkpoint_path: 检查点路径，用于计算缓存键
+        backend: "torchscript" 或 "onnx"
+        intra_op_threads: intra-op 线程数，0 表示默认
+        inter_op_threads: inter-op 线程数，0 表示默认
+        checkpoint_key: 已计算的检查点指纹，默认取 clip_vision.checkpoint_key，都没有时才读取文件计算
+
+    Returns:
+        ExportedVisionEncoder，失败时返回 None（调用方继续使用 eager 模式）
+    """
+    if backend not in ("torchscript", "onnx"):
+        return None
+    model = getattr(clip_vision, "model", None)
+    if model is None:
+        return None
+
+    configure_cpu_threads(intra_op_threads, inter_op_threads)
+    image_size = getattr(clip_vision, "image_size", 224)
+    extension = "pt" if backend == "torchscript" else "onnx"
+    checkpoint_key = checkpoint_key or getattr(clip_vision, "checkpoint_key", None) or checkpoint_hash(checkpoint_path)
+    tmp_path = None
+
+    try:
+        with _export_lock:
+            os.makedirs(cache_dir, exist_ok=True)
+            key = f"{checkpoint_key}_{image_size}"
+            path = os.path.join(cache_dir, f"{key}.{extension}")
+
+            if not os.path.exists(path):
+                print(f"🔧 正在导出CLIP视觉模型（{backend}），仅首次需要: {path}")
+                wrapper = _ImageEmbedsModule(model).eval()
+                dummy = torch.zeros(1, 3, image_size, image_size, device=next(model.parameters()).device)
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                with torch.no_grad():
+                    if backend == "torchscript":
+                        traced = torch.jit.trace(wrapper, dummy, check_trace=False)
+                        traced = torch.jit.freeze(traced.eval())
+                        torch.jit.save(traced, tmp_path)
+                    else:
+                        torch.onnx.export(
+                            wrapper, (dummy,), tmp_path,
+                            input_names=["pixel_values"], output_names=["image_embeds"],
+                            dynamic_axes={"pixel_values": {0: "batch"}, "image_embeds": {0: "batch"}},
+                            opset_version=17
+                        )
+                os.replace(tmp_path, path)
+
+        if backend == "torchscript":
+            run = _load_torchscript(path)
+        else:
+            run = _load_onnx(path, intra_op_threads, inter_op_threads)
+        print(f"✅ 已加载导出的CLIP视觉推理图（{backend}）: {path}")
+        return ExportedVisionEncoder(backend, path, run)
+    except Exception as e:
+        if tmp_path is not None and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        print(f"⚠️ 导出CLIP视觉模型失败，使用eager模式: {e}")
+        return None
+
+
+# ---- 降精度推理 ----
+
+PRECISION_MODES = ("float32", "bf16", "int8")
+
+# 量化模型注册表：以原模型的弱引用为键，避免每次执行重复量化；原模型释放后条目随之移除
+_quantized_models: "weakref.WeakKeyDictionary[torch.nn.Module, torch.nn.Module]" = weakref.WeakKeyDictionary()
+_quantize_lock = threading.Lock()
+
+
+def get_quantized_model(model: torch.nn.Module) -> torch.nn.Module:
+    """
+    获取（并缓存）Linear层动态int8量化后的模型副本（CPU）
+
+    ComfyUI的Linear层是 torch.nn.Linear 的子类（仅重写 forward），
+    量化前在副本上将其还原为 torch.nn.Linear，以便 quantize_dynamic 识别。
+    """
+    quantized = _quantized_models.get(model)
+    if quantized is not None:
+        return quantized
+    with _quantize_lock:
+        quantized = _quantized_models.get(model)
+        if quantized is None:
+            from torch.ao.quantization import quantize_dynamic
+
+            float_model = copy.deepcopy(model).to("cpu").float().eval()
+            for module in float_model.modules():
+                if isinstance(module, torch.nn.Linear) and type(module) is not torch.nn.Linear:
+                    module.__class__ = torch.nn.Linear
+            quantized = quantize_dynamic(float_model, {torch.nn.Linear}, dtype=torch.qint8)
+            _quantized_models[model] = quantized
+    return quantized
+
+
+def precision_context(precision: str, device) -> ContextManager:
+    """bf16 模式返回 autocast 上下文，其余模式为空上下文"""
+    if precision == "bf16":
+        device_type = torch.device(device).type
+        return torch.autocast(device_type, dtype=torch.bfloat16)
+    return nullcontext()
+
+
+class _RssSampler:
+    """后台采样进程常驻内存，用于估计峰值内存"""
+
+    def __init__(self, interval: float = 0.002):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    @staticmethod
+    def current_rss() -> int:
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError, AttributeError):
+            import resource
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self.current_rss())
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        self.baseline = self.current_rss()
+        self.peak = self.baseline
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.current_rss())
+
+
+def benchmark_precision_modes(clip_vision, pixel_values: torch.Tensor, analyzer=None,
+                              repeats: int = 5, top_k: int = 5) -> Dict[str, Dict]:
+    """
+    对比各精度模式的延迟、峰值内存和top-k标签一致性
+
+    Args:
+        clip_vision: CLIP视觉模型对象
+        pixel_values: 预处理后的像素 [B, 3, S, S]
+        analyzer: CLIPAnalyzerTool，默认使用全局实例
+        top_k: 计算与 float32 一致性时的 k
+
+    Returns:
+        Dict: {模式: {"latency_ms", "peak_memory_mb", "cosine_to_float32", "topk_agreement"}}
+            未设置文本编码器时 topk_agreement 为 None
+    """
+    if analyzer is None:
+        from .clip_analyzer import clip_analyzer as analyzer
+
+    report: Dict[str, Dict] = {}
+    baseline_embeddings = None
+    baseline_top = None
+    for precision in PRECISION_MODES:
+        analyzer.encode_pixels(clip_vision, pixel_values, precision=precision)  # 预热（含量化）
+        with _RssSampler() as sampler:
+            start = time.perf_counter()
+            for _ in range(repeats):
+                embeddings = analyzer.encode_pixels(clip_vision, pixel_values, precision=precision)
+            latency_ms = (time.perf_counter() - start) * 1000 / repeats
+
+        embeddings = embeddings.float().cpu()
+        text = analyzer.text_embeddings()
+        top = None
+        if text is not None and embeddings.shape[-1] == text.shape[1]:
+            scores = analyzer.score_embeddings(embeddings, analyzer.all_feature_ids)
+            top = np.argsort(-scores, axis=1)[:, :top_k]
+        if baseline_embeddings is None:
+            baseline_embeddings, baseline_top = embeddings, top
+
+        agreement = None
+        if top is not None and baseline_top is not None:
+            agreement = float(np.mean([
+                len(set(a) & set(b)) / top_k for a, b in zip(top, baseline_top)
+            ]))
+        report[precision] = {
+            "latency_ms": latency_ms,
+            "peak_memory_mb": (sampler.peak - sampler.baseline) / (1024 * 1024),
+            "cosine_to_float32": float(torch.nn.functional.cosine_similarity(
+                embeddings, baseline_embeddings, dim=-1).mean()),
+            "topk_agreement": agreement,
+        }
+    return report
+
+
+def format_benchmark_table(report: Dict[str, Dict]) -> str:
+    """把 benchmark_precision_modes 的结果格式化为表格"""
+    lines = [f"{'精度':<10}{'延迟(ms)':>12}{'峰值内存(MB)':>16}{'与float32余弦':>16}{'top-k一致性':>14}"]
+    for precision, row in report.items():
+        agreement = "-" if row["topk_agreement"] is None else f"{row['topk_agreement']:.1%}"
+        lines.append(f"{precision:<10}{row['latency_ms']:>12.2f}{row['peak_memory_mb']:>16.1f}"
+                     f"{row['cosine_to_float32']:>16.4f}{agreement:>14}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对比各精度模式的延迟与标签一致性（模拟CLIP视觉模型）")
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--dim", type=int, default=512, help="模拟CLIP模型的嵌入维度")
+    parser.add_argument("--intra-op-threads", type=int, default=0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    from .clip_analyzer import CLIPAnalyzerTool
+    from .workflow_replay import FakeCLIPVision, fake_text_encoder
+
+    configure_cpu_threads(args.intra_op_threads)
+    clip_vision = FakeCLIPVision(args.dim)
+    analyzer = CLIPAnalyzerTool()
+    analyzer.set_text_encoder(fake_text_encoder(args.dim), f"fake:{args.dim}")
+    generator = torch.Generator().manual_seed(args.seed)
+    pixel_values = torch.rand(args.batch_size, 3, clip_vision.image_size, clip_vision.image_size, generator=generator)
+
+    report = benchmark_precision_modes(clip_vision, pixel_values, analyzer, repeats=args.repeats, top_k=args.top_k)
+    print(f"📊 批大小 {args.batch_size}，每种精度 {args.repeats} 次，torch 线程数 {torch.get_num_threads()}")
+    print(format_benchmark_table(report))
+
+
+if __name__ == "__main__":
+    main()
@@ -7,6 +7,24 @@ import re
 from typing import Dict, List, Tuple, Any
 from datetime import datetime
 
+from .analysis_result import AnalysisResult
+from .template_registry import template_registry
+
+# 简单的中英文转换表
+CORE_EN_MAPPING = {
+    "长发": "long hair", "短发": "short hair", "卷发": "curly hair",
+    "直发": "straight hair", "男性": "male", "女性": "female",
+    "年轻": "young", "老年": "old", "黑色": "black", "金色": "blonde",
+    "蓝色": "blue", "绿色": "green", "红色": "red", "白色": "white"
+}
+
+VARIABLE_EN_MAPPING = {
+    "微笑": "smiling", "愤怒": "angry", "悲伤": "sad",
+    "站立": "standing", "坐姿": "sitting", "奔跑": "running",
+    "城市": "city", "白天": "daytime", "夜晚": "night",
+    "动漫": "anime", "写实": "realistic"
+}
+
 class LabelGenerator:
     """标签生成器"""
     
@@ -76,11 +94,31 @@ class LabelGenerator:
             result = LabelGenerator._format_prompt(unique_tags, language)
             formatted = result
         else:
-            result = separator.join(unique_tags)
+            # 用户自定义模板：已预编译为函数，这里只是一次查找和一次调用
+            render = template_registry.lookup(output_format, language)
+            if render is not None:
+                slots = LabelGenerator._dedupe_slots(core_tags, variable_tags, clip_tags, additional_tags)
+                result = render(*slots, separator)
+            else:
+                result = separator.join(unique_tags)
             formatted = result
         
         return result, formatted
     
+    @staticmethod
+    def _dedupe_slots(*slots: List[str]) -> List[List[str]]:
+        """跨槽位去重，保留每个标签第一次出现的位置"""
+        seen = set()
+        deduped = []
+        for tags in slots:
+            kept = []
+            for tag in tags:
+                if tag and tag not in seen:
+                    seen.add(tag)
+                    kept.append(tag)
+            deduped.append(kept)
+        return deduped
+    
     @staticmethod
     def _process_core_variables(core_variables: Dict, language: str = "中文") -> List[str]:
         """处理核心变量"""
@@ -91,13 +129,7 @@ class LabelGenerator:
                 if value:  # 只添加非空值
                     if language == "英文":
                         # 简单的中英文转换
-                        en_mapping = {
-                            "长发": "long hair", "短发": "short hair", "卷发": "curly hair",
-                            "直发": "straight hair", "男性": "male", "女性": "female",
-                            "年轻": "young", "老年": "old", "黑色": "black", "金色": "blonde",
-                            "蓝色": "blue", "绿色": "green", "红色": "red", "白色": "white"
-                        }
-                        tag = en_mapping.get(value, value)
+                        tag = CORE_EN_MAPPING.get(value, value)
                     else:
                         tag = value
                     tags.append(tag)
@@ -116,15 +148,9 @@ class LabelGenerator:
                 
                 if level1:
                     if language == "英文":
-                        en_mapping = {
-                            "微笑": "smiling", "愤怒": "angry", "悲伤": "sad",
-                            "站立": "standing", "坐姿": "sitting", "奔跑": "running",
-                            "城市": "city", "白天": "daytime", "夜晚": "night",
-                            "动漫": "anime", "写实": "realistic"
-                        }
-                        tag = en_mapping.get(level1, level1)
+                        tag = VARIABLE_EN_MAPPING.get(level1, level1)
                         if level2:
-                            tag2 = en_mapping.get(level2, level2)
+                            tag2 = VARIABLE_EN_MAPPING.get(level2, level2)
                             tag = f"{tag} ({tag2})"
                     else:
                         if level2:
@@ -138,19 +164,25 @@ class LabelGenerator:
     
     @staticmethod
     def _process_clip_analysis(clip_analysis: Dict, language: str = "中文") -> List[str]:
-        """处理CLIP分析结果"""
+        """
+        处理CLIP分析结果
+
+        阈值、top-k 和类别过滤已由CLIP图像分析器或CLIP分数过滤器完成，这里不再二次过滤。
+        """
         tags = []
         
+        if isinstance(clip_analysis, AnalysisResult):
+            # 紧凑结果：直接在数组视图上选择，不构造中间字典
+            return clip_analysis.with_language(language).tags()
+        
         if isinstance(clip_analysis, dict):
             for feature, data in clip_analysis.items():
                 if isinstance(data, dict) and "confidence" in data:
-                    # 这里可以根据需要过滤低置信度的特征
-                    if data.get("confidence", 0) >= 0.5:
-                        if language == "英文":
-                            english = data.get("english", feature)
-                            tags.append(english)
-                        else:
-                            tags.append(feature)
+                    if language == "英文":
+                        english = data.get("english", feature)
+                        tags.append(english)
+                    else:
+                        tags.append(feature)
         
         return tags
     
@@ -196,6 +228,9 @@ class LabelGenerator:
     def _format_json(core_variables: Dict, variable_variables: Dict, 
                     clip_analysis: Dict, additional_tags: List[str]) -> str:
         """格式化为JSON"""
+        if isinstance(clip_analysis, AnalysisResult):
+            clip_analysis = clip_analysis.to_dict()
+        
         result = {
             "metadata": {
                 "generator": "ComfyUI Character Labeler",
@@ -0,0 +1,368 @@
+"""
+本地标签服务模块
+
+脱离ComfyUI节点图，通过HTTP调用同一套CLIP分析器和LabelGenerator。
+并发请求会被动态合并为批次，每个批次只做一次批量编码。
+
+运行方式（在插件根目录下）:
+    python -m utils.label_service --port 8190
+
+接口:
+    POST /label   请求体为原始图片字节（PNG/JPEG等），
+                  可选查询参数 language、output_format、threshold、separator
+    GET  /stats   延迟与批大小统计
+    GET  /health  健康检查
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import time
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+import torch
+
+from .clip_analyzer import clip_analyzer
+from .label_generator import LabelGenerator
+from .shared_tables import shared_tables
+
+
+def _percentile(values, q: float) -> float:
+    """计算百分位数，空序列返回0"""
+    if not values:
+        return 0.0
+    return float(np.percentile(np.asarray(values, dtype=np.float64), q))
+
+
+class DynamicBatcher:
+    """
+    动态批处理器
+
+    收到第一个请求后最多等待 max_wait_ms 毫秒，或凑满 max_batch_size 个请求，
+    然后在线程池中一次性调用 process_batch 处理整个批次。
+    """
+
+    def __init__(self, process_batch: Callable[[List[Any]], List[Any]],
+                 max_batch_size: int = 8, max_wait_ms: float = 10.0, history_size: int = 10000):
+        self.process_batch = process_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._latencies_ms = deque(maxlen=history_size)
+        self._batch_sizes = deque(maxlen=history_size)
+        self._total_requests = 0
+        self._total_batches = 0
+
+    def start(self):
+        """启动后台批处理任务（需在事件循环中调用）"""
+        if self._worker is None:
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """停止后台批处理任务"""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    async def submit(self, item: Any) -> Any:
+        """提交单个请求并等待其所在批次处理完成"""
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future, time.perf_counter()))
+        return await future
+
+    async def _collect(self) -> List[Tuple[Any, asyncio.Future, float]]:
+        """收集一个批次"""
+        batch = [await self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            items = [item for item, _, _ in batch]
+            try:
+                results = await loop.run_in_executor(None, self.process_batch, items)
+            except Exception as e:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            now = time.perf_counter()
+            self._total_batches += 1
+            self._total_requests += len(batch)
+            self._batch_sizes.append(len(batch))
+            for (_, future, submitted), result in zip(batch, results):
+                self._latencies_ms.append((now - submitted) * 1000)
+                if future.done():
+                    continue
+                # 单个请求的错误（例如无法解码的图片）只影响该请求
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    def stats(self) -> Dict[str, float]:
+        """返回延迟百分位与批大小统计"""
+        latencies = list(self._latencies_ms)
+        sizes = list(self._batch_sizes)
+        return {
+            "requests": self._total_requests,
+            "batches": self._total_batches,
+            "latency_p50_ms": _percentile(latencies, 50),
+            "latency_p99_ms": _percentile(latencies, 99),
+            "batch_size_mean": float(np.mean(sizes)) if sizes else 0.0,
+            "batch_size_max": max(sizes) if sizes else 0,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+        }
+
+
+class BadRequest(ValueError):
+    """请求参数或图片无效，返回400"""
+
+
+def decode_image(data: bytes) -> torch.Tensor:
+    """
+    将上传的图片字节解码为 [H, W, 3] 浮点张量
+
+    Raises:
+        BadRequest: 无法识别的图片数据
+    """
+    from PIL import Image
+
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            array = np.asarray(img.convert("RGB"), dtype=np.float32) / 255.0
+    except OSError as e:
+        raise BadRequest(f"无法解码图片: {e}")
+    return torch.from_numpy(array)
+
+
+class LabelService:
+    """基于asyncio的本地标签HTTP服务"""
+
+    def __init__(self, clip_vision_model=None, host: str = "127.0.0.1", port: int = 8190,
+                 max_batch_size: int = 8, max_wait_ms: float = 10.0,
+                 language: str = "中文", output_format: str = "标签列表",
+                 threshold: float = 0.7, separator: str = ", "):
+        self.clip_vision_model = clip_vision_model
+        self.host = host
+        self.port = port
+        self.defaults = {
+            "language": language,
+            "output_format": output_format,
+            "threshold": threshold,
+            "separator": separator,
+        }
+        self.batcher = DynamicBatcher(self._process_batch, max_batch_size, max_wait_ms)
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    def _process_batch(self, items: List[Tuple[bytes, Dict]]) -> List[Any]:
+        """
+        在线程池中解码，整个批次一次编码、一次打分，再按各请求的选项逐张生成标签
+
+        解码失败的请求返回 BadRequest，不影响同批次的其他请求。
+        """
+        responses: List[Any] = [None] * len(items)
+        images, valid = [], []
+        for index, (data, _) in enumerate(items):
+            try:
+                images.append(decode_image(data))
+                valid.append(index)
+            except BadRequest as e:
+                responses[index] = e
+        if not valid:
+            return responses
+        embeddings = clip_analyzer.encode_images(self.clip_vision_model, images)
+        # 分数与阈值、语言无关，整批只打分一次，各请求使用同一组数组上的视图
+        batch_analysis = clip_analyzer.analyze(embeddings)
+
+        for row, index in enumerate(valid):
+            options = items[index][1]
+            analysis = batch_analysis.image(row).with_threshold(options["threshold"]).with_language(
+                options["language"])
+            labels, formatted = LabelGenerator.generate_labels(
+                core_variables={},
+                variable_variables={},
+                clip_analysis=analysis,
+                output_format=options["output_format"],
+                language=options["language"],
+                separator=options["separator"],
+            )
+            responses[index] = {
+                "labels": labels,
+                "formatted": formatted,
+                "clip_analysis": analysis.to_dict(),
+                "analysis_text": clip_analyzer.generate_analysis_text(analysis, options["language"]),
+            }
+        return responses
+
+    def _parse_options(self, query: str) -> Dict:
+        params = {key: values[-1] for key, values in parse_qs(query).items()}
+        options = dict(self.defaults)
+        for key in ("language", "output_format", "separator"):
+            if key in params:
+                options[key] = params[key]
+        if "threshold" in params:
+            try:
+                threshold = float(params["threshold"])
+            except ValueError:
+                raise BadRequest(f"threshold 必须是数字: {params['threshold']!r}")
+            if not 0.0 <= threshold <= 1.0:
+                raise BadRequest(f"threshold 必须在0到1之间: {threshold}")
+            options["threshold"] = threshold
+        return options
+
+    async def label_image(self, data: bytes, options: Dict = None) -> Dict:
+        """直接在进程内提交一张图片（不经过HTTP）"""
+        merged = dict(self.defaults)
+        merged.update(options or {})
+        return await self.batcher.submit((data, merged))
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        status, payload = 200, {}
+        try:
+            request_line = (await reader.readline()).decode("latin-1").strip()
+            try:
+                method, target, _ = request_line.split(" ", 2)
+            except ValueError:
+                raise BadRequest(f"无效的请求行: {request_line[:100]!r}")
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode("latin-1").strip()
+                if not line:
+                    break
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+            try:
+                length = int(headers.get("content-length", 0))
+                if length < 0:
+                    raise ValueError(length)
+                body = await reader.readexactly(length)
+            except ValueError:
+                raise BadRequest(f"无效的 Content-Length: {headers.get('content-length')!r}")
+            except asyncio.IncompleteReadError:
+                raise BadRequest("请求体长度小于 Content-Length")
+
+            url = urlsplit(target)
+            if method == "GET" and url.path == "/health":
+                payload = {"status": "ok"}
+            elif method == "GET" and url.path == "/stats":
+                payload = self.batcher.stats()
+            elif method == "POST" and url.path == "/label":
+                if not body:
+                    status, payload = 400, {"error": "请求体为空，请上传图片字节"}
+                else:
+                    # 图片在批处理线程中解码，不阻塞事件循环
+                    payload = await self.batcher.submit((body, self._parse_options(url.query)))
+            else:
+                status, payload = 404, {"error": f"未知接口: {method} {url.path}"}
+        except BadRequest as e:
+            status, payload = 400, {"error": str(e)}
+        except Exception as e:
+            status, payload = 500, {"error": str(e)}
+
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        reason = {200: "OK", 400: "Bad Request", 404: "Not Found"}.get(status, "Internal Server Error")
+        writer.write(
+            f"HTTP/1.1 {status} {reason}\r\n"
+            f"Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n".encode("latin-1") + body
+        )
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def start(self):
+        """启动HTTP服务，返回实际监听端口（port=0时由系统分配）"""
+        self.batcher.start()
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self.port
+
+    async def stop(self):
+        """停止HTTP服务"""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        await self.batcher.stop()
+
+    async def serve_forever(self):
+        await self.start()
+        print(f"✅ 标签服务已启动: http://{self.host}:{self.port}")
+        try:
+            await self._server.serve_forever()
+        finally:
+            await self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ComfyUI Character Labeler 本地标签服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8190)
+    parser.add_argument("--clip-vision", default=None, help="CLIP视觉模型路径（需要ComfyUI环境）")
+    parser.add_argument("--text-encoder", default=None,
+                        help="配套的CLIP文本塔（transformers 模型名或本地目录），未设置时CLIP分数为随机模拟数据")
+    parser.add_argument("--max-batch-size", type=int, default=8)
+    parser.add_argument("--max-wait-ms", type=float, default=10.0)
+    parser.add_argument("--language", default="中文", choices=["中文", "英文"])
+    parser.add_argument("--threshold", type=float, default=0.7)
+    parser.add_argument("--shared-memory", action="store_true",
+                        help="通过共享内存与同主机的其他工作进程共用词表和文本嵌入")
+    parser.add_argument("--max-concurrent-inference", type=int, default=0,
+                        help="同时进行的模型推理数，0 表示按设备自动选择")
+    args = parser.parse_args()
+
+    if args.shared_memory:
+        shared_tables.enable()
+
+    clip_vision_model = None
+    if args.clip_vision:
+        from comfy.clip_vision import load_clipvision
+        clip_vision_model = load_clipvision(args.clip_vision)
+    clip_analyzer.configure_concurrency(args.max_concurrent_inference,
+                                        device=getattr(clip_vision_model, "load_device", None))
+    if args.text_encoder:
+        clip_analyzer.use_transformers_text_encoder(args.text_encoder)
+
+    service = LabelService(
+        clip_vision_model=clip_vision_model,
+        host=args.host,
+        port=args.port,
+        max_batch_size=args.max_batch_size,
+        max_wait_ms=args.max_wait_ms,
+        language=args.language,
+        threshold=args.threshold,
+    )
+    try:
+        asyncio.run(service.serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
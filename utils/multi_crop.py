@@ -0,0 +1,159 @@
+"""
+多区域裁剪分析工具模块
+
+表情、发型等特征在全身图中只占很小的区域，整图打分容易被稀释。
+这里以视图方式从 IMAGE 张量中取出固定的裁剪区域（中心、上三分之一、面部大小的网格），
+把所有图像的所有裁剪合并为一个编码批次，再把各区域的分数路由到它们能提供信息的类别。
+
+合并方式：路由到某特征的各区域分数先取平均，再与整图分数按 full_image_weight 加权混合。
+合并分数总是介于整图分数与局部平均之间，不会像跨区域取最大值那样系统性抬高置信度，
+因此同一阈值在多区域分析与整图分析下含义相近；局部特征明显时分数仍会高于整图。
+"""
+
+from typing import Dict, List, Tuple
+
+import numpy as np
+import torch
+
+from .analysis_result import AnalysisResult
+from .clip_analyzer import clip_analyzer
+
+# 区域 -> 该区域分数参与的类别
+# 构图、视角只看整图：任何局部裁剪看起来都像特写，取局部最大值会得到错误结果
+REGION_ROUTING: Dict[str, Tuple[str, ...]] = {
+    "中心": ("人物", "姿势", "服装"),
+    "上三分之一": ("人物", "表情"),
+    "面部网格": ("人物", "表情"),
+}
+
+
+class MultiCropAnalyzerTool:
+    """多区域裁剪分析工具类"""
+
+    def __init__(self, center_ratio: float = 0.6, grid_size: int = 3, full_image_weight: float = 0.5):
+        """
+        Args:
+            center_ratio: 中心裁剪边长占最短边的比例
+            grid_size: 最短边方向上的网格数，决定面部网格单元的大小
+            full_image_weight: 合并时整图分数的权重，其余权重给局部区域的平均分
+        """
+        self.center_ratio = center_ratio
+        self.grid_size = grid_size
+        self.full_image_weight = full_image_weight
+
+    def crop_views(self, images: torch.Tensor) -> List[Tuple[str, torch.Tensor]]:
+        """
+        生成各区域的裁剪
+
+        中心和上三分之一为原张量的切片视图；面部网格用 unfold 在上半部分按单元大小滑窗，
+        同样是步长视图，只在展平为批次时复制（裁剪分辨率下的小块数据）。
+
+        Args:
+            images: [B, H, W, C]
+
+        Returns:
+            List[Tuple[str, torch.Tensor]]: (区域名, [B*K, h, w, C])，面部网格中每张图像的K个单元连续排列
+        """
+        _, height, width, _ = images.shape
+        short_side = min(height, width)
+
+        side = max(1, int(short_side * self.center_ratio))
+        top, left = (height - side) // 2, (width - side) // 2
+        center = images[:, top:top + side, left:left + side]
+
+        # 上三分之一整行保留，预处理时再居中裁成正方形（人像中通常是头部位置）
+        upper = images[:, :max(1, height // 3)]
+
+        cell = max(1, short_side // self.grid_size)
+        upper_half = images[:, :max(cell, height // 2)]
+        # [B, nh, nw, C, cell, cell] -> [B*nh*nw, cell, cell, C]
+        cells = upper_half.unfold(1, cell, cell).unfold(2, cell, cell)
+        grid = cells.permute(0, 1, 2, 4, 5, 3).flatten(0, 2)
+
+        return [("中心", center), ("上三分之一", upper), ("面部网格", grid)]
+
+    def analyze_regions(self, clip_vision_model, images: torch.Tensor, full_embeddings: torch.Tensor = None,
+                        threshold: float = 0.0, language: str = "中文",
+                        feature_ids: np.ndarray = None) -> Tuple[AnalysisResult, Dict[str, np.ndarray]]:
+        """
+        多区域分析：所有裁剪一次编码，按类别路由后与整图分数加权合并
+
+        Args:
+            clip_vision_model: CLIP视觉模型
+            images: [B, H, W, C]
+            full_embeddings: 整图嵌入 [B, D]，已由编码节点算好时直接复用；为None时与裁剪一起编码
+            feature_ids: 参与打分的词表索引，默认为全部特征
+
+        Returns:
+            Tuple[AnalysisResult, Dict[str, np.ndarray]]: 合并后的分析结果，以及 "全图" 和每个区域的 [B, N] 分数
+                （未路由到该区域的特征列为0）
+        """
+        if images.dim() == 3:
+            images = images.unsqueeze(0)
+        if feature_ids is None:
+            feature_ids = clip_analyzer.all_feature_ids
+        feature_ids = np.asarray(feature_ids, dtype=np.int32)
+        batch_size = images.shape[0]
+
+        crops = self.crop_views(images)
+        if full_embeddings is None:
+            crops.insert(0, ("全图", images))
+
+        # 各区域分别预处理（同一区域的裁剪形状相同），拼接后只做一次编码
+        pixel_values = torch.cat([clip_analyzer.preprocess_images(clip_vision_model, batch) for _, batch in crops])
+        embeddings = clip_analyzer.encode_pixels(clip_vision_model, pixel_values)
+
+        offset = 0
+        region_embeddings = {}
+        for region, batch in crops:
+            region_embeddings[region] = embeddings[offset:offset + batch.shape[0]]
+            offset += batch.shape[0]
+        if full_embeddings is None:
+            full_embeddings = region_embeddings.pop("全图")
+
+        scores = clip_analyzer.score_embeddings(full_embeddings, feature_ids)
+        region_scores = {"全图": scores}
+        local_sum = np.zeros_like(scores)
+        local_count = np.zeros(len(feature_ids), dtype=np.int32)
+        vocab = clip_analyzer.vocabulary
+        for region, categories in REGION_ROUTING.items():
+            columns = np.flatnonzero(np.isin(feature_ids, vocab.ids_for_categories(categories)))
+            if not len(columns):
+                continue
+            block = np.zeros_like(scores)
+            crop_scores = clip_analyzer.score_embeddings(region_embeddings[region], feature_ids[columns])
+            # 同一区域的多个网格单元取最高分（面部只落在其中一个单元里）
+            block[:, columns] = crop_scores.reshape(batch_size, -1, len(columns)).max(axis=1)
+            region_scores[region] = block
+            local_sum[:, columns] += block[:, columns]
+            local_count[columns] += 1
+
+        # 跨区域取平均再与整图加权，避免取最大值抬高置信度
+        merged = scores.copy()
+        routed = local_count > 0
+        weight = self.full_image_weight
+        merged[:, routed] = weight * scores[:, routed] + (1 - weight) * local_sum[:, routed] / local_count[routed]
+        result = AnalysisResult(vocab, merged, feature_ids, threshold=threshold, language=language)
+        return result, region_scores
+
+    @staticmethod
+    def winning_regions(result: AnalysisResult, region_scores: Dict[str, np.ndarray]) -> List[Dict[str, str]]:
+        """
+        每张图像中入选特征在哪个区域得分最高（合并分数为加权平均，这里只用于说明标签的主要来源）
+
+        Returns:
+            List[Dict[str, str]]: 每张图像一个 {特征名: 区域名} 字典
+        """
+        regions = list(region_scores)
+        winners = np.argmax(np.stack([region_scores[r] for r in regions]), axis=0)
+        names = result.vocabulary.names(result.language)
+        column_of = {int(feature_id): column for column, feature_id in enumerate(result.feature_ids)}
+        output = []
+        for i in range(result.batch_size):
+            ids, _ = result.selected(i)
+            output.append({names[f]: regions[winners[i, column_of[int(f)]]] for f in ids})
+        return output
+
+
+# 创建全局实例
+multi_crop_analyzer = MultiCropAnalyzerTool()
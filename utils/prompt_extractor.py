@@ -0,0 +1,371 @@
+"""
+自由文本变量提取工具模块
+
+对所有核心/可变变量选项（中英文）以及 configs/lexicon.json 中的别名构建一个 Aho-Corasick 自动机，
+一次线性扫描即可从 "金色长发的精灵少女在森林里微笑" 这样的自由文本中提取结构化变量，
+用于覆盖或补充选择器的输出，或批量导入旧的标注。自动机按配置版本构建一次并缓存。
+
+别名文件格式：
+
+    {
+      "aliases": {"少女": ["characteristics.gender=女性", "appearance.age_range=少年"]},
+      "suffix_hints": {"appearance.hair_color": ["发", "头发", " hair"]}
+    }
+
+别名对应一组赋值（可变变量写作 "类别.子类别=一级" 或 "类别.子类别=一级/二级"）；
+suffix_hints 为某个变量的全部选项生成 "选项+后缀" 的组合词（如 "金色头发"），用来区分发色和瞳色。
+"""
+
+import json
+import os
+import re
+import threading
+from collections import deque
+from typing import Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+from .label_generator import CORE_EN_MAPPING, VARIABLE_EN_MAPPING
+from .variable_processor import variable_processor
+
+LEXICON_FILE = "lexicon.json"
+MERGE_POLICIES = ("补充", "覆盖")
+
+# 自由文本中以标点分隔的片段
+_SEGMENT = re.compile(r"[^,，、;；。\n]+")
+
+
+class AhoCorasick:
+    """
+    多模式匹配自动机
+
+    goto 表为每个状态一个字典，失败指针按BFS构建，每个状态的输出已合并失败链上的输出，
+    扫描时每个字符只做常数次字典查找。
+    """
+
+    def __init__(self, patterns: Sequence[str]):
+        self.patterns = list(patterns)
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[Tuple[int, ...]] = [()]
+
+        for pattern_id, pattern in enumerate(self.patterns):
+            state = 0
+            for char in pattern:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(())
+                state = next_state
+            self._out[state] = self._out[state] + (pattern_id,)
+
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                candidate = self._goto[fail].get(char, 0)
+                self._fail[next_state] = candidate if candidate != next_state else 0
+                self._out[next_state] = self._out[next_state] + self._out[self._fail[next_state]]
+
+    def __len__(self) -> int:
+        return len(self._goto)
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, int, int]]:
+        """
+        扫描文本
+
+        Yields:
+            Tuple[int, int, int]: (起始位置, 结束位置, 模式索引)
+        """
+        goto, fail, out, patterns = self._goto, self._fail, self._out, self.patterns
+        state = 0
+        for end, char in enumerate(text, 1):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for pattern_id in out[state]:
+                yield end - len(patterns[pattern_id]), end, pattern_id
+
+
+class Assignment(NamedTuple):
+    """一次变量赋值：kind 为 "core" 或 "variable"，可变变量的 value 为一级、level2 为二级"""
+    kind: str
+    category: str
+    name: str
+    value: str
+    level2: str = ""
+
+
+class ExtractionResult(NamedTuple):
+    """
+    提取结果：格式与选择器输出相同的变量字典，匹配到的词，未产生赋值的片段，
+    以及每个片段（按标点分隔）与从中得到的赋值
+    """
+    core_variables: Dict[str, Dict]
+    variable_variables: Dict[str, Dict]
+    matches: List[Tuple[str, Assignment]]
+    remainder: List[str]
+    segments: List[Tuple[str, List[Assignment]]]
+
+
+def _is_word_char(char: str) -> bool:
+    return char.isascii() and char.isalnum()
+
+
+class PromptExtractor:
+    """自由文本变量提取器"""
+
+    def __init__(self, config_dir: str = None):
+        if config_dir is None:
+            config_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "configs")
+        self.lexicon_path = os.path.join(config_dir, LEXICON_FILE)
+        self._lock = threading.Lock()
+        self._key: Optional[Tuple] = None
+        # (自动机, 每个模式的候选)，整体替换。候选之间互斥（同一个词可能属于多个变量），候选内的赋值全部生效
+        self._compiled: Optional[Tuple[AhoCorasick, List[List[Tuple[Assignment, ...]]]]] = None
+
+    def _lexicon_stamp(self) -> Optional[Tuple]:
+        try:
+            stat = os.stat(self.lexicon_path)
+            return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            return None
+
+    def load_lexicon(self) -> Dict:
+        """读取别名文件，文件不存在时返回空配置"""
+        if self._lexicon_stamp() is None:
+            return {}
+        try:
+            with open(self.lexicon_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"❌ 加载别名文件 {LEXICON_FILE} 失败: {e}")
+            return {}
+
+    def automaton(self) -> AhoCorasick:
+        """获取当前配置版本的自动机，配置或别名文件变化时重新构建"""
+        return self._compile()[0]
+
+    def _compile(self) -> Tuple[AhoCorasick, List[List[Tuple[Assignment, ...]]]]:
+        """检查配置与别名文件（三次 stat），返回当前版本的自动机与候选"""
+        key = (variable_processor.config_version, self._lexicon_stamp())
+        compiled = self._compiled
+        if self._key == key and compiled is not None:
+            return compiled
+        with self._lock:
+            if self._key != key or self._compiled is None:
+                self._build(key)
+            return self._compiled
+
+    def _build(self, key: Tuple):
+        snapshot = variable_processor.get_snapshot()
+        lexicon = self.load_lexicon()
+        candidates: Dict[str, List[Tuple[Assignment, ...]]] = {}
+
+        def add(pattern: str, assignments: Tuple[Assignment, ...]):
+            pattern = pattern.strip().lower() if pattern.isascii() else pattern.lower()
+            if pattern and assignments not in candidates.setdefault(pattern, []):
+                candidates[pattern].append(assignments)
+
+        # 1. 别名（优先级最高）
+        variable_keys = {
+            f"{category}.{name}" for category, subs in snapshot.variable_variables.items() for name in subs
+        }
+        for alias, targets in lexicon.get("aliases", {}).items():
+            assignments = []
+            for target in targets:
+                path, _, value = target.partition("=")
+                category, _, name = path.partition(".")
+                if path in variable_keys:
+                    level1, _, level2 = value.partition("/")
+                    assignments.append(Assignment("variable", category, name, level1, level2))
+                else:
+                    assignments.append(Assignment("core", category, name, value))
+            add(alias, tuple(assignments))
+
+        # 2. 核心变量选项（中文、英文、后缀组合词）
+        hints = lexicon.get("suffix_hints", {})
+        for category, variables in snapshot.core_variables.items():
+            for name, options in variables.items():
+                if not isinstance(options, list):
+                    continue
+                for option in options:
+                    assignment = (Assignment("core", category, name, option),)
+                    english = CORE_EN_MAPPING.get(option)
+                    for hint in hints.get(f"{category}.{name}", []):
+                        if hint.isascii():
+                            if english:
+                                add(f"{english}{hint}", assignment)
+                        else:
+                            add(f"{option}{hint}", assignment)
+                    add(option, assignment)
+                    if english:
+                        add(english, assignment)
+
+        # 3. 可变变量的一级、二级选项
+        for category, subcategories in snapshot.variable_variables.items():
+            for name, levels in subcategories.items():
+                if not isinstance(levels, dict):
+                    continue
+                for level1 in levels.get("一级", []):
+                    assignment = (Assignment("variable", category, name, level1),)
+                    add(level1, assignment)
+                    if level1 in VARIABLE_EN_MAPPING:
+                        add(VARIABLE_EN_MAPPING[level1], assignment)
+                level2_map = levels.get("二级", {})
+                if isinstance(level2_map, dict):
+                    for level1, level2_options in level2_map.items():
+                        for level2 in level2_options:
+                            add(level2, (Assignment("variable", category, name, level1, level2),))
+
+        patterns = list(candidates)
+        automaton = AhoCorasick(patterns)
+        self._compiled = (automaton, [candidates[pattern] for pattern in patterns])
+        self._key = key
+        print(f"🔧 已构建提示词匹配自动机: {len(patterns)} 个模式, {len(automaton)} 个状态")
+
+    @staticmethod
+    def _select_matches(automaton: AhoCorasick, text: str) -> List[Tuple[int, int, int]]:
+        """最左最长、互不重叠地选择匹配，英文模式要求词边界"""
+        lowered = text.lower()
+        spans = []
+        for start, end, pattern_id in automaton.iter_matches(lowered):
+            pattern = automaton.patterns[pattern_id]
+            if pattern[0].isascii() and start > 0 and _is_word_char(lowered[start - 1]) and _is_word_char(pattern[0]):
+                continue
+            if pattern[-1].isascii() and end < len(lowered) and _is_word_char(lowered[end]) and _is_word_char(pattern[-1]):
+                continue
+            spans.append((start, end, pattern_id))
+        spans.sort(key=lambda span: (span[0], -(span[1] - span[0])))
+
+        selected, covered_until = [], 0
+        for start, end, pattern_id in spans:
+            if start >= covered_until:
+                selected.append((start, end, pattern_id))
+                covered_until = end
+        return selected
+
+    def extract(self, text: str) -> ExtractionResult:
+        """
+        从自由文本中提取变量
+
+        同一个词属于多个变量时（如 "金色" 既是发色也是瞳色），按配置顺序赋给第一个尚未赋值的变量；
+        已有一级取值时，匹配到其下的二级选项会补充二级。
+
+        Returns:
+            ExtractionResult
+        """
+        if not text or not text.strip():
+            return ExtractionResult({}, {}, [], [], [])
+        return self._extract(text, *self._compile())
+
+    def _extract(self, text: str, automaton: AhoCorasick,
+                 candidates: List[List[Tuple[Assignment, ...]]]) -> ExtractionResult:
+        core: Dict[str, Dict] = {}
+        variable: Dict[str, Dict] = {}
+        matches: List[Tuple[str, Assignment]] = []
+        if not text or not text.strip():
+            return ExtractionResult(core, variable, matches, [], [])
+
+        assigned_spans: List[Tuple[int, int, Tuple[Assignment, ...]]] = []
+        for start, end, pattern_id in self._select_matches(automaton, text):
+            for assignments in candidates[pattern_id]:
+                if not all(self._can_assign(core, variable, a) for a in assignments):
+                    continue
+                for assignment in assignments:
+                    self._assign(core, variable, assignment)
+                    matches.append((text[start:end], assignment))
+                assigned_spans.append((start, end, assignments))
+                break
+
+        # 按标点分段，记录每段得到的赋值；没有产生赋值的片段原样保留为自由标签
+        segments, remainder = [], []
+        for segment in _SEGMENT.finditer(text):
+            if not segment.group().strip():
+                continue
+            segment_assignments = [
+                assignment for s, e, assignments in assigned_spans
+                if s < segment.end() and e > segment.start() for assignment in assignments
+            ]
+            segments.append((segment.group().strip(), segment_assignments))
+            if not segment_assignments:
+                remainder.append(segment.group().strip())
+
+        return ExtractionResult(core, variable, matches, remainder, segments)
+
+    @staticmethod
+    def _can_assign(core: Dict, variable: Dict, assignment: Assignment) -> bool:
+        if assignment.kind == "core":
+            return assignment.name not in core.get(assignment.category, {})
+        current = variable.get(assignment.category, {}).get(assignment.name)
+        if current is None:
+            return True
+        # 已选中一级：只允许补充同一一级下的二级
+        return bool(assignment.level2) and not current["二级"] and current["一级"] == assignment.value
+
+    @staticmethod
+    def _assign(core: Dict, variable: Dict, assignment: Assignment):
+        if assignment.kind == "core":
+            core.setdefault(assignment.category, {})[assignment.name] = assignment.value
+        else:
+            variable.setdefault(assignment.category, {})[assignment.name] = {
+                "一级": assignment.value, "二级": assignment.level2
+            }
+
+    def apply(self, core_variables: Dict, variable_variables: Dict, text: str,
+              policy: str = "补充") -> Tuple[Dict, Dict, str]:
+        """
+        把从文本中提取的变量合并到选择器输出
+
+        只有全部赋值都实际写入变量的片段才从自由文本中移除；"补充" 模式下选择器已提供取值、
+        因而没有生效的匹配，其所在片段仍作为附加标签保留。
+
+        Args:
+            policy: "补充"（只填写选择器未提供或为空的变量）或 "覆盖"（提取结果优先）
+
+        Returns:
+            Tuple[Dict, Dict, str]: 合并后的核心变量、可变变量，以及剩余的自由文本（逗号分隔）
+        """
+        extracted = self.extract(text)
+        override = policy == "覆盖"
+        # 实际写入的变量：("core"/"variable", 类别, 名称)
+        applied = set()
+
+        core = {category: dict(values) for category, values in (core_variables or {}).items()}
+        for category, values in extracted.core_variables.items():
+            target = core.setdefault(category, {})
+            for name, value in values.items():
+                if override or not target.get(name):
+                    target[name] = value
+                    applied.add(("core", category, name))
+
+        variable = {
+            category: {name: dict(levels) for name, levels in subs.items()}
+            for category, subs in (variable_variables or {}).items()
+        }
+        for category, subs in extracted.variable_variables.items():
+            target = variable.setdefault(category, {})
+            for name, levels in subs.items():
+                if override or not target.get(name, {}).get("一级"):
+                    target[name] = dict(levels)
+                    applied.add(("variable", category, name))
+
+        remainder = [
+            segment for segment, assignments in extracted.segments
+            if not assignments or not all((a.kind, a.category, a.name) in applied for a in assignments)
+        ]
+        return core, variable, ", ".join(remainder)
+
+    def extract_batch(self, texts: Sequence[str]) -> List[ExtractionResult]:
+        """批量导入旧标注：配置只检查一次，每条文本只扫描一次"""
+        automaton, candidates = self._compile()
+        return [self._extract(text, automaton, candidates) for text in texts]
+
+
+# 创建全局实例
+prompt_extractor = PromptExtractor()
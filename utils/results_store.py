@@ -0,0 +1,403 @@
+"""
+标注结果存储工具模块
+
+把每张图像的变量选择、CLIP分数和生成的标签写入本地 SQLite 数据库（WAL 模式），
+以图像哈希为主键，之后无需重新运行即可查询，例如 "夜晚 + 城市 且置信度 > 0.8 的图像"。
+
+    images      每张图像一行：标签、格式化输出、完整的CLIP分数向量（BLOB）
+    tags        标签名称 + 类别（核心/可变变量为 "类别.变量"，CLIP特征为其类别），只存一次
+    image_tags  (image_id, tag_id, source, confidence)，按图像聚簇，另按 (标签, 置信度) 建索引
+
+写入按批在一个事务中完成；WAL 模式下读取不阻塞写入，多个写入进程只在提交批次时短暂串行。
+"""
+
+import argparse
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .analysis_result import AnalysisResult, FeatureVocabulary
+
+RESULTS_SCHEMA_VERSION = 1
+
+# image_tags.source
+SOURCE_CORE = 0
+SOURCE_VARIABLE = 1
+SOURCE_CLIP = 2
+SOURCE_NAMES = {"核心变量": SOURCE_CORE, "可变变量": SOURCE_VARIABLE, "CLIP": SOURCE_CLIP}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    image_id INTEGER PRIMARY KEY,
+    labels TEXT NOT NULL,
+    formatted TEXT,
+    language TEXT,
+    vocabulary_id INTEGER,
+    feature_ids BLOB,
+    scores BLOB,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tags (
+    tag_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    category TEXT NOT NULL,
+    UNIQUE (name, category)
+);
+CREATE INDEX IF NOT EXISTS tags_category ON tags (category);
+CREATE TABLE IF NOT EXISTS image_tags (
+    tag_id INTEGER NOT NULL,
+    image_id INTEGER NOT NULL,
+    source INTEGER NOT NULL,
+    confidence REAL NOT NULL,
+    PRIMARY KEY (image_id, tag_id, source)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS image_tags_confidence ON image_tags (tag_id, confidence, image_id);
+CREATE TABLE IF NOT EXISTS vocabularies (
+    vocabulary_id INTEGER PRIMARY KEY,
+    names TEXT NOT NULL UNIQUE
+);
+"""
+
+
+def _to_sql_key(image_hash: int) -> int:
+    """64位无符号图像哈希转换为 SQLite 的有符号整数"""
+    image_hash = int(image_hash)
+    return image_hash - (1 << 64) if image_hash >= 1 << 63 else image_hash
+
+
+def _from_sql_key(image_id: int) -> int:
+    return image_id + (1 << 64) if image_id < 0 else image_id
+
+
+class LabelRecord(NamedTuple):
+    """一张图像的标注结果"""
+    image_hash: int
+    labels: str
+    formatted: str = ""
+    language: str = "中文"
+    core_variables: Optional[Dict] = None
+    variable_variables: Optional[Dict] = None
+    # 原始分数视图（AnalysisResult），image_index 为该图像在批次中的位置
+    clip_scores: Optional[AnalysisResult] = None
+    image_index: int = 0
+
+
+def records_from_batch(image_hashes: Sequence[int], labels: Sequence[str], clip_scores: AnalysisResult = None,
+                       core_variables: Dict = None, variable_variables: Dict = None,
+                       language: str = "中文") -> List[LabelRecord]:
+    """
+    由一个批次构建记录
+
+    Args:
+        labels: 与图像一一对应的标签；只有一条时用于整个批次
+    """
+    if len(labels) == 1:
+        labels = list(labels) * len(image_hashes)
+    if len(labels) != len(image_hashes):
+        raise ValueError(f"标签数({len(labels)})与图像数({len(image_hashes)})不一致")
+    return [
+        LabelRecord(int(image_hash), label, label, language, core_variables, variable_variables, clip_scores, i)
+        for i, (image_hash, label) in enumerate(zip(image_hashes, labels))
+    ]
+
+
+class ResultsStore:
+    """SQLite 标注结果存储"""
+
+    def __init__(self, path: str, index_floor: float = 0.5, busy_timeout: float = 30.0, cache_mb: int = 64):
+        """
+        Args:
+            path: 数据库文件路径
+            index_floor: CLIP分数不低于该值的特征才写入倒排表（完整分数向量总是保存在 images 表中）
+            busy_timeout: 等待其他写入者提交的最长秒数
+            cache_mb: 每个连接的页缓存大小，随机位置的索引插入主要受它影响
+        """
+        self.path = path
+        self.index_floor = index_floor
+        self.busy_timeout = busy_timeout
+        self.cache_mb = cache_mb
+        self._local = threading.local()
+        self._tag_ids: Dict[Tuple[str, str], int] = {}
+        self._vocabulary_ids: Dict[Tuple[str, ...], int] = {}
+        self._cache_lock = threading.Lock()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        connection = self.connection()
+        connection.executescript(_SCHEMA)
+        connection.execute(f"PRAGMA user_version = {RESULTS_SCHEMA_VERSION}")
+
+    def connection(self) -> sqlite3.Connection:
+        """当前线程的连接（sqlite3 连接不能跨线程共享）"""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+            connection.execute("PRAGMA journal_mode = WAL")
+            # WAL 模式下 NORMAL 仍保证数据库一致，只在断电时可能丢失最后的事务
+            connection.execute("PRAGMA synchronous = NORMAL")
+            connection.execute("PRAGMA temp_store = MEMORY")
+            connection.execute(f"PRAGMA cache_size = -{self.cache_mb * 1024}")
+            self._local.connection = connection
+        return connection
+
+    def close(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    # ---- 写入 ----
+
+    def _tag_id(self, cursor: sqlite3.Cursor, name: str, category: str, pending: Dict) -> int:
+        key = (name, category)
+        tag_id = self._tag_ids.get(key) or pending.get(key)
+        if tag_id is None:
+            # 新标签直接取 lastrowid；只有已被其他写入者创建（插入被忽略）时才查询
+            cursor.execute("INSERT OR IGNORE INTO tags (name, category) VALUES (?, ?)", key)
+            if cursor.rowcount == 1:
+                tag_id = cursor.lastrowid
+            else:
+                tag_id = cursor.execute("SELECT tag_id FROM tags WHERE name = ? AND category = ?", key).fetchone()[0]
+            pending[key] = tag_id
+        return tag_id
+
+    def _vocabulary_id(self, cursor: sqlite3.Cursor, vocabulary: FeatureVocabulary, pending: Dict) -> int:
+        key = vocabulary.names_cn
+        vocabulary_id = self._vocabulary_ids.get(key) or pending.get(key)
+        if vocabulary_id is None:
+            names = "\n".join(key)
+            cursor.execute("INSERT OR IGNORE INTO vocabularies (names) VALUES (?)", (names,))
+            if cursor.rowcount == 1:
+                vocabulary_id = cursor.lastrowid
+            else:
+                vocabulary_id = cursor.execute(
+                    "SELECT vocabulary_id FROM vocabularies WHERE names = ?", (names,)).fetchone()[0]
+            pending[key] = vocabulary_id
+        return vocabulary_id
+
+    def _tag_rows(self, cursor: sqlite3.Cursor, record: LabelRecord, image_id: int, pending: Dict) -> List[Tuple]:
+        rows = []
+        for category, variables in (record.core_variables or {}).items():
+            for var_name, value in variables.items():
+                if value:
+                    rows.append((self._tag_id(cursor, value, f"{category}.{var_name}", pending),
+                                 image_id, SOURCE_CORE, 1.0))
+        for category, subcategories in (record.variable_variables or {}).items():
+            for sub_name, levels in subcategories.items():
+                for level in ("一级", "二级"):
+                    value = levels.get(level, "") if isinstance(levels, dict) else ""
+                    if value:
+                        rows.append((self._tag_id(cursor, value, f"{category}.{sub_name}", pending),
+                                     image_id, SOURCE_VARIABLE, 1.0))
+        scores = record.clip_scores
+        if scores is not None:
+            row = scores.scores[record.image_index]
+            vocab = scores.vocabulary
+            for column in np.flatnonzero(row >= self.index_floor).tolist():
+                feature = int(scores.feature_ids[column])
+                category = vocab.categories[vocab.category_ids[feature]]
+                rows.append((self._tag_id(cursor, vocab.names_cn[feature], category, pending),
+                             image_id, SOURCE_CLIP, float(row[column])))
+        return rows
+
+    def add(self, records: Iterable[LabelRecord]) -> int:
+        """
+        在一个事务中写入一批记录，已存在的图像会被覆盖
+
+        Returns:
+            int: 写入的记录数
+        """
+        records = list(records)
+        if not records:
+            return 0
+        connection = self.connection()
+        cursor = connection.cursor()
+        now = time.time()
+        # IMMEDIATE：开始时即取得写锁，避免读事务升级为写事务时死锁
+        cursor.execute("BEGIN IMMEDIATE")
+        # 本事务中新建的标签/词表ID，提交成功后才放入缓存
+        new_tags, new_vocabularies = {}, {}
+        try:
+            image_rows, tag_rows = [], []
+            for record in records:
+                image_id = _to_sql_key(record.image_hash)
+                feature_ids = scores = vocabulary_id = None
+                if record.clip_scores is not None:
+                    vocabulary_id = self._vocabulary_id(cursor, record.clip_scores.vocabulary, new_vocabularies)
+                    feature_ids = record.clip_scores.feature_ids.astype(np.int32).tobytes()
+                    scores = record.clip_scores.scores[record.image_index].astype(np.float32).tobytes()
+                image_rows.append((image_id, record.labels, record.formatted, record.language,
+                                   vocabulary_id, feature_ids, scores, now))
+                tag_rows.extend(self._tag_rows(cursor, record, image_id, new_tags))
+
+            cursor.executemany("DELETE FROM image_tags WHERE image_id = ?", [(row[0],) for row in image_rows])
+            cursor.executemany("INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?, ?, ?)", image_rows)
+            cursor.executemany("INSERT OR REPLACE INTO image_tags VALUES (?, ?, ?, ?)", tag_rows)
+            cursor.execute("COMMIT")
+        except BaseException:
+            cursor.execute("ROLLBACK")
+            raise
+        with self._cache_lock:
+            self._tag_ids.update(new_tags)
+            self._vocabulary_ids.update(new_vocabularies)
+        return len(records)
+
+    def writer(self, batch_size: int = 1000) -> "BatchWriter":
+        """批量写入器：缓冲记录，每 batch_size 条提交一个事务"""
+        return BatchWriter(self, batch_size)
+
+    # ---- 查询 ----
+
+    def find(self, tags: Sequence[str], min_confidence: float = 0.0, source: Optional[int] = None,
+             category: Optional[str] = None, limit: Optional[int] = None) -> List[int]:
+        """
+        查找同时带有全部标签的图像
+
+        每个标签在 (tag_id, confidence) 索引上做一次范围扫描，结果取交集。
+
+        Args:
+            tags: 标签名称（中文），例如 ["夜晚", "城市"]
+            min_confidence: 置信度下限；核心/可变变量的选择置信度记为1
+            source: 只匹配某一来源（SOURCE_CORE/SOURCE_VARIABLE/SOURCE_CLIP）
+            category: 只匹配某一类别下的标签
+
+        Returns:
+            List[int]: 图像哈希
+        """
+        if not tags:
+            return []
+        clauses, params = [], []
+        for tag in tags:
+            # DISTINCT：同一图像可能从多个来源带有同一标签，只有一个标签时没有 INTERSECT 去重
+            sql = ("SELECT DISTINCT image_id FROM image_tags WHERE tag_id IN "
+                   "(SELECT tag_id FROM tags WHERE name = ?" + (" AND category = ?" if category else "") + ")"
+                   " AND confidence >= ?")
+            params.extend([tag, category] if category else [tag])
+            params.append(min_confidence)
+            if source is not None:
+                sql += " AND source = ?"
+                params.append(source)
+            clauses.append(sql)
+        query = " INTERSECT ".join(clauses)
+        if limit is not None:
+            query += f" LIMIT {int(limit)}"
+        return [_from_sql_key(row[0]) for row in self.connection().execute(query, params)]
+
+    def category_counts(self, category: str, min_confidence: float = 0.0) -> Dict[str, int]:
+        """某个类别下各标签的图像数"""
+        rows = self.connection().execute(
+            "SELECT tags.name, COUNT(DISTINCT image_tags.image_id) FROM tags "
+            "JOIN image_tags ON image_tags.tag_id = tags.tag_id "
+            "WHERE tags.category = ? AND image_tags.confidence >= ? "
+            "GROUP BY tags.tag_id ORDER BY 2 DESC", (category, min_confidence))
+        return dict(rows.fetchall())
+
+    def get(self, image_hash: int) -> Optional[Dict]:
+        """读取一张图像的记录，CLIP分数还原为 {特征名: 置信度}，缺少词表时键为特征下标"""
+        connection = self.connection()
+        row = connection.execute(
+            "SELECT labels, formatted, language, vocabulary_id, feature_ids, scores, updated_at "
+            "FROM images WHERE image_id = ?", (_to_sql_key(image_hash),)).fetchone()
+        if row is None:
+            return None
+        labels, formatted, language, vocabulary_id, feature_ids, scores, updated_at = row
+        clip_scores = {}
+        if scores is not None and feature_ids is not None:
+            names = None
+            if vocabulary_id is not None:
+                names_row = connection.execute(
+                    "SELECT names FROM vocabularies WHERE vocabulary_id = ?", (vocabulary_id,)).fetchone()
+                names = names_row[0].split("\n") if names_row is not None else None
+            ids = np.frombuffer(feature_ids, dtype=np.int32).tolist()
+            values = np.frombuffer(scores, dtype=np.float32).tolist()
+            # 没有对应词表（或特征下标超出词表）时以特征下标为键
+            clip_scores = {names[i] if names is not None and 0 <= i < len(names) else i: value
+                           for i, value in zip(ids, values)}
+        tags = connection.execute(
+            "SELECT tags.name, tags.category, image_tags.source, image_tags.confidence FROM image_tags "
+            "JOIN tags ON tags.tag_id = image_tags.tag_id WHERE image_tags.image_id = ?",
+            (_to_sql_key(image_hash),)).fetchall()
+        return {
+            "labels": labels,
+            "formatted": formatted,
+            "language": language,
+            "clip_scores": clip_scores,
+            "tags": [{"name": n, "category": c, "source": s, "confidence": v} for n, c, s, v in tags],
+            "updated_at": updated_at,
+        }
+
+    def __len__(self) -> int:
+        return self.connection().execute("SELECT COUNT(*) FROM images").fetchone()[0]
+
+
+class BatchWriter:
+    """缓冲写入：攒够一批再提交，退出 with 块时提交剩余记录"""
+
+    def __init__(self, store: ResultsStore, batch_size: int = 1000):
+        self.store = store
+        self.batch_size = max(1, batch_size)
+        self._buffer: List[LabelRecord] = []
+        self.written = 0
+
+    def add(self, record: LabelRecord):
+        self._buffer.append(record)
+        if len(self._buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            self.written += self.store.add(self._buffer)
+            self._buffer = []
+
+    def __enter__(self) -> "BatchWriter":
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.flush()
+
+
+_open_stores: Dict[str, ResultsStore] = {}
+_open_stores_lock = threading.Lock()
+
+
+def get_results_store(path: str) -> ResultsStore:
+    """获取（并缓存）某路径对应的结果存储"""
+    path = os.path.abspath(os.path.expanduser(path))
+    with _open_stores_lock:
+        store = _open_stores.get(path)
+        if store is None:
+            store = ResultsStore(path)
+            _open_stores[path] = store
+        return store
+
+
+def main():
+    parser = argparse.ArgumentParser(description="查询标注结果数据库")
+    parser.add_argument("database")
+    parser.add_argument("--tags", default="", help="逗号分隔的标签，需同时满足，例如 夜晚,城市")
+    parser.add_argument("--min-confidence", type=float, default=0.0)
+    parser.add_argument("--source", default=None, choices=list(SOURCE_NAMES))
+    parser.add_argument("--category", default=None)
+    parser.add_argument("--limit", type=int, default=100)
+    args = parser.parse_args()
+
+    store = ResultsStore(args.database)
+    if args.tags:
+        tags = [tag.strip() for tag in args.tags.replace("，", ",").split(",") if tag.strip()]
+        source = SOURCE_NAMES[args.source] if args.source else None
+        for image_hash in store.find(tags, args.min_confidence, source, args.category, args.limit):
+            print(f"{image_hash:016x}")
+    elif args.category:
+        for name, count in store.category_counts(args.category, args.min_confidence).items():
+            print(f"{name}\t{count}")
+    else:
+        print(f"图像数: {len(store)}")
+
+
+if __name__ == "__main__":
+    main()
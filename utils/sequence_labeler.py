@@ -0,0 +1,121 @@
+"""
+帧序列标签工具模块
+
+视频帧作为IMAGE批次输入时，相邻帧几乎相同。这里先用低成本的签名（缩略图或差异哈希）
+找出关键帧，只对关键帧做完整的CLIP分析，再把分数在关键帧之间插值传播并做时间平滑，
+得到逐帧标签。
+"""
+
+from typing import List, Tuple
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from .analysis_result import AnalysisResult
+from .clip_analyzer import clip_analyzer
+
+SIGNATURE_METHODS = ("缩略图", "差异哈希")
+
+
+class SequenceLabelerTool:
+    """帧序列标签工具类"""
+
+    def __init__(self, thumbnail_size: int = 16, hash_size: int = 8):
+        self.thumbnail_size = thumbnail_size
+        self.hash_size = hash_size
+
+    def frame_signatures(self, frames: torch.Tensor, method: str = "缩略图") -> np.ndarray:
+        """
+        计算每帧的低成本签名（整批一次插值）
+
+        Args:
+            frames: [B, H, W, C] 帧序列
+            method: "缩略图"（灰度缩略图）或 "差异哈希"（dHash位向量）
+
+        Returns:
+            np.ndarray: [B, K] 签名
+        """
+        gray = frames[..., :3].float().mean(dim=-1, keepdim=True).permute(0, 3, 1, 2)
+        if method == "差异哈希":
+            small = F.interpolate(gray, size=(self.hash_size, self.hash_size + 1), mode="area")
+            bits = small[..., 1:] > small[..., :-1]
+            return bits.flatten(1).cpu().numpy()
+        small = F.interpolate(gray, size=(self.thumbnail_size, self.thumbnail_size), mode="area")
+        return small.flatten(1).cpu().numpy().astype(np.float32)
+
+    @staticmethod
+    def select_keyframes(signatures: np.ndarray, change_threshold: float) -> List[int]:
+        """
+        选择关键帧：与上一关键帧的差异超过阈值的帧
+
+        缩略图签名的差异为平均绝对差，差异哈希为不同位所占比例，两者都在 0~1 之间。
+        第一帧始终是关键帧。
+        """
+        keyframes = [0]
+        reference = signatures[0]
+        for index in range(1, len(signatures)):
+            if signatures.dtype == bool:
+                change = np.count_nonzero(signatures[index] != reference) / signatures.shape[1]
+            else:
+                change = float(np.abs(signatures[index] - reference).mean())
+            if change > change_threshold:
+                keyframes.append(index)
+                reference = signatures[index]
+        return keyframes
+
+    @staticmethod
+    def propagate_scores(keyframes: List[int], key_scores: np.ndarray, num_frames: int,
+                         smoothing_window: int = 1) -> np.ndarray:
+        """
+        把关键帧分数传播到所有帧
+
+        关键帧之间按位置线性插值，最后一个关键帧之后沿用其分数；
+        smoothing_window > 1 时再做居中的滑动平均。
+
+        Returns:
+            np.ndarray: [num_frames, N]
+        """
+        positions = np.arange(num_frames)
+        keys = np.asarray(keyframes)
+        if len(keys) == 1:
+            scores = np.repeat(key_scores[:1], num_frames, axis=0)
+        else:
+            # 每帧两侧的关键帧（最后一个关键帧之后权重为1，即沿用其分数）
+            right = np.clip(np.searchsorted(keys, positions, side="right"), 1, len(keys) - 1)
+            left = right - 1
+            span = (keys[right] - keys[left]).astype(np.float32)
+            weight = np.clip((positions - keys[left]) / span, 0.0, 1.0)[:, None]
+            scores = (1.0 - weight) * key_scores[left] + weight * key_scores[right]
+
+        if smoothing_window > 1 and num_frames > 1:
+            pad = smoothing_window // 2
+            padded = np.pad(scores, ((pad, smoothing_window - 1 - pad), (0, 0)), mode="edge")
+            cumulative = np.cumsum(np.vstack([np.zeros((1, scores.shape[1]), dtype=padded.dtype), padded]), axis=0)
+            scores = (cumulative[smoothing_window:] - cumulative[:-smoothing_window]) / smoothing_window
+        return scores.astype(np.float32)
+
+    def label_sequence(self, clip_vision_model, frames: torch.Tensor, change_threshold: float = 0.05,
+                       method: str = "缩略图", threshold: float = 0.7, language: str = "中文",
+                       feature_ids: np.ndarray = None, smoothing_window: int = 3) -> Tuple[AnalysisResult, List[int]]:
+        """
+        逐帧标签：只对关键帧做完整分析
+
+        Returns:
+            Tuple[AnalysisResult, List[int]]: 覆盖所有帧的分析结果，以及关键帧索引
+        """
+        if frames.dim() == 3:
+            frames = frames.unsqueeze(0)
+        if feature_ids is None:
+            feature_ids = clip_analyzer.quick_feature_ids
+
+        keyframes = self.select_keyframes(self.frame_signatures(frames, method), change_threshold)
+        embeddings = clip_analyzer.encode_images(clip_vision_model, frames[keyframes])
+        key_scores = clip_analyzer.score_embeddings(embeddings, feature_ids)
+        scores = self.propagate_scores(keyframes, key_scores, frames.shape[0], smoothing_window)
+        result = AnalysisResult(clip_analyzer.vocabulary, scores, feature_ids, threshold=threshold, language=language)
+        return result, keyframes
+
+
+# 创建全局实例
+sequence_labeler = SequenceLabelerTool()
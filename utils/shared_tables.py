@@ -0,0 +1,348 @@
+"""
+共享内存词表与文本嵌入工具模块
+
+同一主机上运行多个工作进程时，第一个进程把词表和文本嵌入矩阵发布到
+multiprocessing.shared_memory 段中，其余进程按名称附加，得到只读、零拷贝的 NumPy 视图，
+每个进程不再各自保存一份。段名由表内容的键（提示词 + 文本编码器）决定，
+配置变化后键随之变化，发布者会释放旧段。
+
+段布局（小端）：
+
+    0   magic "CLTB"        4s
+    4   布局版本              uint16
+    6   状态 0=写入中 1=就绪   uint16
+    8   行数 N               uint32
+    12  维度 D               uint32
+    16  嵌入偏移              uint64    float32 [N, D]
+    24  类别索引偏移           uint64    int16 [N]
+    32  词表JSON偏移          uint64
+    40  词表JSON长度          uint64
+    48  表键                  32s
+    80  发布者的 resource_tracker 管道 (st_dev, st_ino)   2×uint64
+"""
+
+import atexit
+import ctypes
+import json
+import os
+import struct
+import sys
+import threading
+import time
+from multiprocessing import shared_memory
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from .analysis_result import FeatureVocabulary
+
+TABLE_MAGIC = b"CLTB"
+TABLE_LAYOUT_VERSION = 2
+SEGMENT_PREFIX = "clabel_"
+
+_HEADER = struct.Struct("<4sHHIIQQQQ32sQQ")
+_HEADER_SIZE = 128
+_STATE_OFFSET = 6
+_ALIGN = 64
+
+# 设置该环境变量为1时默认启用共享内存
+SHARED_TABLES_ENV = "CHARACTER_LABELER_SHARED_TABLES"
+
+
+def segment_name(key: str) -> str:
+    """表键对应的共享内存段名（POSIX 段名长度有限，只取前24位）"""
+    return SEGMENT_PREFIX + key[:24]
+
+
+def _align(offset: int) -> int:
+    return (offset + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+# Python 3.13 起可以按名称附加而不注册到 resource_tracker
+_ATTACH_TRACKS = sys.version_info < (3, 13)
+
+
+class _Segment(shared_memory.SharedMemory):
+    """共享内存段；detach 之后不再关闭映射，映射在进程退出时由系统解除"""
+
+    detached = False
+
+    def close(self):
+        if not self.detached:
+            super().close()
+
+
+def _tracker_identity() -> tuple:
+    """
+    当前进程使用的 resource_tracker 的标识（其管道的 st_dev、st_ino）
+
+    由 multiprocessing 启动的子进程继承父进程的 resource_tracker，得到相同的标识；
+    独立启动的进程各有一个。Windows 不使用 resource_tracker，返回 (0, 0)。
+    """
+    if os.name != "posix":
+        return (0, 0)
+    try:
+        from multiprocessing import resource_tracker
+        info = os.fstat(resource_tracker.getfd())
+        return (info.st_dev, info.st_ino)
+    except Exception:
+        return (0, 0)
+
+
+def _attach_segment(name: str) -> _Segment:
+    """
+    按名称附加段，附加方不参与段的生命周期管理
+
+    Python 3.13 之前，按名称附加的段也会注册到 resource_tracker，进程退出时 resource_tracker 会删除它，
+    导致发布者的段被误删，因此附加后要取消注册。但与发布者共用同一个 resource_tracker 时
+    （例如由 multiprocessing 启动的子进程），注册只是重复，取消注册会删掉发布者自己的登记，
+    发布者释放段时 resource_tracker 报 KeyError，这种情况下不取消注册。
+    """
+    if not _ATTACH_TRACKS:
+        return _Segment(name=name, track=False)
+    shm = _Segment(name=name)
+    header = shm.buf[:_HEADER.size]
+    try:
+        publisher_tracker = _HEADER.unpack(header)[-2:] if len(header) == _HEADER.size else (0, 0)
+    finally:
+        header.release()
+    if os.name == "posix" and tuple(publisher_tracker) != _tracker_identity():
+        try:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister("/" + shm.name, "shared_memory")
+        except Exception:
+            pass
+    return shm
+
+
+class SharedTables:
+    """一个已发布或已附加的共享表"""
+
+    def __init__(self, shm: _Segment, owner: bool):
+        self.shm = shm
+        self.owner = owner
+        magic, layout, _, rows, dim, emb_offset, cat_offset, vocab_offset, vocab_length, key, _, _ = \
+            _HEADER.unpack_from(shm.buf, 0)
+        if magic != TABLE_MAGIC or layout != TABLE_LAYOUT_VERSION:
+            raise ValueError(f"共享内存段格式不匹配: {shm.name}")
+        self.key = key.rstrip(b"\0").decode("ascii")
+
+        # NumPy 不会持有缓冲区导出，视图存活时映射仍可被关闭，之后访问视图会段错误。
+        # 这里以 ctypes 数组为 base：它在存活期间一直持有 shm.buf 的导出，关闭映射会抛出 BufferError
+        exported = (ctypes.c_char * shm.size).from_buffer(shm.buf)
+        self.embeddings = np.ndarray((rows, dim), dtype=np.float32, buffer=exported, offset=emb_offset)
+        self.category_ids = np.ndarray((rows,), dtype=np.int16, buffer=exported, offset=cat_offset)
+        del exported
+        self.embeddings.setflags(write=False)
+        self.category_ids.setflags(write=False)
+        self._vocab_range = (vocab_offset, vocab_offset + vocab_length)
+        self._vocabulary: Optional[FeatureVocabulary] = None
+
+    @property
+    def ready(self) -> bool:
+        return struct.unpack_from("<H", self.shm.buf, _STATE_OFFSET)[0] == 1
+
+    @property
+    def vocabulary(self) -> FeatureVocabulary:
+        """由共享段中的词表JSON重建词表（字符串无法零拷贝，只解析一次）"""
+        if self._vocabulary is None:
+            start, stop = self._vocab_range
+            data = json.loads(bytes(self.shm.buf[start:stop]).decode("utf-8"))
+            self._vocabulary = FeatureVocabulary(data["names_cn"], data["names_en"], data["categories"])
+        return self._vocabulary
+
+    def close(self, detach: bool = False) -> bool:
+        """
+        关闭映射；发布者同时删除段名（已附加的进程不受影响）
+
+        先释放本对象持有的视图再关闭映射。
+
+        Args:
+            detach: 仍有外部视图时放弃对映射的所有权（进程退出时使用）：映射保留到进程退出，
+                段对象析构时不会再尝试关闭而抛出 BufferError
+
+        Returns:
+            bool: 仍有视图引用该段、暂时无法关闭时返回 False
+        """
+        if self.owner:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+            self.owner = False
+        self.embeddings = self.category_ids = None
+        try:
+            self.shm.close()
+            return True
+        except BufferError:
+            if not detach:
+                return False
+            self.shm.detached = True
+            return True
+
+
+def publish_tables(key: str, vocabulary: FeatureVocabulary, embeddings: np.ndarray) -> SharedTables:
+    """
+    创建共享段并写入表，写完后才把状态置为就绪
+
+    Raises:
+        FileExistsError: 其他进程已发布同一个键
+    """
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    rows, dim = embeddings.shape
+    vocab_blob = json.dumps({
+        "names_cn": vocabulary.names_cn,
+        "names_en": vocabulary.names_en,
+        "categories": [vocabulary.categories[i] for i in vocabulary.category_ids],
+    }, ensure_ascii=False).encode("utf-8")
+
+    emb_offset = _HEADER_SIZE
+    cat_offset = _align(emb_offset + embeddings.nbytes)
+    vocab_offset = _align(cat_offset + rows * 2)
+    size = vocab_offset + len(vocab_blob)
+
+    shm = _Segment(name=segment_name(key), create=True, size=size)
+    try:
+        _HEADER.pack_into(shm.buf, 0, TABLE_MAGIC, TABLE_LAYOUT_VERSION, 0, rows, dim,
+                          emb_offset, cat_offset, vocab_offset, len(vocab_blob), key[:32].encode("ascii"),
+                          *_tracker_identity())
+        np.ndarray((rows, dim), dtype=np.float32, buffer=shm.buf, offset=emb_offset)[:] = embeddings
+        np.ndarray((rows,), dtype=np.int16, buffer=shm.buf, offset=cat_offset)[:] = vocabulary.category_ids
+        shm.buf[vocab_offset:vocab_offset + len(vocab_blob)] = vocab_blob
+        struct.pack_into("<H", shm.buf, _STATE_OFFSET, 1)
+        return SharedTables(shm, owner=True)
+    except BaseException:
+        shm.close()
+        shm.unlink()
+        raise
+
+
+def attach_tables(key: str, timeout: float = 5.0) -> Optional[SharedTables]:
+    """
+    按键附加已发布的表
+
+    Returns:
+        SharedTables，段不存在、格式不匹配或在 timeout 秒内未就绪时返回 None
+    """
+    try:
+        shm = _attach_segment(segment_name(key))
+    except FileNotFoundError:
+        return None
+    try:
+        tables = SharedTables(shm, owner=False)
+    except ValueError:
+        shm.close()
+        return None
+    if tables.key != key[:32]:
+        tables.close()
+        return None
+
+    deadline = time.monotonic() + timeout
+    while not tables.ready:
+        if time.monotonic() > deadline:
+            tables.close()
+            return None
+        time.sleep(0.01)
+    return tables
+
+
+class SharedTableManager:
+    """管理当前进程使用的共享表：附加或发布，键变化时释放旧段"""
+
+    def __init__(self, enabled: bool = None):
+        if enabled is None:
+            enabled = os.environ.get(SHARED_TABLES_ENV, "") == "1"
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._current: Optional[SharedTables] = None
+        self._retired: List[SharedTables] = []
+        # 发布失败时的进程内副本 (键, 数组)，避免每次调用都重新编码
+        self._private: Optional[tuple] = None
+        atexit.register(self.release, detach=True)
+
+    def enable(self, enabled: bool = True):
+        self.enabled = enabled
+        if not enabled:
+            self.release()
+
+    def get_or_build(self, key: str, vocabulary: FeatureVocabulary,
+                     build: Callable[[], np.ndarray]) -> np.ndarray:
+        """
+        获取键对应的文本嵌入（只读视图）
+
+        依次尝试：当前已持有的表 -> 附加其他进程发布的表 -> 本进程构建并发布。
+        发布失败（如 /dev/shm 空间不足）时返回本进程私有的数组。
+        """
+        # 无锁的快速路径：先取出数组引用再检查，release() 同时把它置为 None 时改走加锁路径。
+        # 取到的数组持有映射的导出，之后即使表被退役也仍然有效
+        current = self._current
+        if current is not None and current.key == key[:32]:
+            embeddings = current.embeddings
+            if embeddings is not None:
+                return embeddings
+        private = self._private
+        if private is not None and private[0] == key:
+            return private[1]
+
+        with self._lock:
+            current = self._current
+            if current is not None and current.key == key[:32]:
+                return current.embeddings
+
+            tables = attach_tables(key)
+            if tables is None:
+                embeddings = build()
+                try:
+                    tables = publish_tables(key, vocabulary, embeddings)
+                    print(f"✅ 已发布共享文本嵌入: {tables.shm.name} ({embeddings.shape[0]}×{embeddings.shape[1]})")
+                except FileExistsError:
+                    # 其他进程抢先发布，改为附加
+                    tables = attach_tables(key)
+                except OSError as e:
+                    print(f"⚠️ 发布共享文本嵌入失败，使用进程内副本: {e}")
+                if tables is None:
+                    embeddings.setflags(write=False)
+                    self._private = (key, embeddings)
+                    return embeddings
+
+            self._replace(tables)
+            return tables.embeddings
+
+    def _replace(self, tables: Optional[SharedTables], detach: bool = False):
+        """切换到新表，旧表在没有视图引用后关闭"""
+        if self._current is not None:
+            self._retired.append(self._current)
+        self._current = tables
+        self._retired = [old for old in self._retired if not old.close(detach)]
+
+    def vocabulary(self, key: str) -> Optional[FeatureVocabulary]:
+        """当前持有的表中发布的词表，键不匹配或未启用共享时返回 None"""
+        with self._lock:
+            current = self._current
+            if current is None or current.key != key[:32]:
+                return None
+            return current.vocabulary
+
+    def release(self, detach: bool = False):
+        """
+        释放当前进程持有的全部共享表
+
+        Args:
+            detach: 进程退出时为 True，仍被引用的段也不再由本进程关闭
+        """
+        with self._lock:
+            self._replace(None, detach)
+
+    def stats(self) -> Dict:
+        current = self._current
+        return {
+            "enabled": self.enabled,
+            "segment": current.shm.name if current is not None else None,
+            "owner": current.owner if current is not None else False,
+            "size_bytes": current.shm.size if current is not None else 0,
+            "retired": len(self._retired),
+        }
+
+
+# 创建全局实例
+shared_tables = SharedTableManager()
@@ -0,0 +1,527 @@
+"""
+流式标签统计工具模块
+
+训练前需要统计几十万条标注的标签频率与共现情况。统计器逐条接收标注，内存占用有上界，
+不保存任何一条标注：
+
+- 配置词表中的标签（核心/可变变量选项、CLIP特征名，中英文）用定长数组精确计数
+- 词表外的自由标签用 Count-Min Sketch 估计频率，并维护有界的高频候选集
+- 词表标签之间的共现以稀疏 (键, 计数) 数组累积，缓冲区满时合并一次
+- 核心变量按 core_variables.json 中的全部选项统计分布（包括从未出现的选项）
+
+标签词表按内容单独计算指纹：配置版本变化但词表不变时统计照常累积；词表变化时已有计数按标签名迁移，
+移出词表的标签转入自由标签统计，变化记录在报告的 vocabulary_changes 中。
+
+多个工作进程可以各自统计，最后用 merge() 合并；run 结束时 write_report() 写出JSON报告。
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import tempfile
+import threading
+from collections import Counter
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .clip_analyzer import clip_analyzer
+from .label_generator import CORE_EN_MAPPING, VARIABLE_EN_MAPPING
+from .variable_processor import variable_processor
+
+
+def split_tags(caption: str) -> List[str]:
+    """
+    把一条标注拆分为标签（按中英文逗号），每个标签只保留一次
+
+    "夜晚(深夜)" 或 "night (late night)" 形式的二级标签拆为一级和二级两个标签。
+    """
+    tags, seen = [], set()
+    for part in caption.replace("，", ",").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        pieces = [part]
+        if part.endswith(")") and "(" in part:
+            level1, level2 = part[:-1].split("(", 1)
+            pieces = [level1.strip(), level2.strip()]
+        for tag in pieces:
+            if tag and tag not in seen:
+                seen.add(tag)
+                tags.append(tag)
+    return tags
+
+
+def _tag_hash(tag: str) -> int:
+    return int.from_bytes(hashlib.blake2b(tag.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class CountMinSketch:
+    """
+    Count-Min Sketch：depth 行 × width 列的计数表
+
+    估计值不会低于真实计数，超出量以 e/width × 总数 为界（概率 1 - e^-depth）。
+    每行的列号由一个64位哈希的高低两半做双重哈希得到，同一标签在不同进程中位置相同，可以合并。
+    """
+
+    def __init__(self, width: int = 1 << 16, depth: int = 4):
+        self.width = width
+        self.depth = depth
+        self.table = np.zeros((depth, width), dtype=np.int64)
+        self.total = 0
+        self._rows = np.arange(depth, dtype=np.uint64)[:, None]
+
+    def _columns(self, tags: Sequence[str]) -> np.ndarray:
+        hashes = np.array([_tag_hash(tag) for tag in tags], dtype=np.uint64)
+        low = hashes & np.uint64(0xFFFFFFFF)
+        high = (hashes >> np.uint64(32)) | np.uint64(1)
+        return ((low + self._rows * high) % np.uint64(self.width)).astype(np.int64)
+
+    def add(self, tags: Sequence[str], counts: Sequence[int] = None):
+        """每个标签计数加1（或加上 counts 中对应的计数）"""
+        if not tags:
+            return
+        columns = self._columns(tags)
+        increments = 1 if counts is None else np.broadcast_to(np.asarray(counts, dtype=np.int64), columns.shape)
+        np.add.at(self.table, (np.arange(self.depth)[:, None], columns), increments)
+        self.total += len(tags) if counts is None else int(np.sum(counts))
+
+    def estimate(self, tags: Sequence[str]) -> np.ndarray:
+        if not tags:
+            return np.zeros(0, dtype=np.int64)
+        return self.table[np.arange(self.depth)[:, None], self._columns(tags)].min(axis=0)
+
+    @property
+    def error_bound(self) -> float:
+        """估计值超出真实计数的上界（以高概率成立）"""
+        return math.e / self.width * self.total
+
+    def merge(self, other: "CountMinSketch"):
+        if (self.width, self.depth) != (other.width, other.depth):
+            raise ValueError("Count-Min Sketch 尺寸不一致，无法合并")
+        self.table += other.table
+        self.total += other.total
+
+
+class _TagVocabulary:
+    """配置词表：标签名 -> 计数下标，以及核心变量选项的归属"""
+
+    def __init__(self, snapshot):
+        self.names: List[str] = []
+        self.index: Dict[str, int] = {}
+        # 核心变量: [(键, 选项)]，以及 词表下标 -> [(变量序号, 选项序号)]
+        self.core_variables: List[Tuple[str, Tuple[str, ...]]] = []
+        self.core_owners: Dict[int, List[Tuple[int, int]]] = {}
+
+        for category, variables in snapshot.core_variables.items():
+            for var_name, options in variables.items():
+                if not isinstance(options, list):
+                    continue
+                position = len(self.core_variables)
+                self.core_variables.append((f"{category}.{var_name}", tuple(options)))
+                for option_index, option in enumerate(options):
+                    tag_id = self._add(option, CORE_EN_MAPPING.get(option))
+                    self.core_owners.setdefault(tag_id, []).append((position, option_index))
+
+        for subcategories in snapshot.variable_variables.values():
+            for levels in subcategories.values():
+                if not isinstance(levels, dict):
+                    continue
+                for option in levels.get("一级", []):
+                    self._add(option, VARIABLE_EN_MAPPING.get(option))
+                level2_map = levels.get("二级", {})
+                if isinstance(level2_map, dict):
+                    for options in level2_map.values():
+                        for option in options:
+                            self._add(option, VARIABLE_EN_MAPPING.get(option))
+
+        vocab = clip_analyzer.vocabulary
+        for name_cn, name_en in zip(vocab.names_cn, vocab.names_en):
+            self._add(name_cn, name_en)
+
+        # 词表指纹：只随标签和核心变量选项变化，与配置版本号无关
+        payload = json.dumps([self.names, sorted(self.index.items()), self.core_variables], ensure_ascii=False)
+        self.fingerprint = hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+    def _add(self, name: str, alias: Optional[str] = None) -> int:
+        tag_id = self.index.get(name)
+        if tag_id is None:
+            tag_id = len(self.names)
+            self.names.append(name)
+            self.index[name] = tag_id
+        if alias:
+            self.index.setdefault(alias, tag_id)
+        return tag_id
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+
+class TagStatistics:
+    """流式标签统计器"""
+
+    def __init__(self, sketch_width: int = 1 << 16, sketch_depth: int = 4, heavy_hitters: int = 200,
+                 flush_pairs: int = 1 << 20):
+        snapshot = variable_processor.get_snapshot()
+        self.config_version = snapshot.version
+        self.vocabulary = _TagVocabulary(snapshot)
+        self.sketch_width = sketch_width
+        self.sketch_depth = sketch_depth
+        self.heavy_capacity = heavy_hitters
+        self.flush_pairs = flush_pairs
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """清空全部统计（词表保持不变）"""
+        size = len(self.vocabulary)
+        self.vocabulary_changes: List[Dict] = []
+        self._notices: List[Dict] = []
+        self.captions = 0
+        self.tags_total = 0
+        self.counts = np.zeros(size, dtype=np.int64)
+        self.sketch = CountMinSketch(self.sketch_width, self.sketch_depth)
+        self._candidates: Dict[str, int] = {}
+        self._floor = 0
+        # 共现：键 = i * V + j (i < j)，已合并部分保持按键有序
+        self.pair_keys = np.zeros(0, dtype=np.int64)
+        self.pair_counts = np.zeros(0, dtype=np.int64)
+        self._pending: List[np.ndarray] = []
+        self._pending_size = 0
+        self.core_counts = [np.zeros(len(options), dtype=np.int64) for _, options in self.vocabulary.core_variables]
+        self.core_unknown = [Counter() for _ in self.vocabulary.core_variables]
+
+    # ---- 累积 ----
+
+    def add(self, caption: str, core_variables: Dict = None):
+        """
+        统计一条标注
+
+        Args:
+            caption: 逗号分隔的标签
+            core_variables: 可选的核心变量选择（核心变量选择器的输出）。提供时核心变量分布按其精确统计，
+                否则只按标签推断（同名选项如发色/瞳色的 "黑色" 无法区分，不计入分布）
+        """
+        tags = split_tags(caption)
+        index = self.vocabulary.index
+        known = np.unique(np.fromiter((index[tag] for tag in tags if tag in index), dtype=np.int64))
+        free = [tag for tag in tags if tag not in index]
+
+        with self._lock:
+            self.captions += 1
+            self.tags_total += len(tags)
+            self.counts[known] += 1
+            self._add_free(free)
+            self._add_pairs(known)
+            if core_variables:
+                self._add_core_selection(core_variables)
+            else:
+                self._add_core_tags(known)
+
+    def consume(self, captions: Iterable[str]) -> "TagStatistics":
+        """逐条统计一个标注流（例如逐行读取的文件）"""
+        for caption in captions:
+            if caption.strip():
+                self.add(caption)
+        return self
+
+    def _add_free(self, free: List[str], counts: Sequence[int] = None):
+        if not free:
+            return
+        self.sketch.add(free, counts)
+        candidates = self._candidates
+        for tag, estimate in zip(free, self.sketch.estimate(free)):
+            if tag in candidates or estimate > self._floor or len(candidates) < self.heavy_capacity:
+                candidates[tag] = int(estimate)
+        if len(candidates) > 2 * self.heavy_capacity:
+            # 只保留估计值最高的一半，候选集大小保持有界
+            kept = sorted(candidates.items(), key=lambda item: item[1], reverse=True)[:self.heavy_capacity]
+            self._candidates = dict(kept)
+            self._floor = kept[-1][1]
+
+    def _add_pairs(self, known: np.ndarray):
+        if known.size < 2:
+            return
+        first, second = np.triu_indices(known.size, k=1)
+        self._pending.append(known[first] * len(self.vocabulary) + known[second])
+        self._pending_size += first.size
+        if self._pending_size >= self.flush_pairs:
+            self._flush_pairs()
+
+    def _flush_pairs(self, keys: np.ndarray = None, counts: np.ndarray = None):
+        """把缓冲的共现键（以及可选的另一组 (键, 计数)）合并进有序的稀疏数组"""
+        if not self._pending and keys is None:
+            return
+        all_keys = [self.pair_keys] + self._pending
+        all_counts = [self.pair_counts, np.ones(self._pending_size, dtype=np.int64)]
+        if keys is not None:
+            all_keys.append(keys)
+            all_counts.append(counts)
+        self.pair_keys, inverse = np.unique(np.concatenate(all_keys), return_inverse=True)
+        self.pair_counts = np.bincount(inverse, weights=np.concatenate(all_counts)).astype(np.int64)
+        self._pending = []
+        self._pending_size = 0
+
+    def _add_core_selection(self, core_variables: Dict):
+        for position, (key, options) in enumerate(self.vocabulary.core_variables):
+            category, var_name = key.split(".", 1)
+            value = core_variables.get(category, {}).get(var_name)
+            if not value:
+                continue
+            try:
+                self.core_counts[position][options.index(value)] += 1
+            except ValueError:
+                self.core_unknown[position][value] += 1
+
+    def _add_core_tags(self, known: np.ndarray):
+        for tag_id in known.tolist():
+            owners = self.vocabulary.core_owners.get(tag_id)
+            if owners is not None and len(owners) == 1:
+                position, option_index = owners[0]
+                self.core_counts[position][option_index] += 1
+
+    # ---- 词表变化 ----
+
+    def refresh_vocabulary(self) -> Optional[Dict]:
+        """
+        配置版本变化时检查标签词表
+
+        词表不变时只更新版本号；词表变化时按标签名迁移已有计数，不清空统计。
+
+        Returns:
+            词表变化摘要，没有变化时为 None
+        """
+        snapshot = variable_processor.get_snapshot()
+        if snapshot.version == self.config_version:
+            return None
+        vocabulary = _TagVocabulary(snapshot)
+        with self._lock:
+            self.config_version = snapshot.version
+            if vocabulary.fingerprint == self.vocabulary.fingerprint:
+                return None
+            change = self._remap(vocabulary)
+            self.vocabulary_changes.append(change)
+            self._notices.append(change)
+        return change
+
+    def take_notices(self) -> List[Dict]:
+        """取出尚未报告的词表变化（节点输出中提示一次）"""
+        with self._lock:
+            notices, self._notices = self._notices, []
+        return notices
+
+    def _remap(self, vocabulary: "_TagVocabulary") -> Dict:
+        """把统计迁移到新词表（调用方需持有锁）"""
+        old = self.vocabulary
+        self._flush_pairs()
+        mapping = np.array([vocabulary.index.get(name, -1) for name in old.names], dtype=np.int64)
+        kept = mapping >= 0
+
+        # 单标签计数：仍在词表中的按名称迁移，移出词表的转为自由标签
+        counts = np.zeros(len(vocabulary), dtype=np.int64)
+        np.add.at(counts, mapping[kept], self.counts[kept])
+        dropped = np.flatnonzero(~kept & (self.counts > 0))
+        self._add_free([old.names[i] for i in dropped.tolist()], self.counts[dropped])
+        self.counts = counts
+
+        # 共现：两端都仍在词表中的标签对按新下标重新编码
+        if self.pair_keys.size:
+            first, second = np.divmod(self.pair_keys, len(old))
+            first, second = mapping[first], mapping[second]
+            valid = (first >= 0) & (second >= 0) & (first != second)
+            keys = np.minimum(first, second)[valid] * len(vocabulary) + np.maximum(first, second)[valid]
+            self.pair_keys, inverse = np.unique(keys, return_inverse=True)
+            self.pair_counts = np.bincount(inverse, weights=self.pair_counts[valid],
+                                           minlength=self.pair_keys.size).astype(np.int64)
+
+        # 核心变量：按 (变量, 选项) 迁移，配置中已删除的选项计入 not_in_config
+        previous = {key: (options, counts, unknown) for (key, options), counts, unknown
+                    in zip(old.core_variables, self.core_counts, self.core_unknown)}
+        self.core_counts, self.core_unknown = [], []
+        for key, options in vocabulary.core_variables:
+            core_counts = np.zeros(len(options), dtype=np.int64)
+            unknown = Counter()
+            if key in previous:
+                position = {option: i for i, option in enumerate(options)}
+                old_options, old_counts, old_unknown = previous[key]
+                for option, count in list(zip(old_options, old_counts.tolist())) + list(old_unknown.items()):
+                    if count and option in position:
+                        core_counts[position[option]] += count
+                    elif count:
+                        unknown[option] += count
+            self.core_counts.append(core_counts)
+            self.core_unknown.append(unknown)
+
+        self.vocabulary = vocabulary
+        old_names, new_names = set(old.names), set(vocabulary.names)
+        return {
+            "at": datetime.now().isoformat(timespec="seconds"),
+            "config_version": self.config_version,
+            "added": len(new_names - old_names),
+            "removed": len(old_names - new_names),
+            "captions_before": self.captions,
+        }
+
+    def merge(self, other: "TagStatistics"):
+        """合并另一个工作进程的统计（两者需使用同一配置版本的词表）"""
+        if other.vocabulary.names != self.vocabulary.names:
+            raise ValueError("标签词表不一致，无法合并统计")
+        with self._lock:
+            other._flush_pairs()
+            self.captions += other.captions
+            self.tags_total += other.tags_total
+            self.counts += other.counts
+            self.sketch.merge(other.sketch)
+            self._flush_pairs(other.pair_keys, other.pair_counts)
+            for mine, theirs in zip(self.core_counts, other.core_counts):
+                mine += theirs
+            for mine, theirs in zip(self.core_unknown, other.core_unknown):
+                mine.update(theirs)
+            candidates = list(set(self._candidates) | set(other._candidates))
+            self._candidates = dict(zip(candidates, self.sketch.estimate(candidates).tolist()))
+            self._floor = 0
+
+    # ---- 报告 ----
+
+    def heavy_hitters(self, top_n: int = 50) -> List[Tuple[str, int]]:
+        """估计频率最高的自由标签 (标签, 估计计数)"""
+        return sorted(self._candidates.items(), key=lambda item: item[1], reverse=True)[:top_n]
+
+    def top_pairs(self, top_n: int = 100) -> List[Tuple[str, str, int]]:
+        """共现次数最多的词表标签对"""
+        with self._lock:
+            self._flush_pairs()
+        if self.pair_counts.size == 0:
+            return []
+        order = np.argsort(-self.pair_counts, kind="stable")[:top_n]
+        first, second = np.divmod(self.pair_keys[order], len(self.vocabulary))
+        names = self.vocabulary.names
+        return [(names[a], names[b], int(count))
+                for a, b, count in zip(first.tolist(), second.tolist(), self.pair_counts[order].tolist())]
+
+    def core_distributions(self) -> Dict[str, Dict]:
+        """按 core_variables.json 统计每个核心变量的选项分布"""
+        distributions = {}
+        for (key, options), counts, unknown in zip(self.vocabulary.core_variables, self.core_counts,
+                                                   self.core_unknown):
+            total = int(counts.sum())
+            shares = counts / total if total else np.zeros(len(options))
+            nonzero = shares[shares > 0]
+            entropy = float(-(nonzero * np.log(nonzero)).sum())
+            distributions[key] = {
+                "labeled": total,
+                "coverage": total / self.captions if self.captions else 0.0,
+                "counts": {option: int(count) for option, count in zip(options, counts.tolist())},
+                "shares": {option: round(float(share), 6) for option, share in zip(options, shares.tolist())},
+                # 归一化熵：1 表示各选项均匀分布
+                "balance": entropy / math.log(len(options)) if len(options) > 1 else 1.0,
+                "unseen": [option for option, count in zip(options, counts.tolist()) if count == 0],
+                "not_in_config": dict(unknown.most_common(20)),
+            }
+        return distributions
+
+    def report(self, top_n: int = 100) -> Dict:
+        names = self.vocabulary.names
+        seen = np.flatnonzero(self.counts)
+        order = seen[np.argsort(-self.counts[seen], kind="stable")][:top_n]
+
+        pairs = []
+        for first, second, count in self.top_pairs(top_n):
+            # 点互信息：正值表示两个标签比独立出现时更常同时出现
+            p_first = self.counts[self.vocabulary.index[first]] / self.captions
+            p_second = self.counts[self.vocabulary.index[second]] / self.captions
+            pmi = math.log(count / self.captions / (p_first * p_second))
+            pairs.append({"tags": [first, second], "count": count, "pmi": round(pmi, 4)})
+
+        return {
+            "generated_at": datetime.now().isoformat(timespec="seconds"),
+            "config_version": self.config_version,
+            "vocabulary_changes": list(self.vocabulary_changes),
+            "captions": self.captions,
+            "tags_total": self.tags_total,
+            "avg_tags_per_caption": self.tags_total / self.captions if self.captions else 0.0,
+            "vocabulary": {
+                "size": len(names),
+                "seen": int(seen.size),
+                "top": [{"tag": names[i], "count": int(self.counts[i]),
+                         "share": round(float(self.counts[i]) / self.captions, 6)} for i in order.tolist()],
+            },
+            "free_form": {
+                "total": self.sketch.total,
+                "sketch": {"width": self.sketch.width, "depth": self.sketch.depth,
+                           "error_bound": round(self.sketch.error_bound, 2)},
+                "heavy_hitters": [{"tag": tag, "estimate": count} for tag, count in self.heavy_hitters(top_n)],
+            },
+            "cooccurrence": {"pairs": int(self.pair_keys.size), "top": pairs},
+            "core_distributions": self.core_distributions(),
+        }
+
+    def write_report(self, path: str, top_n: int = 100) -> Dict:
+        """原子写出JSON报告"""
+        report = self.report(top_n)
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tag_report.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return report
+
+
+_collectors: Dict[str, TagStatistics] = {}
+_collectors_lock = threading.Lock()
+
+
+def get_tag_statistics(name: str, reset: bool = False) -> TagStatistics:
+    """
+    获取（并缓存）某次运行的统计器，通常以报告路径为名称
+
+    配置版本变化时不会清空统计：标签词表变化时已有计数按标签名迁移，变化可由 take_notices() 取出。
+    """
+    with _collectors_lock:
+        collector = _collectors.get(name)
+        if collector is None or reset:
+            collector = TagStatistics()
+            _collectors[name] = collector
+        else:
+            collector.refresh_vocabulary()
+        return collector
+
+
+def _iter_captions(paths: Sequence[str], extension: str) -> Iterable[str]:
+    """逐行读取标注：目录中的每个标注文件为一条，普通文件每行为一条"""
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for filename in sorted(files):
+                    if filename.endswith(extension):
+                        with open(os.path.join(root, filename), 'r', encoding='utf-8') as f:
+                            yield f.read().replace("\n", ", ")
+        else:
+            with open(path, 'r', encoding='utf-8') as f:
+                yield from f
+
+
+def main():
+    parser = argparse.ArgumentParser(description="流式统计标注中的标签频率与共现")
+    parser.add_argument("paths", nargs="+", help="标注目录（每个文件一条）或文本文件（每行一条）")
+    parser.add_argument("--output", default="tag_report.json")
+    parser.add_argument("--extension", default=".txt")
+    parser.add_argument("--top", type=int, default=100)
+    args = parser.parse_args()
+
+    statistics = TagStatistics().consume(_iter_captions(args.paths, args.extension))
+    statistics.write_report(args.output, args.top)
+    print(f"✅ 已统计 {statistics.captions} 条标注，报告已写入 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
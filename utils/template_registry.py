@@ -0,0 +1,271 @@
+"""
+输出模板注册表模块
+
+模板定义保存在 configs/output_templates.json 中，格式示例:
+
+    {
+      "kohya": {
+        "description": "kohya训练用标签",
+        "sections": ["{core}", "{variable}", "{clip}", "{additional}"],
+        "joiner": ", "
+      },
+      "自然语言": {
+        "sections": ["人物特征为{core|、}", "场景为{variable|、}"],
+        "joiner": "，",
+        "suffix": "。",
+        "languages": {
+          "英文": {"sections": ["A character with {core| and }", "{variable|, }"], "joiner": ". ", "suffix": "."}
+        }
+      }
+    }
+
+每个 section 是一小段文本，可引用槽位 {core}、{variable}、{clip}、{additional}、{all}；
+{槽位|连接符} 指定该槽位的标签连接符，缺省使用节点的 separator。
+section 中引用的槽位全部为空时整段省略，其余 section 以 joiner 连接，再加上 prefix/suffix。
+
+每个模板只在首次使用时编译为一个Python函数，并按模板内容的哈希缓存；
+逐张图像格式化时只是一次字典查找和一次普通的函数调用。
+模板文件只在首次使用和 refresh()（节点列表刷新、重新加载配置）时检查，逐张图像不访问文件系统。
+读取文件时即编译每个模板的全部语言版本：文件顶层不是对象时使用默认模板，
+引用未知槽位或格式错误的模板会被跳过并提示，不会出现在 output_format 选项中。
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+TEMPLATE_CONFIG_FILE = "output_templates.json"
+
+# 模板可引用的槽位
+TEMPLATE_SLOTS = ("core", "variable", "clip", "additional", "all")
+
+_SLOT_PATTERN = re.compile(r"\{(\w+)(?:\|([^}]*))?\}")
+
+TemplateFunction = Callable[[List[str], List[str], List[str], List[str], str], str]
+
+
+def _default_templates() -> Dict:
+    """默认模板定义"""
+    return {
+        "kohya": {
+            "description": "kohya训练用标签（核心 → 可变 → CLIP → 附加）",
+            "sections": ["{core}", "{variable}", "{clip}", "{additional}"],
+            "joiner": ", "
+        },
+        "danbooru": {
+            "description": "danbooru顺序（CLIP识别标签在前，人物特征随后）",
+            "sections": ["{clip}", "{core}", "{variable}", "{additional}"],
+            "joiner": ", "
+        },
+        "自然语言": {
+            "description": "自然语言句子",
+            "sections": ["人物特征为{core|、}", "状态与环境为{variable|、}", "画面中可以看到{clip|、}", "{additional|，}"],
+            "joiner": "，",
+            "suffix": "。",
+            "languages": {
+                "英文": {
+                    "sections": ["A character with {core|, }", "{variable|, }", "The image shows {clip|, }", "{additional|, }"],
+                    "joiner": ". ",
+                    "suffix": "."
+                }
+            }
+        }
+    }
+
+
+def template_hash(definition: Dict) -> str:
+    """模板定义的内容哈希，用作编译缓存键"""
+    payload = json.dumps(definition, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def compile_template(definition: Dict) -> TemplateFunction:
+    """
+    将模板定义编译为Python函数
+
+    生成的函数签名为 render(core, variable, clip, additional, separator) -> str，
+    其中前四个参数为标签列表。
+
+    Raises:
+        ValueError: 模板引用了未知槽位或缺少 sections
+    """
+    sections = definition.get("sections")
+    if not isinstance(sections, list) or not sections:
+        raise ValueError("模板缺少 sections 列表")
+    if not all(isinstance(section, str) for section in sections):
+        raise ValueError("模板的 sections 只能包含字符串")
+
+    lines = []
+    uses_all = False
+    for section in sections:
+        pieces = []
+        slots = []
+        position = 0
+        for match in _SLOT_PATTERN.finditer(section):
+            slot, joiner = match.group(1), match.group(2)
+            if slot not in TEMPLATE_SLOTS:
+                raise ValueError(f"模板引用了未知槽位: {{{slot}}}，可用槽位: {', '.join(TEMPLATE_SLOTS)}")
+            if match.start() > position:
+                pieces.append(repr(section[position:match.start()]))
+            variable_name = "all_tags" if slot == "all" else slot
+            uses_all = uses_all or slot == "all"
+            pieces.append(f"{'separator' if joiner is None else repr(joiner)}.join({variable_name})")
+            slots.append(variable_name)
+            position = match.end()
+        if position < len(section):
+            pieces.append(repr(section[position:]))
+
+        expression = " + ".join(pieces) if pieces else "''"
+        if slots:
+            lines.append(f"    if {' or '.join(dict.fromkeys(slots))}:")
+            lines.append(f"        parts.append({expression})")
+        else:
+            lines.append(f"    parts.append({expression})")
+
+    prefix = repr(definition.get("prefix", ""))
+    suffix = repr(definition.get("suffix", ""))
+    joiner = repr(definition.get("joiner", ", "))
+    lines.append(f"    return {prefix} + {joiner}.join(parts) + {suffix} if parts else ''")
+
+    header = ["def render(core, variable, clip, additional, separator):"]
+    if uses_all:
+        header.append("    all_tags = core + variable + clip + additional")
+    header.append("    parts = []")
+    lines = header + lines
+
+    namespace: Dict = {}
+    exec(compile("\n".join(lines), "<output_template>", "exec"), namespace)
+    return namespace["render"]
+
+
+def _resolve_definition(definition: Dict, language: Optional[str]) -> Dict:
+    """合并某语言的覆盖项，去掉不参与编译的字段"""
+    overrides = definition.get("languages", {}).get(language) if language is not None else None
+    if overrides:
+        definition = {**definition, **overrides}
+    return {key: value for key, value in definition.items() if key not in ("languages", "description")}
+
+
+class TemplateRegistry:
+    """输出模板注册表"""
+
+    def __init__(self, config_dir: str = None):
+        if config_dir is None:
+            config_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "configs")
+        self.config_dir = config_dir
+        self.config_path = os.path.join(config_dir, TEMPLATE_CONFIG_FILE)
+        self._lock = threading.Lock()
+        self._definitions: Dict[str, Dict] = {}
+        self._stamp: Optional[Tuple] = None
+        self._loaded = False
+        self._compiled: Dict[str, TemplateFunction] = {}
+        self._resolved: Dict[Tuple, TemplateFunction] = {}
+
+    def _file_stamp(self) -> Optional[Tuple]:
+        try:
+            stat = os.stat(self.config_path)
+            return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            return None
+
+    def _load(self) -> Dict[str, Dict]:
+        """返回已加载的模板定义，仅在首次使用时读取文件"""
+        if self._loaded:
+            return self._definitions
+        return self.refresh()
+
+    def refresh(self) -> Dict[str, Dict]:
+        """检查模板文件戳，文件变化时重新读取"""
+        stamp = self._file_stamp()
+        if self._loaded and stamp == self._stamp:
+            return self._definitions
+        with self._lock:
+            if stamp is None:
+                definitions = _default_templates()
+            else:
+                try:
+                    with open(self.config_path, 'r', encoding='utf-8') as f:
+                        definitions = json.load(f)
+                    if not isinstance(definitions, dict):
+                        raise ValueError(f"顶层应为 {{模板名: 定义}} 对象，实际为 {type(definitions).__name__}")
+                except Exception as e:
+                    print(f"❌ 加载输出模板 {TEMPLATE_CONFIG_FILE} 失败: {e}")
+                    definitions = _default_templates()
+            definitions = self._validate(definitions)
+            self._definitions = definitions
+            self._stamp = stamp
+            self._loaded = True
+        return definitions
+
+    def _validate(self, definitions: Dict) -> Dict[str, Dict]:
+        """编译每个模板的默认与各语言版本，返回可用的模板，错误的模板打印提示后跳过"""
+        valid = {}
+        for name, definition in definitions.items():
+            try:
+                if not isinstance(definition, dict):
+                    raise ValueError("模板定义应为对象")
+                languages = definition.get("languages", {})
+                if not isinstance(languages, dict) or not all(isinstance(v, dict) for v in languages.values()):
+                    raise ValueError("languages 应为 {语言: 覆盖项} 对象")
+                for language in [None, *languages]:
+                    resolved = _resolve_definition(definition, language)
+                    key = template_hash(resolved)
+                    if key not in self._compiled:
+                        self._compiled[key] = compile_template(resolved)
+            except ValueError as e:
+                print(f"❌ 输出模板 {name} 无效，已跳过: {e}")
+                continue
+            valid[name] = definition
+        return valid
+
+    def names(self) -> List[str]:
+        """所有模板名称（节点列表刷新时调用，顺带检查模板文件）"""
+        return list(self.refresh().keys())
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._load()
+
+    def lookup(self, name: str, language: str = "中文") -> Optional[TemplateFunction]:
+        """获取已编译的模板函数，模板不存在时返回 None"""
+        definitions = self._load()
+        resolved_key = (name, language, self._stamp)
+        render = self._resolved.get(resolved_key)
+        if render is not None:
+            return render
+
+        definition = definitions.get(name)
+        if definition is None:
+            return None
+        definition = _resolve_definition(definition, language)
+
+        key = template_hash(definition)
+        render = self._compiled.get(key)
+        if render is None:
+            render = compile_template(definition)
+            self._compiled[key] = render
+        self._resolved[resolved_key] = render
+        return render
+
+    def get(self, name: str, language: str = "中文") -> TemplateFunction:
+        """
+        获取已编译的模板函数
+
+        Raises:
+            KeyError: 模板不存在
+        """
+        render = self.lookup(name, language)
+        if render is None:
+            raise KeyError(name)
+        return render
+
+    def render(self, name: str, core: List[str], variable: List[str], clip: List[str],
+               additional: List[str], separator: str = ", ", language: str = "中文") -> str:
+        """使用指定模板格式化一组标签"""
+        return self.get(name, language)(core, variable, clip, additional, separator)
+
+
+# 创建全局实例
+template_registry = TemplateRegistry()
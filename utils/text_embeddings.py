@@ -0,0 +1,254 @@
+"""
+文本嵌入工具模块
+
+为词表中的每个特征构建CLIP文本嵌入。每个特征会套用 configs/prompt_templates.json
+中的多个提示词模板（如 "an anime illustration of {}"）分别编码，
+再在构建时取平均并重新归一化，折叠为每个特征一个向量。
+折叠后的矩阵与打分参数按 (词表, 文本编码器) 缓存，运行时打分只是一次矩阵乘法；
+模板文件只在首次使用和 refresh() 时检查。
+"""
+
+import hashlib
+import json
+import os
+import threading
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .analysis_result import FeatureVocabulary
+from .shared_tables import shared_tables
+
+PROMPT_TEMPLATE_FILE = "prompt_templates.json"
+
+TextEncoder = Callable[[List[str]], "np.ndarray"]
+
+
+def _default_prompt_config() -> Dict:
+    """默认提示词模板配置"""
+    return {
+        "templates": [
+            "a picture of a character with {}",
+            "an anime illustration of {}",
+            "a photo of a person, {}",
+            "a character portrait, {}"
+        ],
+        "category_templates": {
+            "表情": ["a picture of a character with a {} expression", "a {} face"],
+            "姿势": ["a picture of a character {}", "a full body shot of a character {}"],
+            "环境": ["a picture of a character in a {} scene", "{} background"],
+            "风格": ["a {} style illustration", "artwork in {} style"],
+            "服装": ["a picture of a character wearing {}", "a character in a {}"],
+            "构图": ["a {} shot of a character", "a {} picture of a person"],
+            "视角": ["a picture of a character seen {}", "a shot of a person taken {}"]
+        },
+        "logit_scale": 100.0,
+        "logit_bias": -25.0
+    }
+
+
+def _to_numpy(embeddings) -> np.ndarray:
+    if hasattr(embeddings, "detach"):
+        embeddings = embeddings.detach().float().cpu().numpy()
+    return np.asarray(embeddings, dtype=np.float32)
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+class TextTables(NamedTuple):
+    """构建好的文本嵌入表：打分时直接使用，不再读取配置"""
+    embeddings: np.ndarray          # [N, D] float32，行已L2归一化
+    vocabulary: FeatureVocabulary   # 与嵌入行对应的词表
+    logit_scale: float
+    logit_bias: float
+
+    def confidence(self, similarity: np.ndarray) -> np.ndarray:
+        """余弦相似度映射为 0~1 的置信度（logit 截断在 ±80 内，避免 float32 的 exp 溢出）"""
+        logits = np.clip(self.logit_scale * similarity + self.logit_bias, -80.0, 80.0)
+        return (1.0 / (1.0 + np.exp(-logits))).astype(np.float32)
+
+
+class TextEmbeddingBank:
+    """提示词集成的文本嵌入缓存"""
+
+    def __init__(self, config_dir: str = None):
+        if config_dir is None:
+            config_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "configs")
+        self.config_path = os.path.join(config_dir, PROMPT_TEMPLATE_FILE)
+        self._lock = threading.Lock()
+        self._config: Dict = _default_prompt_config()
+        self._stamp: Optional[Tuple] = ()
+        self._loaded = False
+        self._cache: Dict[str, np.ndarray] = {}
+        # (id(词表), 编码器键, 是否共享) -> (词表, TextTables)，配置变化时清空
+        self._tables: Dict[Tuple, Tuple[FeatureVocabulary, TextTables]] = {}
+
+    def load_config(self) -> Dict:
+        """返回提示词模板配置，仅在首次使用时读取文件"""
+        if self._loaded:
+            return self._config
+        return self.refresh()
+
+    def refresh(self) -> Dict:
+        """检查模板文件戳，文件变化时重新读取，并使已构建的文本嵌入表失效"""
+        try:
+            info = os.stat(self.config_path)
+            stamp = (info.st_ino, info.st_mtime_ns, info.st_size)
+        except OSError:
+            stamp = None
+        if self._loaded and stamp == self._stamp:
+            return self._config
+        with self._lock:
+            config = _default_prompt_config()
+            if stamp is not None:
+                try:
+                    with open(self.config_path, 'r', encoding='utf-8') as f:
+                        config.update(json.load(f))
+                except Exception as e:
+                    print(f"❌ 加载提示词模板 {PROMPT_TEMPLATE_FILE} 失败: {e}")
+            self._config = config
+            self._stamp = stamp
+            self._loaded = True
+            self._tables = {}
+        return config
+
+    @property
+    def logit_scale(self) -> float:
+        return float(self.load_config().get("logit_scale", 100.0))
+
+    @property
+    def logit_bias(self) -> float:
+        return float(self.load_config().get("logit_bias", -25.0))
+
+    def prompts_for(self, vocabulary) -> Tuple[List[str], np.ndarray]:
+        """
+        展开词表的全部提示词
+
+        Returns:
+            Tuple[List[str], np.ndarray]: 提示词列表，以及每条提示词所属的特征索引
+        """
+        config = self.load_config()
+        default_templates = config.get("templates") or ["{}"]
+        category_templates = config.get("category_templates", {})
+
+        prompts, owners = [], []
+        for i, name in enumerate(vocabulary.names_en):
+            category = vocabulary.categories[vocabulary.category_ids[i]]
+            for template in category_templates.get(category, default_templates):
+                prompts.append(template.format(name))
+                owners.append(i)
+        return prompts, np.asarray(owners, dtype=np.int64)
+
+    def _cache_key(self, prompts: Sequence[str], encoder_key: str) -> str:
+        digest = hashlib.sha1(encoder_key.encode("utf-8"))
+        for prompt in prompts:
+            digest.update(prompt.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def build(self, vocabulary, encode_text: TextEncoder, encoder_key: str = "default",
+              batch_size: int = 256) -> np.ndarray:
+        """
+        构建（或取缓存的）每个特征一个向量的文本嵌入矩阵
+
+        Args:
+            vocabulary: FeatureVocabulary
+            encode_text: 文本编码函数，输入提示词列表，输出 [P, D] 嵌入
+            encoder_key: 区分不同文本编码器的缓存键
+
+        Returns:
+            np.ndarray: [N, D] float32，行已L2归一化
+        """
+        return self.tables(vocabulary, encode_text, encoder_key, batch_size).embeddings
+
+    def tables(self, vocabulary, encode_text: TextEncoder, encoder_key: str = "default",
+               batch_size: int = 256) -> TextTables:
+        """
+        与 build 相同，同时返回与嵌入行对应的词表和打分参数
+
+        同一词表对象与编码器只在首次调用时展开提示词、计算缓存键，之后直接返回缓存的表。
+        启用共享内存时返回共享段中发布的词表（内容与传入的词表一致），调用方可改用它，
+        使进程内只保留一份词表；否则返回传入的词表。
+        """
+        memo_key = (id(vocabulary), encoder_key, shared_tables.enabled)
+        memo = self._tables.get(memo_key)
+        if memo is not None and memo[0] is vocabulary:
+            return memo[1]
+
+        config = self.load_config()
+        embeddings, resolved = self._build_tables(vocabulary, encode_text, encoder_key, batch_size)
+        tables = TextTables(embeddings, resolved, float(config.get("logit_scale", 100.0)),
+                            float(config.get("logit_bias", -25.0)))
+        with self._lock:
+            if self._config is config:
+                self._tables[memo_key] = (vocabulary, tables)
+        return tables
+
+    def _build_tables(self, vocabulary, encode_text: TextEncoder, encoder_key: str,
+                      batch_size: int) -> Tuple[np.ndarray, FeatureVocabulary]:
+        prompts, owners = self.prompts_for(vocabulary)
+        key = self._cache_key(prompts, encoder_key)
+        if shared_tables.enabled:
+            # 多个工作进程共用一份：附加已发布的共享段，或构建后发布
+            embeddings = shared_tables.get_or_build(
+                key, vocabulary, lambda: self._encode(vocabulary, prompts, owners, encode_text, batch_size))
+            shared = shared_tables.vocabulary(key)
+            if shared is not None and shared is not vocabulary and (
+                    shared.names_cn, shared.names_en, shared.categories) == (
+                    vocabulary.names_cn, vocabulary.names_en, vocabulary.categories):
+                vocabulary = shared
+            return embeddings, vocabulary
+
+        cached = self._cache.get(key)
+        if cached is not None:
+            return cached, vocabulary
+
+        folded = self._encode(vocabulary, prompts, owners, encode_text, batch_size)
+        folded.setflags(write=False)
+        self._cache[key] = folded
+        return folded, vocabulary
+
+    @staticmethod
+    def _encode(vocabulary, prompts: List[str], owners: np.ndarray, encode_text: TextEncoder,
+                batch_size: int) -> np.ndarray:
+        """分批编码全部提示词，并按特征取平均、重新归一化"""
+        encoded = np.concatenate([
+            _normalize(_to_numpy(encode_text(prompts[start:start + batch_size])))
+            for start in range(0, len(prompts), batch_size)
+        ])
+        folded = np.zeros((len(vocabulary), encoded.shape[1]), dtype=np.float32)
+        np.add.at(folded, owners, encoded)
+        folded /= np.bincount(owners, minlength=len(vocabulary))[:, None].clip(min=1)
+        return _normalize(folded).astype(np.float32, copy=False)
+
+    def clear_cache(self):
+        self._cache.clear()
+        self._tables = {}
+
+
+def load_transformers_text_encoder(model_name: str = "openai/clip-vit-large-patch14",
+                                   device: str = "cpu") -> TextEncoder:
+    """
+    使用 transformers 的CLIP文本塔创建文本编码函数（可选依赖）
+
+    文本塔需与所用的CLIP视觉模型配套，嵌入维度才能对齐。
+    """
+    import torch
+    from transformers import CLIPModel, CLIPTokenizer
+
+    tokenizer = CLIPTokenizer.from_pretrained(model_name)
+    model = CLIPModel.from_pretrained(model_name).to(device).eval()
+
+    def encode_text(prompts: List[str]):
+        tokens = tokenizer(prompts, padding=True, truncation=True, return_tensors="pt").to(device)
+        with torch.no_grad():
+            return model.get_text_features(**tokens)
+
+    return encode_text
+
+
+# 创建全局实例
+text_embedding_bank = TextEmbeddingBank()
@@ -2,17 +2,42 @@
 变量处理器工具模块
 """
 
+import copy
 import json
 import os
-from typing import Dict, List, Any, Optional
+import stat
+import tempfile
+import threading
+from types import MappingProxyType
+from typing import Dict, List, Any, Mapping, NamedTuple, Optional, Tuple
+
+CORE_CONFIG_FILE = "core_variables.json"
+VARIABLE_CONFIG_FILE = "variable_variables.json"
+
+
+class ConfigSnapshot(NamedTuple):
+    """配置快照，发布后不再修改；两份配置为只读映射，内部的列表与字典也不应原地修改"""
+    version: int
+    core_variables: Mapping
+    variable_variables: Mapping
+    file_stamps: Tuple
+
 
 class VariableProcessor:
-    """变量处理器"""
+    """
+    变量处理器
+
+    读路径无锁：get_snapshot() 返回只读的配置快照，仅在配置文件变化时由持锁的线程重建并整体替换；
+    load_core_variables() / load_variable_variables() 返回深拷贝，调用方可以修改后再保存。
+    写路径串行：所有写入都持有写锁，并通过临时文件 + 重命名原子完成。
+    """
     
     def __init__(self, config_dir: str = None):
         if config_dir is None:
             config_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "configs")
         self.config_dir = config_dir
+        self._lock = threading.RLock()
+        self._snapshot: Optional[ConfigSnapshot] = None
         os.makedirs(self.config_dir, exist_ok=True)
         self._ensure_config_files()
     
@@ -48,9 +73,7 @@ class VariableProcessor:
             }
         }
         
-        config_path = os.path.join(self.config_dir, "core_variables.json")
-        with open(config_path, 'w', encoding='utf-8') as f:
-            json.dump(default_config, f, ensure_ascii=False, indent=2)
+        config_path = self._write_json_atomic(CORE_CONFIG_FILE, default_config)
         print(f"✅ 已创建默认核心变量配置文件: {config_path}")
     
     def _create_default_variable_config(self):
@@ -127,29 +150,112 @@ class VariableProcessor:
             }
         }
         
-        config_path = os.path.join(self.config_dir, "variable_variables.json")
-        with open(config_path, 'w', encoding='utf-8') as f:
-            json.dump(default_config, f, ensure_ascii=False, indent=2)
+        config_path = self._write_json_atomic(VARIABLE_CONFIG_FILE, default_config)
         print(f"✅ 已创建默认可变变量配置文件: {config_path}")
     
     def load_core_variables(self) -> Dict:
-        """加载核心变量配置"""
-        return self._load_json_file("core_variables.json")
+        """加载核心变量配置（快照的深拷贝）"""
+        return copy.deepcopy(dict(self.get_snapshot().core_variables))
     
     def load_variable_variables(self) -> Dict:
-        """加载可变变量配置"""
-        return self._load_json_file("variable_variables.json")
+        """加载可变变量配置（快照的深拷贝）"""
+        return copy.deepcopy(dict(self.get_snapshot().variable_variables))
+
+    @property
+    def config_version(self) -> int:
+        """当前配置版本号，配置文件每次变化后递增"""
+        return self.get_snapshot().version
+
+    def get_snapshot(self) -> ConfigSnapshot:
+        """
+        获取当前配置快照
+
+        快路径只比较文件戳，不加锁；文件变化时持锁重建快照。
+        """
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.file_stamps == self._file_stamps():
+            return snapshot
+        with self._lock:
+            return self._rebuild_snapshot(force=False)
+
+    def reload(self) -> ConfigSnapshot:
+        """强制重新读取配置文件并发布新快照"""
+        with self._lock:
+            return self._rebuild_snapshot(force=True)
+
+    def save_core_variables(self, config: Dict) -> str:
+        """原子写入核心变量配置，返回文件路径"""
+        return self._write_json_atomic(CORE_CONFIG_FILE, config)
+
+    def save_variable_variables(self, config: Dict) -> str:
+        """原子写入可变变量配置，返回文件路径"""
+        return self._write_json_atomic(VARIABLE_CONFIG_FILE, config)
+
+    def _file_stamps(self) -> Tuple:
+        """配置文件戳（inode、修改时间、大小），重命名写入会改变inode"""
+        stamps = []
+        for filename in (CORE_CONFIG_FILE, VARIABLE_CONFIG_FILE):
+            try:
+                info = os.stat(os.path.join(self.config_dir, filename))
+                stamps.append((info.st_ino, info.st_mtime_ns, info.st_size))
+            except OSError:
+                stamps.append(None)
+        return tuple(stamps)
+
+    def _rebuild_snapshot(self, force: bool) -> ConfigSnapshot:
+        """重建并发布快照（调用方需持有锁）"""
+        previous = self._snapshot
+        # 先取文件戳再读取，读取期间若文件再次变化，下次读取会重新加载
+        stamps = self._file_stamps()
+        if not force and previous is not None and previous.file_stamps == stamps:
+            return previous
+        snapshot = ConfigSnapshot(
+            version=previous.version + 1 if previous is not None else 1,
+            core_variables=MappingProxyType(self._load_json_file(CORE_CONFIG_FILE)),
+            variable_variables=MappingProxyType(self._load_json_file(VARIABLE_CONFIG_FILE)),
+            file_stamps=stamps
+        )
+        self._snapshot = snapshot
+        return snapshot
+
+    def _write_json_atomic(self, filename: str, data: Dict) -> str:
+        """串行化地写入JSON：先写临时文件再重命名，读取方不会看到半写入的文件"""
+        config_path = os.path.join(self.config_dir, filename)
+        with self._lock:
+            fd, tmp_path = tempfile.mkstemp(dir=self.config_dir, prefix=f".{filename}.", suffix=".tmp")
+            try:
+                # mkstemp 创建的文件权限为0600，沿用原文件权限（新文件为0644）
+                try:
+                    permissions = stat.S_IMODE(os.stat(config_path).st_mode)
+                except OSError:
+                    permissions = 0o644
+                os.chmod(tmp_path, permissions)
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump(data, f, ensure_ascii=False, indent=2)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, config_path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+            if self._snapshot is not None:
+                self._rebuild_snapshot(force=True)
+        return config_path
     
     def _load_json_file(self, filename: str) -> Dict:
         """加载JSON文件"""
         filepath = os.path.join(self.config_dir, filename)
         try:
             with open(filepath, 'r', encoding='utf-8') as f:
-                return json.load(f)
+                data = json.load(f)
+            if not isinstance(data, dict):
+                raise ValueError(f"顶层应为对象，实际为 {type(data).__name__}")
+            return data
         except Exception as e:
             print(f"❌ 加载配置文件 {filename} 失败: {e}")
             # 如果是核心变量文件，返回默认配置
-            if filename == "core_variables.json":
+            if filename == CORE_CONFIG_FILE:
                 return self._get_default_core_config()
             else:
                 return self._get_default_variable_config()
@@ -278,10 +384,8 @@ class VariableProcessor:
     
     def validate_variable_selection(self, selections: Dict, variable_type: str) -> Dict:
         """验证变量选择"""
-        if variable_type == "core":
-            template = self.load_core_variables()
-        else:
-            template = self.load_variable_variables()
+        snapshot = self.get_snapshot()
+        template = snapshot.core_variables if variable_type == "core" else snapshot.variable_variables
         
         validated = {}
         
@@ -0,0 +1,211 @@
+"""
+加权随机选择工具模块
+
+从核心变量和可变变量配置中按权重随机抽取选项，批量生成多样化的变量组合。
+每个变量（以及每个一级选项下的二级选项）预先构建 Walker 别名表，
+抽样时每个变量只需一次均匀随机数和一次比较，整批抽样全部向量化。
+
+权重定义在可选的 configs/option_weights.json 中，未列出的选项权重为1：
+
+    {
+      "core_variables": {"appearance.hair_style": {"长发": 3, "短发": 2}},
+      "variable_variables": {
+        "state_action.expression": {"微笑": 4},
+        "state_action.expression/微笑": {"大笑": 2}
+      }
+    }
+
+其中 "类别.子类别/一级选项" 为该一级选项下二级选项的权重。
+"""
+
+import json
+import os
+import threading
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .variable_processor import variable_processor
+
+OPTION_WEIGHTS_FILE = "option_weights.json"
+
+
+class AliasTable(NamedTuple):
+    """Walker 别名表：落在第 i 格时以 prob[i] 的概率取 i，否则取 alias[i]"""
+    options: Tuple[str, ...]
+    prob: np.ndarray
+    alias: np.ndarray
+
+
+def build_alias_table(options: Sequence[str], weights: Sequence[float]) -> AliasTable:
+    """
+    用 Vose 方法构建别名表，O(n)
+
+    Args:
+        options: 选项
+        weights: 非负权重，全为0时按均匀分布处理
+    """
+    n = len(options)
+    weights = np.asarray(weights, dtype=np.float64)
+    if n == 0:
+        raise ValueError("选项列表为空")
+    if np.any(weights < 0):
+        raise ValueError("权重不能为负数")
+    total = weights.sum()
+    scaled = weights * n / total if total > 0 else np.ones(n)
+
+    prob = np.ones(n, dtype=np.float64)
+    alias = np.arange(n, dtype=np.int64)
+    small = [i for i in range(n) if scaled[i] < 1.0]
+    large = [i for i in range(n) if scaled[i] >= 1.0]
+    while small and large:
+        s, l = small.pop(), large.pop()
+        prob[s] = scaled[s]
+        alias[s] = l
+        scaled[l] -= 1.0 - scaled[s]
+        (small if scaled[l] < 1.0 else large).append(l)
+    # 剩余格子因浮点误差留下，概率均为1
+
+    return AliasTable(tuple(options), prob, alias)
+
+
+def draw_alias(table: AliasTable, rng: np.random.Generator, count: int) -> np.ndarray:
+    """从别名表中抽取 count 个选项下标"""
+    n = len(table.options)
+    cells = rng.integers(0, n, size=count)
+    keep = rng.random(count) < table.prob[cells]
+    return np.where(keep, cells, table.alias[cells])
+
+
+class _SamplerTables(NamedTuple):
+    """某个配置版本对应的全部别名表"""
+    key: Tuple
+    core: List[Tuple[str, str, AliasTable]]
+    variable: List[Tuple[str, str, AliasTable, Dict[str, AliasTable]]]
+
+
+class WeightedVariableSampler:
+    """加权变量抽样器"""
+
+    def __init__(self, config_dir: str = None):
+        if config_dir is None:
+            config_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "configs")
+        self.weights_path = os.path.join(config_dir, OPTION_WEIGHTS_FILE)
+        self._lock = threading.Lock()
+        self._tables: Optional[_SamplerTables] = None
+
+    def _weights_stamp(self) -> Optional[Tuple]:
+        try:
+            stat = os.stat(self.weights_path)
+            return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            return None
+
+    def load_weights(self) -> Dict:
+        """读取权重文件，文件不存在时返回空配置"""
+        if self._weights_stamp() is None:
+            return {}
+        try:
+            with open(self.weights_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"❌ 加载权重文件 {OPTION_WEIGHTS_FILE} 失败: {e}")
+            return {}
+
+    def tables(self) -> _SamplerTables:
+        """
+        获取当前配置版本的别名表
+
+        配置版本或权重文件变化时才重新构建，之后每次抽样都复用。
+        """
+        snapshot = variable_processor.get_snapshot()
+        key = (snapshot.version, self._weights_stamp())
+        tables = self._tables
+        if tables is not None and tables.key == key:
+            return tables
+        with self._lock:
+            if self._tables is None or self._tables.key != key:
+                self._tables = self._build_tables(key, snapshot)
+            return self._tables
+
+    def _build_tables(self, key: Tuple, snapshot) -> _SamplerTables:
+        weights = self.load_weights()
+        core_weights = weights.get("core_variables", {})
+        variable_weights = weights.get("variable_variables", {})
+
+        def table_for(options: Sequence[str], option_weights: Dict[str, float]) -> AliasTable:
+            return build_alias_table(options, [float(option_weights.get(option, 1.0)) for option in options])
+
+        core = []
+        for category, variables in snapshot.core_variables.items():
+            for var_name, options in variables.items():
+                if isinstance(options, list) and options:
+                    core.append((category, var_name, table_for(options, core_weights.get(f"{category}.{var_name}", {}))))
+
+        variable = []
+        for category, subcategories in snapshot.variable_variables.items():
+            for sub_name, levels in subcategories.items():
+                # 与可变变量选择器一致，只处理带一级选项的变量
+                if not isinstance(levels, dict) or not levels.get("一级"):
+                    continue
+                prefix = f"{category}.{sub_name}"
+                level1_table = table_for(levels["一级"], variable_weights.get(prefix, {}))
+                level2_tables = {}
+                level2_map = levels.get("二级", {})
+                if isinstance(level2_map, dict):
+                    for level1, level2_options in level2_map.items():
+                        if level2_options:
+                            level2_tables[level1] = table_for(
+                                level2_options, variable_weights.get(f"{prefix}/{level1}", {}))
+                variable.append((category, sub_name, level1_table, level2_tables))
+
+        return _SamplerTables(key, core, variable)
+
+    def sample(self, count: int, seed: int = 0, include_core: bool = True, include_variable: bool = True,
+               include_level2: bool = True) -> List[Dict[str, Dict]]:
+        """
+        抽取 count 组变量选择
+
+        Args:
+            count: 组数
+            seed: 随机种子，相同种子和配置得到相同结果
+            include_level2: 是否同时抽取二级选项（按抽中的一级选项条件抽样）
+
+        Returns:
+            List[Dict]: 每组为 {"core_variables": {...}, "variable_variables": {...}}，
+                格式与核心/可变变量选择器的输出相同
+        """
+        tables = self.tables()
+        rng = np.random.default_rng(seed)
+        selections = [{"core_variables": {}, "variable_variables": {}} for _ in range(count)]
+
+        if include_core:
+            for category, var_name, table in tables.core:
+                drawn = draw_alias(table, rng, count)
+                for selection, index in zip(selections, drawn):
+                    selection["core_variables"].setdefault(category, {})[var_name] = table.options[index]
+
+        if include_variable:
+            for category, sub_name, level1_table, level2_tables in tables.variable:
+                level1_drawn = draw_alias(level1_table, rng, count)
+                level2_values = [""] * count
+                if include_level2:
+                    # 按一级选项分组，每组在其二级别名表上一次抽完
+                    for index in np.unique(level1_drawn):
+                        table = level2_tables.get(level1_table.options[index])
+                        if table is None:
+                            continue
+                        rows = np.flatnonzero(level1_drawn == index)
+                        for row, level2_index in zip(rows, draw_alias(table, rng, len(rows))):
+                            level2_values[row] = table.options[level2_index]
+                for row, selection in enumerate(selections):
+                    selection["variable_variables"].setdefault(category, {})[sub_name] = {
+                        "一级": level1_table.options[level1_drawn[row]],
+                        "二级": level2_values[row]
+                    }
+
+        return selections
+
+
+# 创建全局实例
+weighted_sampler = WeightedVariableSampler()
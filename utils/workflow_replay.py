@@ -0,0 +1,531 @@
+"""
+工作流回放压测模块
+
+脱离ComfyUI执行 API 格式的工作流JSON（如 example_workflow.json），用于衡量整条流水线的性能：
+
+- 安装 comfy / folder_paths 桩模块，以插件包的形式导入 NODE_CLASS_MAPPINGS
+- CLIP视觉模型替换为一个小型的确定性 torch 模型，文本编码器替换为确定性的随机向量，
+  打分走真实的矩阵乘法路径
+- LoadImage 等ComfyUI内置节点替换为输出合成图像批次的桩节点
+- 按拓扑顺序执行节点图，多个线程并发回放，统计吞吐、延迟百分位、各节点耗时与峰值RSS
+
+运行方式（在插件根目录下）:
+    python -m utils.workflow_replay example_workflow.json --replays 200 --concurrency 4 --batch-size 4
+    python -m utils.workflow_replay example_workflow.json --output baseline.json
+    python -m utils.workflow_replay example_workflow.json --baseline baseline.json --tolerance 0.2
+
+指定 --baseline 时作为回归门禁：吞吐下降或 p99 延迟、峰值RSS 上升超过容差时以退出码1结束。
+"""
+
+import argparse
+import hashlib
+import importlib
+import importlib.util
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import types
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+
+PLUGIN_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGE_NAME = "character_labeler_replay"
+FAKE_CLIP_VISION_NAME = "fake_clip_vision.safetensors"
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+# ---- 桩模块与模拟模型 ----
+
+class FakeCLIPVisionModel(torch.nn.Module):
+    """
+    模拟的CLIP视觉模型：分块卷积 + 平均池化 + 投影
+
+    与ComfyUI的视觉模型调用方式相同：model(pixel_values=..., intermediate_output=-2)，
+    返回元组的第3项为图像嵌入。权重由种子确定，每次运行结果一致。
+    """
+
+    def __init__(self, dim: int = 512, width: int = 256, patch_size: int = 32, seed: int = 0):
+        super().__init__()
+        generator = torch.Generator().manual_seed(seed)
+        self.patch = torch.nn.Conv2d(3, width, patch_size, stride=patch_size)
+        self.proj = torch.nn.Linear(width, dim)
+        with torch.no_grad():
+            for parameter in self.parameters():
+                parameter.copy_(torch.randn(parameter.shape, generator=generator) * 0.05)
+
+    def forward(self, pixel_values: torch.Tensor, intermediate_output: int = None):
+        hidden = torch.tanh(self.patch(pixel_values).flatten(2).mean(-1))
+        return hidden, hidden, self.proj(hidden)
+
+
+class FakeCLIPVision:
+    """模拟的 comfy.clip_vision.ClipVisionModel"""
+
+    image_size = 224
+    image_mean = (0.48145466, 0.4578275, 0.40821073)
+    image_std = (0.26862954, 0.26130258, 0.27577711)
+
+    def __init__(self, dim: int = 512):
+        self.model = FakeCLIPVisionModel(dim).eval()
+        self.load_device = torch.device("cpu")
+        self.dim = dim
+
+
+def fake_text_encoder(dim: int = 512):
+    """按提示词哈希生成确定性单位向量的文本编码器"""
+    def encode_text(prompts: List[str]) -> np.ndarray:
+        vectors = np.empty((len(prompts), dim), dtype=np.float32)
+        for i, prompt in enumerate(prompts):
+            seed = int.from_bytes(hashlib.blake2b(prompt.encode("utf-8"), digest_size=8).digest(), "little")
+            vectors[i] = np.random.default_rng(seed).standard_normal(dim)
+        return vectors
+    return encode_text
+
+
+STUB_MODULE_NAMES = ("comfy", "comfy.clip_vision", "comfy.model_management", "folder_paths")
+
+
+def install_stub_modules(model_dir: str, dim: int = 512) -> Dict[str, Optional[types.ModuleType]]:
+    """
+    安装 comfy、comfy.clip_vision、comfy.model_management 与 folder_paths 桩模块
+
+    folder_paths 返回的模型路径指向 model_dir 下的空文件，加载得到 FakeCLIPVision。
+
+    Returns:
+        被替换的原模块（不存在时为 None），交给 restore_modules 恢复
+    """
+    replaced = {name: sys.modules.get(name) for name in STUB_MODULE_NAMES}
+    comfy = types.ModuleType("comfy")
+    clip_vision = types.ModuleType("comfy.clip_vision")
+    model_management = types.ModuleType("comfy.model_management")
+    clip_vision.load_clipvision = lambda path: FakeCLIPVision(dim)
+    model_management.load_model_gpu = lambda patcher: None
+    comfy.clip_vision = clip_vision
+    comfy.model_management = model_management
+
+    folder_paths = types.ModuleType("folder_paths")
+
+    def get_full_path(folder_name: str, filename: str) -> str:
+        path = os.path.join(model_dir, folder_name, filename)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if not os.path.exists(path):
+            open(path, "wb").close()
+        return path
+
+    folder_paths.get_filename_list = lambda folder_name: [FAKE_CLIP_VISION_NAME]
+    folder_paths.get_full_path = get_full_path
+    folder_paths.get_output_directory = lambda: os.path.join(model_dir, "output")
+    folder_paths.get_input_directory = lambda: os.path.join(model_dir, "input")
+
+    sys.modules.update({
+        "comfy": comfy,
+        "comfy.clip_vision": clip_vision,
+        "comfy.model_management": model_management,
+        "folder_paths": folder_paths,
+    })
+    return replaced
+
+
+def restore_modules(replaced: Dict[str, Optional[types.ModuleType]]):
+    """恢复 install_stub_modules 替换的模块"""
+    for name, module in replaced.items():
+        if module is None:
+            sys.modules.pop(name, None)
+        else:
+            sys.modules[name] = module
+
+
+def unload_plugin(package_name: str = PACKAGE_NAME):
+    """移除 load_plugin 导入的包及其子模块"""
+    for name in [name for name in sys.modules if name == package_name or name.startswith(f"{package_name}.")]:
+        del sys.modules[name]
+
+
+def load_plugin(root: str = PLUGIN_ROOT, package_name: str = PACKAGE_NAME) -> types.ModuleType:
+    """以包的形式导入插件（nodes.py 使用相对导入），需先安装桩模块"""
+    if package_name in sys.modules:
+        return sys.modules[package_name]
+    spec = importlib.util.spec_from_file_location(
+        package_name, os.path.join(root, "__init__.py"), submodule_search_locations=[root])
+    package = importlib.util.module_from_spec(spec)
+    sys.modules[package_name] = package
+    spec.loader.exec_module(package)
+    return package
+
+
+# ---- ComfyUI内置节点的桩 ----
+
+class SyntheticLoadImage:
+    """LoadImage 桩：输出回放时提供的合成图像批次"""
+
+    RETURN_TYPES = ("IMAGE", "MASK")
+    FUNCTION = "load_image"
+
+    def __init__(self):
+        self.images: Optional[torch.Tensor] = None
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {"required": {"image": ("STRING", {"default": ""})}}
+
+    def load_image(self, image=""):
+        batch, height, width, _ = self.images.shape
+        return (self.images, torch.zeros((batch, height, width), dtype=torch.float32))
+
+
+class DiscardImage:
+    """SaveImage / PreviewImage 桩：不写文件"""
+
+    RETURN_TYPES = ()
+    FUNCTION = "discard"
+    OUTPUT_NODE = True
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {"required": {"images": ("IMAGE",)}}
+
+    def discard(self, images, **kwargs):
+        return ()
+
+
+BUILTIN_STUBS = {
+    "LoadImage": SyntheticLoadImage,
+    "SaveImage": DiscardImage,
+    "PreviewImage": DiscardImage,
+}
+
+
+# ---- 节点图 ----
+
+def _default_value(spec: Tuple) -> Any:
+    """INPUT_TYPES 中某个输入的默认值：选项列表取 default 或第一项，其他类型取 default"""
+    kind = spec[0]
+    options = spec[1] if len(spec) > 1 and isinstance(spec[1], dict) else {}
+    if isinstance(kind, (list, tuple)):
+        return options.get("default", kind[0] if kind else None)
+    if "default" in options:
+        return options["default"]
+    raise KeyError("缺少必需的连接输入")
+
+
+class WorkflowGraph:
+    """API 格式工作流的可执行节点图"""
+
+    def __init__(self, workflow: Dict, node_classes: Dict[str, type]):
+        if "nodes" in workflow and "links" in workflow:
+            raise ValueError("只支持API格式的工作流（ComfyUI 中使用 Save (API Format) 导出）")
+        self.node_classes = node_classes
+        self.nodes: Dict[str, Dict] = {str(node_id): node for node_id, node in workflow.items()}
+
+        missing = sorted({node["class_type"] for node in self.nodes.values()} - set(node_classes))
+        if missing:
+            raise ValueError(f"未知的节点类型: {', '.join(missing)}")
+
+        # 每个节点的常量参数（补全未填写的必需输入）与连接输入，只解析一次
+        self.constants: Dict[str, Dict[str, Any]] = {}
+        self.links: Dict[str, Dict[str, Tuple[str, int]]] = {}
+        for node_id, node in self.nodes.items():
+            constants, links = {}, {}
+            for name, value in node.get("inputs", {}).items():
+                if isinstance(value, list) and len(value) == 2 and isinstance(value[1], int):
+                    if str(value[0]) not in self.nodes:
+                        raise ValueError(f"节点 {node_id} 的输入 {name} 连接到不存在的节点 {value[0]}")
+                    links[name] = (str(value[0]), value[1])
+                else:
+                    constants[name] = value
+            input_types = node_classes[node["class_type"]].INPUT_TYPES()
+            for name, spec in input_types.get("required", {}).items():
+                if name not in constants and name not in links:
+                    try:
+                        constants[name] = _default_value(spec)
+                    except KeyError:
+                        raise ValueError(f"节点 {node_id}（{node['class_type']}）缺少必需输入: {name}")
+            for name, kind in input_types.get("hidden", {}).items():
+                if kind == "UNIQUE_ID":
+                    constants[name] = node_id
+            self.constants[node_id] = constants
+            self.links[node_id] = links
+
+        self.order = self._topological_order()
+
+        # 不依赖图像输入的节点（加载器、变量选择器等）在ComfyUI中只在参数变化时执行，回放时也只执行一次
+        dynamic = set()
+        for node_id in self.order:
+            if node_classes[self.nodes[node_id]["class_type"]] is SyntheticLoadImage or \
+                    any(source in dynamic for source, _ in self.links[node_id].values()):
+                dynamic.add(node_id)
+        self.static = frozenset(self.order) - dynamic
+
+    def _topological_order(self) -> List[str]:
+        """Kahn 算法；同一层内按节点编号排序，保证执行顺序稳定"""
+        indegree = {node_id: 0 for node_id in self.nodes}
+        dependents = defaultdict(list)
+        for node_id, links in self.links.items():
+            for source, _ in set(links.values()):
+                indegree[node_id] += 1
+                dependents[source].append(node_id)
+
+        def sort_key(node_id: str):
+            return (0, int(node_id)) if node_id.isdigit() else (1, node_id)
+
+        ready = sorted((node_id for node_id, degree in indegree.items() if degree == 0), key=sort_key)
+        order = []
+        while ready:
+            node_id = ready.pop(0)
+            order.append(node_id)
+            for dependent in dependents[node_id]:
+                indegree[dependent] -= 1
+                if indegree[dependent] == 0:
+                    ready.append(dependent)
+            ready.sort(key=sort_key)
+        if len(order) != len(self.nodes):
+            raise ValueError("工作流中存在循环连接")
+        return order
+
+    def instantiate(self) -> Dict[str, Any]:
+        """为一个回放线程创建全部节点实例（与ComfyUI相同，每个节点一个实例）"""
+        return {node_id: self.node_classes[self.nodes[node_id]["class_type"]]() for node_id in self.order}
+
+    def execute(self, instances: Dict[str, Any], images: torch.Tensor, node_times: Dict[str, float],
+                cache: Optional[Dict[str, Tuple]] = None) -> Dict[str, Tuple]:
+        """
+        按拓扑顺序执行一次
+
+        Args:
+            images: 提供给 LoadImage 桩的图像批次
+            node_times: 按节点类型累加耗时（秒）
+            cache: 不依赖图像的节点的输出缓存（与ComfyUI的输出缓存相同）；为 None 时每次都执行全部节点
+        """
+        outputs: Dict[str, Tuple] = {}
+        for node_id in self.order:
+            if cache is not None and node_id in cache:
+                outputs[node_id] = cache[node_id]
+                continue
+            instance = instances[node_id]
+            if isinstance(instance, SyntheticLoadImage):
+                instance.images = images
+            kwargs = dict(self.constants[node_id])
+            for name, (source, index) in self.links[node_id].items():
+                kwargs[name] = outputs[source][index]
+            start = time.perf_counter()
+            result = getattr(instance, instance.FUNCTION)(**kwargs)
+            node_times[self.nodes[node_id]["class_type"]] += time.perf_counter() - start
+            outputs[node_id] = result if isinstance(result, tuple) else tuple(result.get("result", ()))
+            if cache is not None and node_id in self.static:
+                cache[node_id] = outputs[node_id]
+        return outputs
+
+
+# ---- 回放 ----
+
+def peak_rss_bytes() -> Optional[int]:
+    """进程峰值常驻内存（Linux 上 ru_maxrss 单位为KB，macOS 为字节）"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def synthetic_batches(count: int, batch_size: int, height: int, width: int, seed: int = 0) -> List[torch.Tensor]:
+    """生成 count 个 [B, H, W, 3] 的合成图像批次（渐变 + 噪声，避免全随机图像过于单一）"""
+    generator = torch.Generator().manual_seed(seed)
+    ramp_y = torch.linspace(0, 1, height)[:, None, None]
+    ramp_x = torch.linspace(0, 1, width)[None, :, None]
+    batches = []
+    for _ in range(count):
+        colors = torch.rand((batch_size, 1, 1, 3), generator=generator)
+        noise = torch.rand((batch_size, height, width, 3), generator=generator)
+        batches.append((0.5 * colors + 0.25 * (ramp_y + ramp_x) / 2 + 0.25 * noise).clamp(0, 1))
+    return batches
+
+
+def replay(workflow: Dict, replays: int = 100, concurrency: int = 1, batch_size: int = 1,
+           height: int = 512, width: int = 512, warmup: int = 2, dim: int = 512, seed: int = 0,
+           cache_static: bool = True) -> Dict:
+    """
+    并发回放工作流并统计性能
+
+    Args:
+        replays: 计入统计的回放次数（不含预热）
+        concurrency: 并发回放的线程数，每个线程使用各自的节点实例
+        warmup: 每个线程开始计时前的预热次数（首次加载、文本嵌入构建等）
+        cache_static: 不依赖图像的节点只执行一次（与ComfyUI的输出缓存一致）；为 False 时每次全部重新执行
+
+    Returns:
+        Dict: 吞吐、延迟百分位（毫秒）、各节点平均耗时与峰值RSS
+    """
+    # 桩模块、本次导入的插件包与文本编码器都在结束后恢复，临时模型目录随之删除
+    with tempfile.TemporaryDirectory(prefix="workflow_replay_") as model_dir:
+        replaced = install_stub_modules(model_dir, dim)
+        plugin_loaded = PACKAGE_NAME in sys.modules
+        try:
+            package = load_plugin()
+            analyzer = importlib.import_module(f"{package.__name__}.utils.clip_analyzer").clip_analyzer
+            previous_encoder = (analyzer._text_encoder, analyzer._text_encoder_key)
+            analyzer.set_text_encoder(fake_text_encoder(dim), f"workflow_replay_{dim}")
+            try:
+                graph = WorkflowGraph(workflow, {**BUILTIN_STUBS, **package.NODE_CLASS_MAPPINGS})
+                batches = synthetic_batches(max(4, concurrency), batch_size, height, width, seed)
+                report = _measure(graph, batches, replays, concurrency, warmup, cache_static)
+            finally:
+                analyzer.set_text_encoder(*previous_encoder)
+        finally:
+            if not plugin_loaded:
+                unload_plugin()
+            restore_modules(replaced)
+    return report
+
+
+def _measure(graph: WorkflowGraph, batches: List[torch.Tensor], replays: int, concurrency: int, warmup: int,
+             cache_static: bool) -> Dict:
+    """并发执行节点图并汇总耗时，batches 为 [B, H, W, 3] 的图像批次"""
+    batch_size, height, width = batches[0].shape[:3]
+
+    latencies: List[float] = []
+    node_times: Dict[str, float] = defaultdict(float)
+    lock = threading.Lock()
+    counter = iter(range(replays))
+    # 全部线程预热完成后才开始计时
+    started = threading.Barrier(concurrency + 1)
+
+    def worker(worker_id: int):
+        try:
+            instances = graph.instantiate()
+            cache = {} if cache_static else None
+            for i in range(warmup):
+                graph.execute(instances, batches[(worker_id + i) % len(batches)], defaultdict(float), cache)
+        except BaseException:
+            started.abort()
+            raise
+        started.wait()
+
+        local_times: Dict[str, float] = defaultdict(float)
+        local_latencies = []
+        while True:
+            with lock:
+                index = next(counter, None)
+            if index is None:
+                break
+            start = time.perf_counter()
+            graph.execute(instances, batches[index % len(batches)], local_times, cache)
+            local_latencies.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(local_latencies)
+            for class_type, seconds in local_times.items():
+                node_times[class_type] += seconds
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [pool.submit(worker, worker_id) for worker_id in range(concurrency)]
+        try:
+            started.wait()
+        except threading.BrokenBarrierError:
+            pass
+        start = time.perf_counter()
+        for future in futures:
+            future.result()
+    wall = time.perf_counter() - start
+
+    latencies_ms = np.asarray(latencies) * 1000
+    peak = peak_rss_bytes()
+    return {
+        "workflow_nodes": [graph.nodes[node_id]["class_type"] for node_id in graph.order],
+        "cached_nodes": sorted(graph.nodes[node_id]["class_type"] for node_id in graph.static) if cache_static else [],
+        "replays": len(latencies),
+        "concurrency": concurrency,
+        "batch_size": batch_size,
+        "resolution": [height, width],
+        "wall_seconds": wall,
+        "throughput_replays_per_s": len(latencies) / wall if wall > 0 else 0.0,
+        "throughput_images_per_s": len(latencies) * batch_size / wall if wall > 0 else 0.0,
+        "latency_ms": {
+            "p50": float(np.percentile(latencies_ms, 50)),
+            "p90": float(np.percentile(latencies_ms, 90)),
+            "p99": float(np.percentile(latencies_ms, 99)),
+            "max": float(latencies_ms.max()),
+        },
+        "node_mean_ms": {class_type: seconds * 1000 / len(latencies) for class_type, seconds in
+                         sorted(node_times.items(), key=lambda item: item[1], reverse=True)},
+        "peak_rss_mb": peak / (1 << 20) if peak is not None else None,
+    }
+
+
+def check_regression(report: Dict, baseline: Dict, tolerance: float = 0.2) -> List[str]:
+    """
+    与基准报告比较，返回超出容差的指标说明（为空表示通过）
+
+    吞吐允许下降 tolerance，p99 延迟与峰值RSS允许上升 tolerance。
+    """
+    failures = []
+    current, reference = report["throughput_images_per_s"], baseline["throughput_images_per_s"]
+    if current < reference * (1 - tolerance):
+        failures.append(f"吞吐 {current:.1f} 图/秒 低于基准 {reference:.1f} 图/秒")
+    current, reference = report["latency_ms"]["p99"], baseline["latency_ms"]["p99"]
+    if current > reference * (1 + tolerance):
+        failures.append(f"p99延迟 {current:.1f}ms 高于基准 {reference:.1f}ms")
+    current, reference = report.get("peak_rss_mb"), baseline.get("peak_rss_mb")
+    if current is not None and reference is not None and current > reference * (1 + tolerance):
+        failures.append(f"峰值RSS {current:.0f}MB 高于基准 {reference:.0f}MB")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="脱离ComfyUI回放工作流并测量整条流水线的性能")
+    parser.add_argument("workflow", help="API格式的工作流JSON")
+    parser.add_argument("--replays", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--height", type=int, default=512)
+    parser.add_argument("--width", type=int, default=512)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--dim", type=int, default=512, help="模拟CLIP模型的嵌入维度")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-cache", action="store_true", help="每次回放都重新执行不依赖图像的节点")
+    parser.add_argument("--output", default=None, help="把报告写入JSON文件（可作为之后的基准）")
+    parser.add_argument("--baseline", default=None, help="基准报告；超出容差时以退出码1结束")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    with open(args.workflow, 'r', encoding='utf-8') as f:
+        workflow = json.load(f)
+    report = replay(workflow, replays=args.replays, concurrency=args.concurrency, batch_size=args.batch_size,
+                    height=args.height, width=args.width, warmup=args.warmup, dim=args.dim, seed=args.seed,
+                    cache_static=not args.no_cache)
+
+    latency = report["latency_ms"]
+    print(f"📊 回放 {report['replays']} 次（并发 {report['concurrency']}，批大小 {report['batch_size']}）")
+    print(f"   吞吐: {report['throughput_replays_per_s']:.1f} 次/秒，{report['throughput_images_per_s']:.1f} 图/秒")
+    print(f"   延迟: p50 {latency['p50']:.2f}ms，p90 {latency['p90']:.2f}ms，"
+          f"p99 {latency['p99']:.2f}ms，最大 {latency['max']:.2f}ms")
+    if report["peak_rss_mb"] is not None:
+        print(f"   峰值RSS: {report['peak_rss_mb']:.0f}MB")
+    for class_type, mean_ms in report["node_mean_ms"].items():
+        print(f"   - {class_type}: {mean_ms:.2f}ms")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        failures = check_regression(report, baseline, args.tolerance)
+        if failures:
+            for failure in failures:
+                print(f"❌ {failure}")
+            sys.exit(1)
+        print(f"✅ 性能在基准的 ±{args.tolerance:.0%} 范围内")
+
+
+if __name__ == "__main__":
+    main()